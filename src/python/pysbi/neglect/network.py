@@ -3,7 +3,7 @@ from brian.library.IF import exp_IF
 from brian.library.synapses import exp_synapse, biexp_synapse
 
 # Default parameters
-from pysbi.util.utils import init_connection
+from pysbi.util.utils import init_rand_weight_connection
 import numpy as np
 
 class LIP():
@@ -58,63 +58,71 @@ class LIP():
     def init_connectivity(self):
         # Init connections from contralaterally tuned pyramidal cells to other
         # contralaterally tuned pyramidal cells in the same hemisphere
-        self.connections.append(init_connection(self.e_contra_mem, self.e_contra_mem, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ec_mem_ec_mem, delay=5*ms, allow_self_conn=False))
-        self.connections.append(init_connection(self.e_contra_mem, self.e_contra_mem, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ec_mem_ec_mem, delay=5*ms, allow_self_conn=False))
-
-        self.connections.append(init_connection(self.e_contra_vis, self.e_contra_vis, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ec_vis_ec_vis, delay=5*ms, allow_self_conn=False))
-        self.connections.append(init_connection(self.e_contra_vis, self.e_contra_vis, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ec_vis_ec_vis, delay=5*ms, allow_self_conn=False))
-
-        ec_vis_ec_mem_ampa=init_connection(self.e_contra_vis, self.e_contra_mem, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ec_vis_ec_mem, delay=5*ms)
-        ec_vis_ec_mem_nmda=init_connection(self.e_contra_vis, self.e_contra_mem, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ec_vis_ec_mem, delay=5*ms)
+        self.connections.append(init_rand_weight_connection(self.e_contra_mem, self.e_contra_mem, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_mem_ec_mem, delay=5*ms,
+            allow_self_conn=False))
+        self.connections.append(init_rand_weight_connection(self.e_contra_mem, self.e_contra_mem, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ec_mem_ec_mem, delay=5*ms,
+            allow_self_conn=False))
+
+        self.connections.append(init_rand_weight_connection(self.e_contra_vis, self.e_contra_vis, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ec_vis, delay=5*ms,
+            allow_self_conn=False))
+        self.connections.append(init_rand_weight_connection(self.e_contra_vis, self.e_contra_vis, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ec_vis_ec_vis, delay=5*ms,
+            allow_self_conn=False))
+
+        ec_vis_ec_mem_ampa=init_rand_weight_connection(self.e_contra_vis, self.e_contra_mem, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ec_mem, delay=5*ms)
+        ec_vis_ec_mem_nmda=init_rand_weight_connection(self.e_contra_vis, self.e_contra_mem, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ec_vis_ec_mem, delay=5*ms)
         self.connections.append(ec_vis_ec_mem_ampa)
         self.connections.append(ec_vis_ec_mem_nmda)
 
         # Init connections from ipsilaterally tuned interneurons to contralaterally
         # tuned pyramidal cells in the same hemisphere
-        ii_ec_gabaa=init_connection(self.i_ipsi, self.e_contra, 'g_gaba_a', self.params.w_gaba_a_min,
+        ii_ec_gabaa=init_rand_weight_connection(self.i_ipsi, self.e_contra, 'g_gaba_a', self.params.w_gaba_a_min,
             self.params.w_gaba_a_max, self.params.p_ii_ec, delay=5*ms)
-        ii_ec_gabab=init_connection(self.i_ipsi, self.e_contra, 'g_gaba_b', self.params.w_gaba_b_min,
+        ii_ec_gabab=init_rand_weight_connection(self.i_ipsi, self.e_contra, 'g_gaba_b', self.params.w_gaba_b_min,
             self.params.w_gaba_b_max, self.params.p_ii_ec, delay=5*ms)
         self.connections.append(ii_ec_gabaa)
         self.connections.append(ii_ec_gabab)
 
         # Init connections from ipsilaterally tuned pyramidal cells to other
         # ipsilaterally tuned pyramidal cells in the same hemisphere
-        self.connections.append(init_connection(self.e_ipsi_mem, self.e_ipsi_mem, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ei_mem_ei_mem, delay=5*ms, allow_self_conn=False))
-        self.connections.append(init_connection(self.e_ipsi_mem, self.e_ipsi_mem, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ei_mem_ei_mem, delay=5*ms, allow_self_conn=False))
-
-        self.connections.append(init_connection(self.e_ipsi_vis, self.e_ipsi_vis, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ei_vis_ei_vis, delay=5*ms, allow_self_conn=False))
-        self.connections.append(init_connection(self.e_ipsi_vis, self.e_ipsi_vis, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ei_vis_ei_vis, delay=5*ms, allow_self_conn=False))
-
-        ei_vis_ei_mem_ampa=init_connection(self.e_ipsi_vis, self.e_ipsi_mem, 'g_ampa_r', self.params.w_ampa_min,
-            self.params.w_ampa_max, self.params.p_ei_vis_ei_mem, delay=5*ms)
-        ei_vis_ei_mem_nmda=init_connection(self.e_ipsi_vis, self.e_ipsi_mem, 'g_nmda', self.params.w_nmda_min,
-            self.params.w_nmda_max, self.params.p_ei_vis_ei_mem, delay=5*ms)
+        self.connections.append(init_rand_weight_connection(self.e_ipsi_mem, self.e_ipsi_mem, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ei_mem_ei_mem, delay=5*ms,
+            allow_self_conn=False))
+        self.connections.append(init_rand_weight_connection(self.e_ipsi_mem, self.e_ipsi_mem, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ei_mem_ei_mem, delay=5*ms,
+            allow_self_conn=False))
+
+        self.connections.append(init_rand_weight_connection(self.e_ipsi_vis, self.e_ipsi_vis, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ei_vis_ei_vis, delay=5*ms,
+            allow_self_conn=False))
+        self.connections.append(init_rand_weight_connection(self.e_ipsi_vis, self.e_ipsi_vis, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ei_vis_ei_vis, delay=5*ms,
+            allow_self_conn=False))
+
+        ei_vis_ei_mem_ampa=init_rand_weight_connection(self.e_ipsi_vis, self.e_ipsi_mem, 'g_ampa_r',
+            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ei_vis_ei_mem, delay=5*ms)
+        ei_vis_ei_mem_nmda=init_rand_weight_connection(self.e_ipsi_vis, self.e_ipsi_mem, 'g_nmda',
+            self.params.w_nmda_min, self.params.w_nmda_max, self.params.p_ei_vis_ei_mem, delay=5*ms)
         self.connections.append(ei_vis_ei_mem_ampa)
         self.connections.append(ei_vis_ei_mem_nmda)
 
         # Init connections from contralaterally tuned interneurons to ipsilaterally
         # tuned pyramidal cells in the same hemisphere
-        ic_ei_gabaa=init_connection(self.i_contra, self.e_ipsi, 'g_gaba_a', self.params.w_gaba_a_min,
+        ic_ei_gabaa=init_rand_weight_connection(self.i_contra, self.e_ipsi, 'g_gaba_a', self.params.w_gaba_a_min,
             self.params.w_gaba_a_max, self.params.p_ic_ei, delay=5*ms)
-        ic_ei_gabab=init_connection(self.i_contra, self.e_ipsi, 'g_gaba_b', self.params.w_gaba_b_min,
+        ic_ei_gabab=init_rand_weight_connection(self.i_contra, self.e_ipsi, 'g_gaba_b', self.params.w_gaba_b_min,
             self.params.w_gaba_b_max, self.params.p_ic_ei, delay=5*ms)
         self.connections.append(ic_ei_gabaa)
         self.connections.append(ic_ei_gabab)
 
         # Init connections from ipsilaterally tuned pyramidal cells to ipsilaterally
         # tuned interneurons in the same hemisphere
-        ei_ii_ampa=init_connection(self.e_ipsi, self.i_ipsi, 'g_ampa_r', self.params.w_ampa_min,
+        ei_ii_ampa=init_rand_weight_connection(self.e_ipsi, self.i_ipsi, 'g_ampa_r', self.params.w_ampa_min,
             self.params.w_ampa_max, self.params.p_ei_ii, delay=5*ms)
         #ei_ii_nmda=DelayConnection(self.e_ipsi, self.i_ipsi, 'g_nmda', sparseness=self.params.p_ei_ii,
         #    weight=self.params.w_nmda_max, delay=delay=5*ms)
@@ -125,7 +133,7 @@ class LIP():
 
         # Init connections from contralaterally tuned pyramidal cells to
         # contralaterally tuned interneurons in the same hemisphere
-        ec_ic_ampa=init_connection(self.e_contra, self.i_contra, 'g_ampa_r', self.params.w_ampa_min,
+        ec_ic_ampa=init_rand_weight_connection(self.e_contra, self.i_contra, 'g_ampa_r', self.params.w_ampa_min,
             self.params.w_ampa_max, self.params.p_ec_ic, delay=5*ms)
         #ec_ic_nmda=DelayConnection(self.e_contra, self.i_contra, 'g_nmda', sparseness=self.params.p_ec_ic,
         #    weight=self.params.w_nmda_max, delay=delay=5*ms)
@@ -204,31 +212,31 @@ class BrainNetworkGroup(NeuronGroup):
 
         if self.background_inputs is not None:
             # Background -> E+I population connections
-            background_left_ampa=init_connection(self.background_inputs[0], self.left_lip.neuron_group, 'g_ampa_b',
-                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_b_e, delay=5*ms)
-            background_right_ampa=init_connection(self.background_inputs[1], self.right_lip.neuron_group, 'g_ampa_b',
-                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_b_e, delay=5*ms)
+            background_left_ampa=init_rand_weight_connection(self.background_inputs[0], self.left_lip.neuron_group,
+                'g_ampa_b', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_b_e, delay=5*ms)
+            background_right_ampa=init_rand_weight_connection(self.background_inputs[1], self.right_lip.neuron_group,
+                'g_ampa_b', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_b_e, delay=5*ms)
             self.connections.append(background_left_ampa)
             self.connections.append(background_right_ampa)
 
         if self.visual_cortex_input is not None:
             # Task input -> E population connections
-            vc_left_lip_ampa=init_connection(self.visual_cortex_input[0], self.left_lip.e_contra_vis, 'g_ampa_x',
-                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_v_ec_vis, delay=270*ms)
-            vc_right_lip_ampa=init_connection(self.visual_cortex_input[1], self.right_lip.e_contra_vis, 'g_ampa_x',
-                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_v_ec_vis, delay=270*ms)
+            vc_left_lip_ampa=init_rand_weight_connection(self.visual_cortex_input[0], self.left_lip.e_contra_vis,
+                'g_ampa_x', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_v_ec_vis, delay=270*ms)
+            vc_right_lip_ampa=init_rand_weight_connection(self.visual_cortex_input[1], self.right_lip.e_contra_vis,
+                'g_ampa_x', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_v_ec_vis, delay=270*ms)
             self.connections.append(vc_left_lip_ampa)
             self.connections.append(vc_right_lip_ampa)
 
         if self.go_input is not None:
-            go_left_lip_i_ampa=init_connection(self.go_input, self.left_lip.i_group, 'g_ampa_g', self.params.w_ampa_min,
-                self.params.w_ampa_max, self.params.p_g_i, delay=5*ms)
-            go_right_lip_i_ampa=init_connection(self.go_input, self.right_lip.i_group, 'g_ampa_g', self.params.w_ampa_min,
-                self.params.w_ampa_max, self.params.p_g_i, delay=5*ms)
-            go_left_lip_e_ampa=init_connection(self.go_input, self.left_lip.e_group, 'g_ampa_g', self.params.w_ampa_min,
-                self.params.w_ampa_max, self.params.p_g_e, delay=5*ms)
-            go_right_lip_e_ampa=init_connection(self.go_input, self.right_lip.e_group, 'g_ampa_g', self.params.w_ampa_min,
-                self.params.w_ampa_max, self.params.p_g_e, delay=5*ms)
+            go_left_lip_i_ampa=init_rand_weight_connection(self.go_input, self.left_lip.i_group, 'g_ampa_g',
+                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_g_i, delay=5*ms)
+            go_right_lip_i_ampa=init_rand_weight_connection(self.go_input, self.right_lip.i_group, 'g_ampa_g',
+                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_g_i, delay=5*ms)
+            go_left_lip_e_ampa=init_rand_weight_connection(self.go_input, self.left_lip.e_group, 'g_ampa_g',
+                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_g_e, delay=5*ms)
+            go_right_lip_e_ampa=init_rand_weight_connection(self.go_input, self.right_lip.e_group, 'g_ampa_g',
+                self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_g_e, delay=5*ms)
             self.connections.append(go_left_lip_i_ampa)
             self.connections.append(go_right_lip_i_ampa)
             self.connections.append(go_left_lip_e_ampa)
@@ -254,21 +262,21 @@ class BrainNetworkGroup(NeuronGroup):
     def init_connectivity(self):
         # Init connections from contralaterally tuned neurons in the opposite
         # hemisphere to ipsilaterally tuned neurons in this hemisphere
-        left_ec_vis_ei_vis_ampa=init_connection(self.right_lip.e_contra_vis, self.left_lip.e_ipsi_vis, 'g_ampa_r',
-            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ei_vis, delay=20*ms)
+        left_ec_vis_ei_vis_ampa=init_rand_weight_connection(self.right_lip.e_contra_vis, self.left_lip.e_ipsi_vis,
+            'g_ampa_r', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ei_vis, delay=20*ms)
         #left_ec_ei_nmda=DelayConnection(self.right_lip.e_contra, self.left_lip.e_ipsi, 'g_nmda',
         #    sparseness=self.params.p_ec_ei, weight=self.params.w_nmda_max, delay=(10*ms, 20*ms))
         self.connections.append(left_ec_vis_ei_vis_ampa)
         #self.connections.append(left_ec_ei_nmda)
 
-        left_ec_mem_ei_mem_ampa=init_connection(self.right_lip.e_contra_mem, self.left_lip.e_ipsi_mem, 'g_ampa_r',
-            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_mem_ei_mem, delay=20*ms)
+        left_ec_mem_ei_mem_ampa=init_rand_weight_connection(self.right_lip.e_contra_mem, self.left_lip.e_ipsi_mem,
+            'g_ampa_r', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_mem_ei_mem, delay=20*ms)
         self.connections.append(left_ec_mem_ei_mem_ampa)
 
 
         # Init connections from contralaterally tuned pyramidal cells in the opposite
         # hemisphere to ipsilaterally tuned interneurons in this hemisphere
-        left_ec_ii_ampa=init_connection(self.right_lip.e_contra, self.left_lip.i_ipsi, 'g_ampa_r',
+        left_ec_ii_ampa=init_rand_weight_connection(self.right_lip.e_contra, self.left_lip.i_ipsi, 'g_ampa_r',
             self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_ii, delay=20*ms)
         #left_ec_ii_nmda=DelayConnection(self.right_lip.e_contra, self.left_lip.i_ipsi, 'g_nmda',
         #    sparseness=self.params.p_ec_ii, weight=self.params.w_nmda_max, delay=(10*ms, 20*ms))
@@ -277,20 +285,20 @@ class BrainNetworkGroup(NeuronGroup):
 
         # Init connections from contralaterally tuned neurons in the opposite
         # hemisphere to ipsilaterally tuned neurons in this hemisphere
-        right_ec_vis_ei_vis_ampa=init_connection(self.left_lip.e_contra_vis, self.right_lip.e_ipsi_vis, 'g_ampa_r',
-            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ei_vis, delay=20*ms)
+        right_ec_vis_ei_vis_ampa=init_rand_weight_connection(self.left_lip.e_contra_vis, self.right_lip.e_ipsi_vis,
+            'g_ampa_r', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_vis_ei_vis, delay=20*ms)
         #right_ec_ei_nmda=DelayConnection(self.left_lip.e_contra, self.right_lip.e_ipsi, 'g_nmda',
         #    sparseness=self.params.p_ec_ei, weight=self.params.w_nmda_max, delay=(10*ms, 20*ms))
         self.connections.append(right_ec_vis_ei_vis_ampa)
         #self.connections.append(right_ec_ei_nmda)
 
-        right_ec_mem_ei_mem_ampa=init_connection(self.left_lip.e_contra_mem, self.right_lip.e_ipsi_mem, 'g_ampa_r',
-            self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_mem_ei_mem, delay=20*ms)
+        right_ec_mem_ei_mem_ampa=init_rand_weight_connection(self.left_lip.e_contra_mem, self.right_lip.e_ipsi_mem,
+            'g_ampa_r', self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_mem_ei_mem, delay=20*ms)
         self.connections.append(right_ec_mem_ei_mem_ampa)
 
         # Init connections from contralaterally tuned pyramidal cells in the opposite
         # hemisphere to ipsilaterally tuned interneurons in this hemisphere
-        right_ec_ii_ampa=init_connection(self.left_lip.e_contra, self.right_lip.i_ipsi, 'g_ampa_r',
+        right_ec_ii_ampa=init_rand_weight_connection(self.left_lip.e_contra, self.right_lip.i_ipsi, 'g_ampa_r',
             self.params.w_ampa_min, self.params.w_ampa_max, self.params.p_ec_ii, delay=20*ms)
         #right_ec_ii_nmda=DelayConnection(self.left_lip.e_contra, self.right_lip.i_ipsi, 'g_nmda',
         #    sparseness=self.params.p_ec_ii, weight=self.params.w_nmda_max, delay=(10*ms, 20*ms))
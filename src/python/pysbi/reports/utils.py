@@ -1,8 +1,11 @@
 import copy
 from exceptions import Exception
 from glob import glob
+import hashlib
 import os
 from shutil import copytree, copyfile
+import sys
+import h5py
 import numpy as np
 from pysbi.config import TEMPLATE_DIR
 
@@ -20,7 +23,9 @@ def get_local_average(dict, param_array):
     return np.mean(values)
 
 
-def all_trials_exist(file_prefix, contrast_range, num_trials):
+def all_trials_exist(file_prefix, contrast_range, num_trials, store=None):
+    if store is not None:
+        return store.all_trials_exist(file_prefix, contrast_range, num_trials)
     for contrast in contrast_range:
         for i in range(num_trials):
             fname='%s.contrast.%0.4f.trial.%d.h5' % (file_prefix, contrast, i)
@@ -29,9 +34,14 @@ def all_trials_exist(file_prefix, contrast_range, num_trials):
     return True
 
 
-def get_tested_param_combos(data_dir, num_groups, trial_duration, contrast_range, num_trials, edesc):
+def get_tested_param_combos(data_dir, num_groups, trial_duration, contrast_range, num_trials, edesc, store=None):
+    if store is not None:
+        # Trial files are listed in the store index - prefixes are checked instead of every file in the directory
+        files=['%s.contrast.0.0000.trial.0.h5' % prefix for prefix in store.get_prefixes()]
+    else:
+        files=os.listdir(data_dir)
     param_combos=[]
-    for file in os.listdir(data_dir):
+    for file in files:
         if file.endswith('.h5'):
             file_split=file.split('.')
             p_b_e=float('%s.%s' % (file_split[7],file_split[8]))
@@ -45,12 +55,89 @@ def get_tested_param_combos(data_dir, num_groups, trial_duration, contrast_range
                       (num_groups, trial_duration, p_b_e, p_x_e, p_e_e, p_e_i, p_i_i, p_i_e, edesc)
             file_prefix=os.path.join(data_dir,file_desc)
             param_tuple=(p_b_e,p_x_e,p_e_e,p_e_i,p_i_i,p_i_e)
-            if not param_tuple in param_combos and all_trials_exist(file_prefix, contrast_range, num_trials):
+            if not param_tuple in param_combos and all_trials_exist(file_prefix, contrast_range, num_trials,
+                store=store):
                 param_combos.append(param_tuple)
     param_combos.sort()
     return param_combos
 
 
+def get_code_version(module_names):
+    """
+    Get a hash of the source code of modules
+    module_names = names of (imported) modules
+    """
+    code_hash=hashlib.md5()
+    for module_name in module_names:
+        source_file=sys.modules[module_name].__file__
+        if source_file.endswith('.pyc') or source_file.endswith('.pyo'):
+            source_file=source_file[:-1]
+        code_hash.update(open(source_file, 'rb').read())
+    return code_hash.hexdigest()
+
+
+def get_trial_files_key(file_prefix, contrast_range, num_trials, store=None):
+    """
+    Get a hash of the name, modification time, and size of the trial files of a parameter point
+    file_prefix = trial file prefix
+    store = SweepStore to get modification times from instead of the trial files (its index is updated when files are
+            changed)
+    """
+    key_values=[]
+    for contrast in contrast_range:
+        for i in range(num_trials):
+            fname='%s.contrast.%0.4f.trial.%d.h5' % (file_prefix, contrast, i)
+            if store is not None:
+                row=store.get_row(file_prefix, contrast, i)
+                key_values.append((os.path.basename(fname), None if row is None else store.index['mtime'][row]))
+            elif os.path.exists(fname):
+                stat=os.stat(fname)
+                key_values.append((os.path.basename(fname), stat.st_mtime, stat.st_size))
+            else:
+                key_values.append((os.path.basename(fname), None))
+    return hashlib.md5(repr(key_values)).hexdigest()
+
+
+class ReportCache():
+    """
+    Results computed for each parameter point of a sweep, stored with the key of the inputs they were computed from so
+    they can be reused when the inputs have not changed
+    cache_file = HDF5 file to store results in
+    """
+    def __init__(self, cache_file):
+        self.cache_file=cache_file
+        self.entries={}
+        if os.path.exists(cache_file):
+            f=h5py.File(cache_file, 'r')
+            for name,f_entry in f.iteritems():
+                self.entries[name]=(f_entry.attrs['key'], dict([(value_name, value) for value_name,value in
+                                                                 f_entry.attrs.iteritems() if value_name!='key']))
+            f.close()
+
+    def get(self, name, key):
+        """
+        Get the results of a parameter point - None if not computed or computed from different inputs
+        """
+        if name in self.entries and self.entries[name][0]==key:
+            return self.entries[name][1]
+        return None
+
+    def set(self, name, key, values):
+        """
+        Store the results of a parameter point
+        values = dictionary of result name -> value
+        """
+        self.entries[name]=(key, values)
+        f=h5py.File(self.cache_file, 'a')
+        if name in f:
+            del f[name]
+        f_entry=f.create_group(name)
+        f_entry.attrs['key']=key
+        for value_name,value in values.iteritems():
+            f_entry.attrs[value_name]=value
+        f.close()
+
+
 def make_report_dirs(output_dir):
 
     rdirs = ['img']
@@ -6,20 +6,43 @@ from brian.stdunits import nA, mA, Hz, ms
 import matplotlib.pylab as plt
 import numpy as np
 from scikits.learn.linear_model.base import LinearRegression
-from pysbi.wta.analysis import FileInfo, get_roc_single_option, get_auc, get_auc_single_option, get_lfp_signal, run_bayesian_analysis
+from pysbi.wta.analysis import FileInfo, get_roc_single_option, get_auc, get_auc_single_option, get_lfp_signal, run_bayesian_analysis, load_trial, compute_auc
 from pysbi.config import TEMPLATE_DIR
 from pysbi.reports.summary import render_summary_report, SummaryData
-from pysbi.reports.utils import all_trials_exist, get_tested_param_combos, make_report_dirs
+from pysbi.reports.utils import all_trials_exist, get_tested_param_combos, make_report_dirs, ReportCache, get_code_version, get_trial_files_key
 from pysbi.util.utils import save_to_png, Struct, plot_raster, save_to_eps
+from pysbi.wta.sweep_store import SweepStore
 
 
 def create_all_reports(data_dir, num_groups, trial_duration, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range,
                        p_i_i_range, p_i_e_range, contrast_range, num_trials, e_desc, base_report_dir, regenerate_network_plots=True,
                        regenerate_trial_plots=True, smooth_missing_params=False,
-                       summary_filename='wta_network_summary.h5'):
+                       summary_filename='wta_network_summary.h5', store_file=None, use_index=False,
+                       incremental=False, cache_filename='wta_network_cache.h5'):
+    """
+    store_file = sweep store or trial index (written by pysbi.wta.sweep_store) to find trials with
+    use_index = compute each parameter point's AUC and BOLD regressions from the summary fields in the trial index
+                instead of creating a network report from the trial files
+    incremental = only recompute parameter points whose trial files or analysis code have changed since the last run,
+                  reusing cached results for the others
+    cache_filename = file in base_report_dir to cache results of each parameter point in
+    """
 
     make_report_dirs(base_report_dir)
 
+    # Find trials with a sweep store or trial index instead of listing the data directory
+    store=None
+    if store_file is not None:
+        store=SweepStore(store_file)
+    elif use_index:
+        raise ValueError('A trial index is needed to summarize parameter points from the index')
+
+    cache=None
+    if incremental:
+        cache=ReportCache(os.path.join(base_report_dir, cache_filename))
+        code_version=get_code_version(['pysbi.reports.wta', 'pysbi.wta.analysis', 'pysbi.wta.sweep_store',
+                                       'pysbi.util.utils'])
+
     summary_data=SummaryData(num_groups=num_groups, num_trials=num_trials, trial_duration=trial_duration,
         p_b_e_range=p_b_e_range, p_x_e_range=p_x_e_range, p_e_e_range=p_e_e_range, p_e_i_range=p_e_i_range,
         p_i_i_range=p_i_i_range, p_i_e_range=p_i_e_range)
@@ -32,7 +55,8 @@ def create_all_reports(data_dir, num_groups, trial_duration, p_b_e_range, p_x_e_
     bfr_intercept_dict={}
     bfr_r_sqr_dict={}
 
-    param_combos=get_tested_param_combos(data_dir, num_groups, trial_duration, contrast_range, num_trials, e_desc)
+    param_combos=get_tested_param_combos(data_dir, num_groups, trial_duration, contrast_range, num_trials, e_desc,
+        store=store)
 
     report_info=Struct()
     report_info.edesc=e_desc
@@ -58,11 +82,28 @@ def create_all_reports(data_dir, num_groups, trial_duration, p_b_e_range, p_x_e_
                       (num_groups, trial_duration, p_b_e, p_x_e, p_e_e, p_e_i, p_i_i, p_i_e, e_desc)
             file_prefix=os.path.join(data_dir,file_desc)
             reports_dir=os.path.join(base_report_dir,file_desc)
-            if all_trials_exist(file_prefix, contrast_range, num_trials):
+            cache_key=None
+            cached_values=None
+            wta_report=None
+            if cache is not None:
+                cache_key='%s.%s.%s.%d' % (code_version, get_trial_files_key(file_prefix, contrast_range, num_trials,
+                    store=store), use_index, num_trials)
+                cached_values=cache.get(file_desc, cache_key)
+                if cached_values is not None:
+                    print('Using cached report for %s' % file_desc)
+                    wta_report=get_cached_network_summary(cached_values)
+
+            if wta_report is None and use_index and store.all_trials_exist(file_desc, contrast_range, num_trials):
+                wta_report=get_index_network_summary(store, file_desc, contrast_range, num_trials)
+            elif wta_report is None and all_trials_exist(file_prefix, contrast_range, num_trials, store=store):
                 print('Creating report for %s' % file_desc)
                 wta_report=create_wta_network_report(file_prefix, contrast_range, num_trials, reports_dir,
-                    e_desc, regenerate_network_plots=regenerate_network_plots, regenerate_trial_plots=regenerate_trial_plots)
+                    e_desc, regenerate_network_plots=regenerate_network_plots, regenerate_trial_plots=regenerate_trial_plots,
+                    store=store)
+            if wta_report is not None and cache_key is not None and cached_values is None:
+                cache.set(file_desc, cache_key, get_network_summary_values(wta_report))
 
+            if wta_report is not None:
                 if not (i,j,k,l,m,n) in bc_slope_dict:
                     bc_slope_dict[(i,j,k,l,m,n)]=[]
                 bc_slope_dict[(i,j,k,l,m,n)].append(wta_report.bold.bold_contrast_slope)
@@ -136,7 +177,7 @@ def create_all_reports(data_dir, num_groups, trial_duration, p_b_e_range, p_x_e_
 
 
 def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_dir, edesc, regenerate_network_plots=True,
-                              regenerate_trial_plots=True):
+                              regenerate_trial_plots=True, store=None):
 
     make_report_dirs(reports_dir)
 
@@ -155,14 +196,12 @@ def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_d
 
     report_info.contrast_accuracy=np.zeros([len(contrast_range),1])
 
-    max_bold=[]
     for j,contrast in enumerate(contrast_range):
-        contrast_max_bold=[]
         report_info.contrast_accuracy[j]=0.0
         for i in range(num_trials):
             file_name='%s.contrast.%0.4f.trial.%d.h5' % (file_prefix, contrast, i)
             print('opening %s' % file_name)
-            data=FileInfo(file_name)
+            data=load_trial(file_prefix, contrast, i, store=store)
 
             if not i:
                 report_info.wta_params=data.wta_params
@@ -179,15 +218,7 @@ def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_d
             trial_idx=j*num_trials+i
             trial = create_trial_report(data, reports_dir, contrast, i, regenerate_plots=regenerate_trial_plots)
             trial_contrast[trial_idx]=trial.input_contrast
-            if not math.isnan(trial.max_bold):
-                trial_max_bold[trial_idx]=trial.max_bold
-            else:
-                if j>1 and max_bold[j-1]<1.0 and max_bold[j-2]<1.0:
-                    trial_max_bold[trial_idx]=max_bold[j-1]+(max_bold[j-1]-max_bold[j-2])
-                elif j>0 and max_bold[j-1]<1.0:
-                    trial_max_bold[trial_idx]=max_bold[j-1]*2.0
-                else:
-                    trial_max_bold[trial_idx]=1.0
+            trial_max_bold[trial_idx]=trial.max_bold
 
             report_info.contrast_accuracy[j]+=trial.correct
 
@@ -195,11 +226,8 @@ def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_d
             trial_max_rate[trial_idx]=trial.max_rate
             trial_rt[trial_idx]=trial.rt
             report_info.trials.append(trial)
-
-            contrast_max_bold.append(trial_max_bold[trial_idx])
         report_info.contrast_accuracy[j]/=float(num_trials)
-        mean_contrast_bold=np.mean(np.array(contrast_max_bold))
-        max_bold.append(mean_contrast_bold)
+    trial_max_bold=fill_missing_bold(trial_max_bold, len(contrast_range), num_trials)
 
     clf=LinearRegression()
     clf.fit(trial_max_input,trial_max_rate)
@@ -229,7 +257,7 @@ def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_d
         regenerate_plot=regenerate_network_plots)
 
     report_info.roc=create_roc_report(file_prefix, report_info.num_groups, contrast_range, num_trials, reports_dir,
-        regenerate_plot=regenerate_network_plots)
+        regenerate_plot=regenerate_network_plots, store=store)
 
     #create report
     template_file='wta_network_instance.html'
@@ -244,6 +272,145 @@ def create_wta_network_report(file_prefix, contrast_range, num_trials, reports_d
     return report_info
 
 
+# Results of a parameter point that are cached between report runs
+cached_network_summary_values=['auc', 'bold_contrast_slope', 'bold_contrast_intercept', 'bold_contrast_r_sqr',
+                               'bold_firing_rate_slope', 'bold_firing_rate_intercept', 'bold_firing_rate_r_sqr']
+
+def get_network_summary_values(wta_report):
+    """
+    Get the results of a parameter point to cache from its network report
+    """
+    values=dict([(name, float(getattr(wta_report.bold, name))) for name in cached_network_summary_values[1:]])
+    values['auc']=float(wta_report.roc.auc)
+    return values
+
+
+def get_cached_network_summary(values):
+    """
+    Create a network report summary from cached results of a parameter point
+    """
+    report=Struct()
+    report.roc=Struct()
+    report.roc.auc=values['auc']
+    report.bold=Struct()
+    for name in cached_network_summary_values[1:]:
+        setattr(report.bold, name, values[name])
+    return report
+
+
+def fill_missing_bold(trial_max_bold, num_contrasts, num_trials):
+    """
+    Fill in the maximum BOLD of trials where it is NaN, extrapolating from the mean of the previous contrasts
+    trial_max_bold = maximum BOLD of each trial, ordered by contrast and then trial
+    Returns the filled maximum BOLD of each trial
+    """
+    trial_max_bold=np.array(trial_max_bold, dtype=float)
+    max_bold=[]
+    for j in range(num_contrasts):
+        for i in range(num_trials):
+            trial_idx=j*num_trials+i
+            if math.isnan(trial_max_bold[trial_idx]):
+                if j>1 and max_bold[j-1]<1.0 and max_bold[j-2]<1.0:
+                    trial_max_bold[trial_idx]=max_bold[j-1]+(max_bold[j-1]-max_bold[j-2])
+                elif j>0 and max_bold[j-1]<1.0:
+                    trial_max_bold[trial_idx]=max_bold[j-1]*2.0
+                else:
+                    trial_max_bold[trial_idx]=1.0
+        max_bold.append(np.mean(trial_max_bold[j*num_trials:(j+1)*num_trials]))
+    return trial_max_bold
+
+
+def get_index_network_summary(store, file_desc, contrast_range, num_trials, num_extra_trials=10):
+    """
+    Compute the AUC and BOLD regressions of a parameter point from the summary fields in a trial index, without
+    reading the trial files. The results are computed as create_wta_network_report computes them from the trial files
+    - the AUC from noisy firing rates before the end of the stimulus (as in get_auc), and the BOLD regressions against
+    the input contrast and the maximum rate of the population with the highest input, with missing BOLD signals
+    extrapolated.
+    store = SweepStore
+    file_desc = trial file prefix of the parameter point
+    num_extra_trials = number of copies of each trial in the ROC (as in get_auc)
+    """
+    rows=np.array([store.get_row(file_desc, contrast, i) for contrast in contrast_range for i in range(num_trials)])
+    input_freq=store.index['input_freq'][rows,:]
+    e_max=store.index['e_max'][rows,:]
+    e_final_mean=store.index['e_final_mean'][rows,:]
+    e_final_max=store.index['e_final_max'][rows,:]
+    truncated=None
+    if 'truncated' in store.index:
+        truncated=store.index['truncated'][rows]==1
+
+    trial_contrast=np.reshape(np.abs(input_freq[:,0]-input_freq[:,1])/np.sum(input_freq,axis=1),(-1,1))
+    max_input_idx=np.array([np.where(freq==np.max(freq))[0][0] for freq in input_freq])
+    trial_max_rate=np.reshape(e_max[np.arange(len(rows)),max_input_idx],(-1,1))
+    trial_max_bold=fill_missing_bold(store.index['bold_max'][rows], len(contrast_range), num_trials)
+
+    report=Struct()
+    report.roc=Struct()
+    report.roc.auc=get_summary_auc(input_freq, e_final_mean, e_final_max, truncated=truncated,
+        num_extra_trials=num_extra_trials)
+
+    report.bold=Struct()
+    for name,x in [('bold_contrast', trial_contrast), ('bold_firing_rate', trial_max_rate)]:
+        clf=LinearRegression()
+        clf.fit(x,trial_max_bold)
+        setattr(report.bold, '%s_slope' % name, clf.coef_[0])
+        setattr(report.bold, '%s_intercept' % name, clf.intercept_)
+        setattr(report.bold, '%s_r_sqr' % name, clf.score(x,trial_max_bold))
+    return report
+
+
+def get_summary_auc(input_freq, e_final_mean, e_final_max, truncated=None, num_extra_trials=10):
+    """
+    Compute the two-option AUC from the mean and max firing rate of each population before the end of the stimulus,
+    as get_auc does from the firing rates - each trial's mean rates get noise proportional to the larger max rate, and
+    trials with equal inputs are positive examples of the option with the higher max rate
+    input_freq = input rate of each option in each trial (trials x options)
+    e_final_mean = mean rate of each population before the end of the stimulus (trials x populations)
+    e_final_max = max rate of each population before the end of the stimulus (trials x populations)
+    truncated = whether or not each trial was stopped after a decision - truncated trials and trials without rates
+                before the end of the stimulus are left out
+    num_extra_trials = number of copies of each trial in the ROC
+    Returns the AUC, or NaN if no trials have rates before the end of the stimulus
+    """
+    complete=np.all(np.isfinite(e_final_mean),axis=1) & np.all(np.isfinite(e_final_max),axis=1)
+    if truncated is not None:
+        complete&=~np.asarray(truncated, dtype=bool)
+    if not np.any(complete):
+        return float('NaN')
+    input_freq=input_freq[complete,:]
+    e_final_mean=e_final_mean[complete,:]
+    e_final_max=e_final_max[complete,:]
+
+    total_p=0.0
+    option_aucs=[]
+    for option_idx in range(2):
+        other_idx=1-option_idx
+        # Trials where this option has the higher input (or the higher rate if the inputs are equal) are positive
+        examples=input_freq[:,option_idx]>input_freq[:,other_idx]
+        ties=input_freq[:,option_idx]==input_freq[:,other_idx]
+        examples[ties]=e_final_max[ties,option_idx]>e_final_max[ties,other_idx]
+
+        max_rate=np.maximum(e_final_max[:,option_idx], e_final_max[:,other_idx])
+        pop_mean=e_final_mean[:,option_idx]+.25*max_rate*np.random.randn(len(max_rate))
+        other_pop_mean=e_final_mean[:,other_idx]+.25*max_rate*np.random.randn(len(max_rate))
+        rate_sum=pop_mean+other_pop_mean
+        f_scores=np.zeros(len(rate_sum))
+        f_scores[rate_sum!=0]=pop_mean[rate_sum!=0]/rate_sum[rate_sum!=0]
+
+        examples=np.repeat(examples,num_extra_trials).astype(int)
+        p=float(np.sum(examples))
+        n=float(len(examples))-p
+        l=zip(examples, np.repeat(f_scores,num_extra_trials))
+        option_aucs.append((compute_auc(sorted(l, key=lambda example: example[1], reverse=True), n, p), p))
+        total_p+=p
+    total_auc=0.0
+    for auc,p in option_aucs:
+        if total_p>0:
+            total_auc+=auc*(p/total_p)
+    return total_auc
+
+
 def create_bold_report(reports_dir, trial_contrast, trial_max_bold, trial_max_rate, trial_rt, regenerate_plot=True):
 
     report_info=Struct()
@@ -454,10 +621,10 @@ def create_trial_report(data, reports_dir, contrast, trial_idx, regenerate_plots
     return trial
 
 
-def create_roc_report(file_prefix, num_groups, contrast_range, num_trials, reports_dir, regenerate_plot=True):
+def create_roc_report(file_prefix, num_groups, contrast_range, num_trials, reports_dir, regenerate_plot=True, store=None):
     num_extra_trials=10
     roc_report=Struct()
-    roc_report.auc=get_auc(file_prefix, contrast_range, num_trials, num_extra_trials, num_groups)
+    roc_report.auc=get_auc(file_prefix, contrast_range, num_trials, num_extra_trials, num_groups, store=store)
     roc_report.auc_single_option=[]
     roc_url = 'img/roc.png'
     fname=os.path.join(reports_dir, roc_url)
@@ -465,9 +632,10 @@ def create_roc_report(file_prefix, num_groups, contrast_range, num_trials, repor
     if regenerate_plot or not os.path.exists(fname):
         fig=plt.figure()
         for i in range(num_groups):
-            roc=get_roc_single_option(file_prefix, contrast_range, num_trials, num_extra_trials, i)
+            roc=get_roc_single_option(file_prefix, contrast_range, num_trials, num_extra_trials, i, store=store)
             plt.plot(roc[:,0],roc[:,1],'x-',label='option %d' % i)
-            roc_report.auc_single_option.append(get_auc_single_option(file_prefix, contrast_range, num_trials, num_extra_trials, i))
+            roc_report.auc_single_option.append(get_auc_single_option(file_prefix, contrast_range, num_trials,
+                num_extra_trials, i, store=store))
         plt.plot([0,1],[0,1],'--')
         plt.xlabel('False Positive Rate')
         plt.ylabel('True Positive Rate')
@@ -0,0 +1,42 @@
+from time import time
+from brian import ms, nS, pA, second
+from pysbi.wta.network import default_params, simulation_params, run_wta, run_wta_batch
+import numpy as np
+
+def test_batch_trials(num_trials=8, trial_duration=.2*second, network_group_size=400):
+    """
+    Benchmark a batch of short trials against running them one at a time, with DCS and muscimol applied so that the
+    per-step network operations of the batch are exercised, and check the shape of the batch results
+    num_trials = number of trials in the batch
+    trial_duration = duration of each trial
+    network_group_size = total number of neurons in each trial's network
+    """
+    wta_params=default_params()
+    wta_params.network_group_size=network_group_size
+    wta_params.background_input_size=network_group_size
+    wta_params.task_input_size=int(network_group_size*.8*wta_params.f)
+
+    sim_params=simulation_params(trial_duration=trial_duration, stim_start_time=.05*second,
+        stim_end_time=trial_duration, p_dcs=0.5*pA, i_dcs=-0.25*pA, dcs_start_time=0*second,
+        dcs_end_time=trial_duration, muscimol_amount=1*nS, injection_site=0)
+    input_freqs=np.array([[30.0, 10.0], [10.0, 30.0]]*(num_trials/2))
+
+    start_time=time()
+    for k in range(num_trials):
+        run_wta(wta_params, input_freqs[k,:], sim_params, record_lfp=False, record_voxel=False, record_spikes=False,
+            report=None)
+    single_time=time()-start_time
+
+    start_time=time()
+    results=run_wta_batch(wta_params, input_freqs, sim_params, report=None)
+    batch_time=time()-start_time
+
+    assert results.e_rates.shape[:2]==(num_trials, wta_params.num_groups)
+    assert results.i_rates.shape[:2]==(num_trials, 1)
+    assert len(results.rt)==num_trials and len(results.choice)==num_trials
+
+    print('%d trials of %.0fms: one at a time %.2fs, batched %.2fs' % (num_trials, trial_duration/ms, single_time,
+                                                                      batch_time))
+
+if __name__=='__main__':
+    test_batch_trials()
@@ -0,0 +1,48 @@
+from brian import Network, PoissonGroup, Clock, ms
+from brian.connections import DelayConnection
+from pysbi.wta.connectivity import ConnectivityCache
+from pysbi.wta.network import WTANetworkGroup, default_params
+
+def init_network(wta_params, clock, connectivity_cache=None):
+    """
+    Create a WTA network group with its background and task inputs
+    """
+    background_input=PoissonGroup(wta_params.background_input_size, rates=wta_params.background_freq, clock=clock)
+    task_inputs=[]
+    for i in range(wta_params.num_groups):
+        task_inputs.append(PoissonGroup(wta_params.task_input_size, rates=wta_params.task_input_resting_rate,
+            clock=clock))
+    wta_network=WTANetworkGroup(params=wta_params, background_input=background_input, task_inputs=task_inputs,
+        clock=clock, connectivity_cache=connectivity_cache, connectivity_seed=0)
+    return wta_network, background_input, task_inputs
+
+
+def test_delay_connections(network_group_size=200, run_time=10*ms):
+    """
+    Build a small WTA network (with Brian units enabled) from generated and from cached connectivity and check that its
+    delay connections can be created and run
+    network_group_size = total number of neurons in the network
+    run_time = time to run the network for
+    """
+    wta_params=default_params()
+    wta_params.network_group_size=network_group_size
+    wta_params.background_input_size=network_group_size
+    wta_params.task_input_size=int(network_group_size*.8*wta_params.f)
+    clock=Clock(dt=.5*ms)
+
+    connectivity_cache=ConnectivityCache()
+    for restored in [False, True]:
+        wta_network, background_input, task_inputs=init_network(wta_params, clock,
+            connectivity_cache=connectivity_cache)
+        delay_conns=[conn for conn in wta_network.connections.values() if isinstance(conn, DelayConnection)]
+        assert len(delay_conns)
+        assert connectivity_cache.hits==int(restored)
+
+        net=Network(background_input, task_inputs, wta_network, wta_network.connections.values())
+        net.reinit()
+        net.run(run_time, report=None)
+        print('%s connectivity: %d delay connections, ran %.0fms' % ('Cached' if restored else 'Generated',
+                                                                    len(delay_conns), run_time/ms))
+
+if __name__=='__main__':
+    test_delay_connections()
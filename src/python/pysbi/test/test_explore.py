@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from pysbi.wta.explore import explore
+from pysbi.wta.sweep_store import SweepStore
+
+def test_explore_round(output_dir=None, num_trials=2, contrast_range=[0.0, 0.25, 1.0], num_processes=None):
+    """
+    Run the first round of an exploration on a tiny grid end to end - simulate the trials, index the trial files, and
+    check that every simulated point is in the index and gets scored
+    output_dir = directory to write trial files to (a temporary directory that is removed afterwards if None)
+    num_trials = number of trials per parameter point and contrast
+    contrast_range = contrasts to simulate
+    """
+    remove_output=output_dir is None
+    if output_dir is None:
+        output_dir=tempfile.mkdtemp(prefix='wta-explore-')
+    try:
+        results=explore(output_dir, {'p_e_e': (0.08, 0.09)}, num_trials, num_levels=2, max_rounds=0,
+            contrast_range=contrast_range, num_processes=num_processes)
+        assert len(results.points)==2
+
+        store=SweepStore(os.path.join(output_dir, 'trial_index.h5'))
+        assert len(store)==len(results.points)*len(contrast_range)*num_trials
+        assert np.all(np.isfinite(results.auc))
+        for point,auc,posterior in zip(results.points, results.auc, results.posterior):
+            print('p_e_e=%.3f: auc=%.3f posterior=%.3f' % (point[0], auc, posterior))
+    finally:
+        if remove_output:
+            shutil.rmtree(output_dir)
+
+if __name__=='__main__':
+    test_explore_round()
@@ -0,0 +1,76 @@
+from time import time
+from brian import Hz, pA, second, network_operation
+from pysbi.wta.network import simulation_params
+from pysbi.wta.virtual_subject import VirtualSubject
+import numpy as np
+
+def run_legacy_trial(subject, sim_params, input_freq):
+    """
+    Run a trial by creating and adding new network operations, as VirtualSubject.run_trial used to
+    """
+    subject.wta_monitor.sim_params=sim_params
+    subject.net.reinit(states=False)
+
+    @network_operation(when='start', clock=subject.input_update_clock)
+    def set_task_inputs():
+        for idx in range(len(subject.task_inputs)):
+            rate = subject.wta_params.task_input_resting_rate
+            if sim_params.stim_start_time <= subject.simulation_clock.t < sim_params.stim_end_time:
+                rate = input_freq[idx] * Hz + np.random.randn() * subject.wta_params.input_var
+                if rate < subject.wta_params.task_input_resting_rate:
+                    rate = subject.wta_params.task_input_resting_rate
+            subject.task_inputs[idx]._S[0, :] = rate
+
+    @network_operation(clock=subject.simulation_clock)
+    def inject_current():
+        if sim_params.dcs_start_time < subject.simulation_clock.t <= sim_params.dcs_end_time:
+            subject.wta_network.group_e.I_dcs = sim_params.p_dcs
+            subject.wta_network.group_i.I_dcs = sim_params.i_dcs
+        else:
+            subject.wta_network.group_e.I_dcs = 0 * pA
+            subject.wta_network.group_i.I_dcs = 0 * pA
+
+    @network_operation(when='start', clock=subject.simulation_clock)
+    def inject_muscimol():
+        if sim_params.muscimol_amount > 0:
+            subject.wta_network.groups_e[sim_params.injection_site].g_muscimol = sim_params.muscimol_amount
+
+    subject.net.add(set_task_inputs, inject_current, inject_muscimol)
+    subject.net.run(sim_params.trial_duration, report=None)
+    subject.net.remove(set_task_inputs, inject_current, inject_muscimol)
+
+
+def test_trial_overhead(num_trials=20, trial_duration=.02*second):
+    """
+    Micro-benchmark of the per-trial overhead of a VirtualSubject session - runs very short trials so that the time per
+    trial is dominated by trial setup, first by adding new network operations every trial and then with the persistent
+    network operations reset in place
+    num_trials = number of trials to run with each method
+    trial_duration = duration of each trial
+    """
+    sim_params=simulation_params(ntrials=num_trials, trial_duration=trial_duration, stim_start_time=0*second,
+        stim_end_time=trial_duration, p_dcs=0.5*pA, i_dcs=-0.25*pA, dcs_start_time=0*second,
+        dcs_end_time=trial_duration)
+    input_freq=np.array([30.0, 10.0])
+
+    subject=VirtualSubject(0, sim_params=sim_params)
+    # Take the persistent network operations out of the network while running the legacy trials
+    subject.net.remove(subject.set_task_inputs, subject.inject_current)
+    start_time=time()
+    for t in range(num_trials):
+        run_legacy_trial(subject, sim_params, input_freq)
+    legacy_time=(time()-start_time)/num_trials
+    subject.net.add(subject.set_task_inputs, subject.inject_current)
+
+    start_time=time()
+    for t in range(num_trials):
+        subject.reset_trial(sim_params, input_freq)
+        subject.net.run(sim_params.trial_duration, report=None)
+    persistent_time=(time()-start_time)/num_trials
+
+    print('Time per %.0fms trial, adding network operations: %.4fs' % (trial_duration/second*1000.0, legacy_time))
+    print('Time per %.0fms trial, persistent network operations: %.4fs' % (trial_duration/second*1000.0,
+                                                                           persistent_time))
+
+if __name__=='__main__':
+    test_trial_overhead()
@@ -1,10 +1,11 @@
-from brian.clock import defaultclock, reinit_default_clock
+from time import time
+from brian.clock import defaultclock, reinit_default_clock, Clock
 from brian.monitor import MultiStateMonitor
 from brian.network import network_operation, Network
 from brian.stdunits import nS, ms
 from brian.units import second
 from matplotlib.pyplot import subplot, figure, ylabel, xlabel, plot, legend, title
-from pysbi.voxel import Voxel, default_params, zheng_params, ZhengVoxel, TestVoxel
+from pysbi.voxel import Voxel, default_params, zheng_params, ZhengVoxel, TestVoxel, get_bold_signal, get_bold_duration
 import numpy as np
 
 def test_voxel():
@@ -149,5 +150,70 @@ def plot_results(voxel_monitor, new_voxel_monitor):#h_hrf):
 #    ylabel('BOLD')
 #    legend()
 
+def get_network_bold_signal(g_total, voxel_params, baseline_range, trial_duration):
+    """
+    Compute the BOLD signal by running a Voxel in a Brian network, as get_bold_signal used to
+    """
+    simulation_clock=Clock(dt=1*ms)
+
+    voxel=Voxel(simulation_clock, params=voxel_params)
+    voxel.G_base=g_total[baseline_range[0]:baseline_range[1]].mean()
+    voxel_monitor = MultiStateMonitor(voxel, vars=['G_total','s','f_in','v','f_out','q','y'], record=True,
+        clock=simulation_clock)
+
+    @network_operation(when='start', clock=simulation_clock)
+    def get_input():
+        idx=int(simulation_clock.t/simulation_clock.dt)
+        if idx<baseline_range[0]:
+            voxel.G_total=voxel.G_base
+        elif idx<len(g_total):
+            voxel.G_total=g_total[idx]
+        else:
+            voxel.G_total=voxel.G_base
+
+    net=Network(voxel, get_input, voxel_monitor)
+    net.run(get_bold_duration(trial_duration))
+
+    return voxel_monitor
+
+
+def test_bold_signal(num_trials=20, trial_duration=4*second):
+    """
+    Compare the BOLD signal computed by running a Voxel in a Brian network with the integrated and linearized balloon
+    model of get_bold_signal, for one trial and a batch of trials
+    num_trials = number of trials in the batch
+    trial_duration = trial duration
+    """
+    num_steps=int(trial_duration/ms)
+    g_total=np.ones((num_trials,num_steps))*20*nS*(1.0+.05*np.random.randn(num_trials,num_steps))
+    g_total[:,int(num_steps/4):int(3*num_steps/4)]*=1.1
+
+    start_time=time()
+    network_monitor=get_network_bold_signal(g_total[0,:], default_params, [500, 2500], trial_duration)
+    print('Brian network: %.3fs' % (time()-start_time))
+
+    start_time=time()
+    bold=get_bold_signal(g_total[0,:], default_params, [500, 2500], trial_duration)
+    print('Balloon model: %.3fs' % (time()-start_time))
+
+    start_time=time()
+    linear_bold=get_bold_signal(g_total[0,:], default_params, [500, 2500], trial_duration, linear=True)
+    print('Linearized balloon model: %.3fs' % (time()-start_time))
+
+    start_time=time()
+    batch_bold=get_bold_signal(g_total, default_params, [500, 2500], trial_duration)
+    print('Balloon model, %d trials: %.3fs' % (num_trials, time()-start_time))
+
+    start_time=time()
+    get_bold_signal(g_total, default_params, [500, 2500], trial_duration, linear=True)
+    print('Linearized balloon model, %d trials: %.3fs' % (num_trials, time()-start_time))
+
+    y_max=np.max(np.abs(network_monitor['y'][0]))
+    print('Max BOLD: %.6f' % y_max)
+    print('Max difference, balloon model: %.6f' % np.max(np.abs(bold['y'][0]-network_monitor['y'][0])))
+    print('Max difference, linearized balloon model: %.6f' % np.max(np.abs(linear_bold['y'][0]-
+                                                                         network_monitor['y'][0])))
+    print('Max difference, batch: %.6f' % np.max(np.abs(batch_bold['y'][0]-bold['y'][0])))
+
 if __name__=='__main__':
     test_voxel()
\ No newline at end of file
@@ -0,0 +1,41 @@
+from brian import NeuronGroup, Connection, nS, ms
+from brian.connections import DelayConnection
+from pysbi.util.weights import WeightHistory, connection_weights
+import numpy as np
+
+def test_compressed_weights(num_neurons=20, num_snapshots=5):
+    """
+    Check that the weights of compressed Brian connections (random and one-to-one, with and without delays) are read
+    without a dense copy, and that a history of changing weights reconstructs every snapshot
+    num_neurons = number of neurons in each group
+    num_snapshots = number of weight snapshots to record
+    """
+    group1=NeuronGroup(num_neurons, model='dg/dt=-g/(10*ms) : siemens')
+    group2=NeuronGroup(num_neurons, model='dg/dt=-g/(10*ms) : siemens')
+    conns={
+        'random': Connection(group1, group2, 'g', weight=1*nS, sparseness=0.2),
+        'random_delay': DelayConnection(group1, group2, 'g', weight=1*nS, sparseness=0.2, delay=.5*ms),
+        'one_to_one_delay': DelayConnection(group1, group2, 'g', max_delay=5*ms)
+    }
+    conns['one_to_one_delay'].connect_one_to_one(group1, group2, weight=2*nS, delay=.5*ms)
+
+    for name,conn in conns.iteritems():
+        conn.compress()
+        W=conn.W
+        assert np.allclose(connection_weights(W).toarray(), np.asarray(W.todense())), name
+
+        history=WeightHistory(keyframe_interval=2)
+        snapshots=[]
+        for idx in range(num_snapshots):
+            # Change some of the existing synapses, as STDP would
+            changed=np.random.permutation(len(W.alldata))[:3]
+            W.alldata[changed]*=1.5
+            history.add(W)
+            snapshots.append(np.array(W.todense()))
+            assert np.isclose(history.diag_means[-1], np.mean(np.diagonal(snapshots[-1]))), name
+        for idx in range(num_snapshots):
+            assert np.allclose(history.get(idx).toarray(), snapshots[idx]), name
+        print('%s: %d synapses, %d snapshots reconstructed' % (name, len(W.alldata), num_snapshots))
+
+if __name__=='__main__':
+    test_compressed_weights()
@@ -0,0 +1,103 @@
+import glob
+import hashlib
+import os
+import platform
+import numpy as np
+
+# Brian preferences that change the generated or compiled code
+compile_preferences=['useweave', 'useweave_linear_diffeq', 'usecodegen', 'usecodegenweave', 'usecodegenstateupdate',
+                     'usecodegenreset', 'usecodegenthreshold', 'openmp', 'weavecompiler', 'gcc_options']
+
+def get_compile_key():
+    """
+    Get a key identifying the compiler flags and code generation preferences currently set in Brian, along with the
+    python, numpy, and machine they are compiled for
+    """
+    from brian.globalprefs import get_global_preference
+    key_values=[]
+    for name in compile_preferences:
+        try:
+            key_values.append((name, get_global_preference(name)))
+        except KeyError:
+            key_values.append((name, None))
+    key_values.extend([platform.python_version(), np.__version__, platform.machine()])
+    # Code compiled with -march=native can only be shared between identical machines
+    if any(['native' in option for option in get_global_preference('gcc_options')]):
+        key_values.append(platform.node())
+    return hashlib.md5(repr(key_values)).hexdigest()
+
+def use_compile_cache(cache_root):
+    """
+    Make weave store compiled code in a shared directory. weave keys compiled modules by their code (which is generated
+    from the model equations) - code compiled with different flags goes in a different subdirectory of cache_root.
+    Must be called after the Brian preferences are set and before the network is first run.
+    cache_root = root directory of the compile cache
+    Returns the directory compiled code will be stored in
+    """
+    cache_dir=os.path.join(os.path.abspath(cache_root), get_compile_key())
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Created by another process
+            pass
+    os.environ['PYTHONCOMPILED']=cache_dir
+    return cache_dir
+
+def get_compile_dir():
+    """
+    Get the directory weave stores compiled code in - the first directory in PYTHONCOMPILED if it is set (e.g. by
+    use_compile_cache), otherwise weave's default directory
+    """
+    if os.environ.get('PYTHONCOMPILED'):
+        return os.environ['PYTHONCOMPILED'].split(os.pathsep)[0]
+    from scipy.weave import catalog
+    return catalog.default_dir()
+
+def get_compiled_modules(compile_dir):
+    return set([os.path.basename(f) for f in glob.glob(os.path.join(compile_dir, 'sc_*')) if f.endswith('.so') or
+                                                                                            f.endswith('.pyd')])
+
+
+class CompileCacheMonitor():
+    """
+    Counts the distinct code blocks run through weave.inline and the modules compiled into the compile directory while
+    it is open. Lookups in weave's catalog are not seen, so code that was not compiled is not necessarily code that was
+    found in the cache, and modules compiled by other processes sharing the directory are counted too - no compiled
+    modules means nothing had to be compiled.
+    """
+    def __init__(self):
+        from scipy import weave
+        self.weave=weave
+        self.compile_dir=get_compile_dir()
+        self.modules=get_compiled_modules(self.compile_dir)
+        self.code=set()
+        self.inline=weave.inline
+
+        def inline(code, *args, **kwargs):
+            self.code.add(hashlib.md5(code).hexdigest())
+            return self.inline(code, *args, **kwargs)
+        weave.inline=inline
+
+    def close(self):
+        """
+        Stop counting
+        """
+        self.weave.inline=self.inline
+
+    def get_num_code_blocks(self):
+        """
+        Number of distinct code blocks run through weave.inline
+        """
+        return len(self.code)
+
+    def get_num_compiled(self):
+        """
+        Number of modules compiled into the compile directory
+        """
+        return len(get_compiled_modules(self.compile_dir)-self.modules)
+
+    def report(self):
+        return 'Compile cache %s: %d code blocks run, %d modules compiled' % (self.compile_dir,
+                                                                            self.get_num_code_blocks(),
+                                                                            self.get_num_compiled())
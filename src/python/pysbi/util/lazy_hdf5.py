@@ -0,0 +1,110 @@
+import h5py
+import numpy as np
+
+def read_dataset(file_name, path, mmap=False):
+    """
+    Read a dataset from an HDF5 file
+    file_name = HDF5 file
+    path = path of the dataset in the file
+    mmap = memory-map the dataset instead of reading it if it is stored contiguously and uncompressed
+    """
+    f=h5py.File(file_name, 'r')
+    try:
+        dataset=f[path]
+        if mmap and dataset.chunks is None and dataset.compression is None and dataset.size>0:
+            offset=dataset.id.get_offset()
+            if offset is not None:
+                return np.memmap(file_name, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+        return np.array(dataset)
+    finally:
+        f.close()
+
+
+class LazyDatasets():
+    """
+    Dictionary of HDF5 datasets that are only read when first accessed
+    file_name = HDF5 file
+    paths = dictionary of key -> path of the dataset in the file
+    mmap = memory-map contiguous datasets instead of reading them
+    """
+    def __init__(self, file_name, paths, mmap=False):
+        self.file_name=file_name
+        self.paths=dict(paths)
+        self.mmap=mmap
+        self.values={}
+
+    def __getitem__(self, key):
+        if not key in self.values:
+            self.values[key]=read_dataset(self.file_name, self.paths[key], mmap=self.mmap)
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        # Values that are set replace the dataset and are never evicted
+        self.paths.pop(key, None)
+        self.values[key]=value
+
+    def __contains__(self, key):
+        return key in self.paths or key in self.values
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return sorted(set(self.paths.keys()) | set(self.values.keys()))
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def update(self, values):
+        for key, value in values.iteritems():
+            self[key]=value
+
+    def evict(self):
+        """
+        Release datasets that have been read - they will be read again when next accessed
+        """
+        for key in self.paths:
+            self.values.pop(key, None)
+
+
+class LazyDatasetList():
+    """
+    List of HDF5 datasets that are only read when first accessed
+    file_name = HDF5 file
+    paths = path of each dataset in the file
+    mmap = memory-map contiguous datasets instead of reading them
+    """
+    def __init__(self, file_name, paths, mmap=False):
+        self.file_name=file_name
+        self.paths=list(paths)
+        self.mmap=mmap
+        self.values={}
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx<0:
+            idx+=len(self)
+        if not idx in self.values:
+            self.values[idx]=read_dataset(self.file_name, self.paths[idx], mmap=self.mmap)
+        return self.values[idx]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def evict(self):
+        """
+        Release datasets that have been read - they will be read again when next accessed
+        """
+        self.values={}
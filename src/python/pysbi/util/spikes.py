@@ -0,0 +1,120 @@
+import numpy as np
+
+class SpikeIndex():
+    """
+    Spikes of a population sorted by neuron (and by time within each neuron) with an offsets index - the spikes of
+    neuron i are times[offsets[i]:offsets[i+1]]. Per-neuron statistics are computed in a single pass over the spikes.
+    offsets = index of the first spike of each neuron (num_neurons+1 values)
+    times = spike times (seconds) sorted by neuron and time
+    """
+    def __init__(self, offsets, times):
+        self.offsets=np.asarray(offsets, dtype=np.int64)
+        self.times=np.asarray(times, dtype=np.float64)
+        self.num_neurons=len(self.offsets)-1
+        self.counts=np.diff(self.offsets)
+        self.neurons=np.repeat(np.arange(self.num_neurons), self.counts)
+
+    @classmethod
+    def from_spikes(cls, spike_neurons, spike_times, num_neurons=None):
+        """
+        Index spikes given as neuron and time arrays in any order
+        spike_neurons = neuron of each spike
+        spike_times = time of each spike (seconds)
+        num_neurons = number of neurons in the population (one more than the highest neuron index if None)
+        """
+        spike_neurons=np.asarray(spike_neurons, dtype=np.int64)
+        spike_times=np.asarray(spike_times, dtype=np.float64)
+        if num_neurons is None:
+            num_neurons=int(np.max(spike_neurons))+1 if len(spike_neurons) else 0
+        order=np.lexsort((spike_times, spike_neurons))
+        offsets=np.zeros(num_neurons+1, dtype=np.int64)
+        offsets[1:]=np.cumsum(np.bincount(spike_neurons, minlength=num_neurons))
+        return cls(offsets, spike_times[order])
+
+    def __len__(self):
+        return len(self.times)
+
+    def neuron_times(self, neuron):
+        """
+        Spike times of one neuron
+        """
+        return self.times[self.offsets[neuron]:self.offsets[neuron+1]]
+
+    def window(self, start_time, end_time):
+        """
+        Mask of the spikes in [start_time, end_time)
+        """
+        return (self.times>=float(start_time)) & (self.times<float(end_time))
+
+    def window_counts(self, start_time, end_time):
+        """
+        Number of spikes of each neuron in [start_time, end_time)
+        """
+        return np.bincount(self.neurons[self.window(start_time, end_time)], minlength=self.num_neurons)
+
+    def binned_counts(self, start_time, end_time, bins):
+        """
+        Number of spikes of each neuron in each of bins equal bins of [start_time, end_time) (neurons x bins)
+        """
+        start_time=float(start_time)
+        bin_width=(float(end_time)-start_time)/bins
+        mask=self.window(start_time, end_time)
+        bin_idx=np.minimum(((self.times[mask]-start_time)/bin_width).astype(int), bins-1)
+        counts=np.bincount(self.neurons[mask]*bins+bin_idx, minlength=self.num_neurons*bins)
+        return counts.reshape((self.num_neurons, bins))
+
+    def isis(self, start_time, end_time):
+        """
+        Interspike intervals of each neuron between its spikes in [start_time, end_time)
+        Returns the neuron and duration of each interval
+        """
+        mask=self.window(start_time, end_time)
+        neurons=self.neurons[mask]
+        times=self.times[mask]
+        same_neuron=neurons[1:]==neurons[:-1]
+        return neurons[1:][same_neuron], np.diff(times)[same_neuron]
+
+    def isi_cvs(self, start_time, end_time):
+        """
+        Coefficient of variation of the interspike intervals of each neuron in [start_time, end_time) (0 for neurons
+        with fewer than two intervals)
+        """
+        neurons,isis=self.isis(start_time, end_time)
+        num_isis=np.bincount(neurons, minlength=self.num_neurons).astype(float)
+        sums=np.bincount(neurons, weights=isis, minlength=self.num_neurons)
+        sq_sums=np.bincount(neurons, weights=isis**2, minlength=self.num_neurons)
+        cvs=np.zeros(self.num_neurons)
+        valid=num_isis>1
+        mean=sums[valid]/num_isis[valid]
+        std=np.sqrt(np.maximum(sq_sums[valid]/num_isis[valid]-mean**2, 0.0))
+        cvs[valid]=std/np.abs(mean)
+        return cvs
+
+    def count_fanos(self, start_time, end_time, bins):
+        """
+        Fano factor (variance/mean) of the spike counts of each neuron over bins equal bins of [start_time, end_time)
+        (0 for neurons without spikes)
+        """
+        counts=self.binned_counts(start_time, end_time, bins)
+        var=np.var(counts, axis=1)
+        avg=np.mean(counts, axis=1)
+        fanos=np.zeros(self.num_neurons)
+        nz_idx=avg>0
+        fanos[nz_idx]=var[nz_idx]/avg[nz_idx]
+        return fanos
+
+
+def write_spikes(f_spikes, name, spikes, num_neurons):
+    """
+    Write the spikes of a population sorted by neuron, with the offset of the first spike of each neuron
+    f_spikes = HDF5 group to write to
+    name = population name (datasets are written to <name>.spike_neurons, <name>.spike_times, <name>.spike_offsets)
+    spikes = list of (neuron, time) tuples as recorded by SpikeMonitor
+    num_neurons = number of neurons in the population
+    """
+    spikes=np.array(spikes, dtype=np.float64).reshape((-1,2))
+    index=SpikeIndex.from_spikes(spikes[:,0].astype(np.int64), spikes[:,1], num_neurons=num_neurons)
+    neuron_dtype=np.uint16 if num_neurons<=np.iinfo(np.uint16).max else np.uint32
+    f_spikes['%s.spike_neurons' % name]=index.neurons.astype(neuron_dtype)
+    f_spikes['%s.spike_times' % name]=index.times.astype(np.float32)
+    f_spikes['%s.spike_offsets' % name]=index.offsets.astype(np.uint32)
@@ -1,5 +1,5 @@
 import math
-from scipy import optimize
+from scipy import optimize, sparse
 from scipy.stats import ttest_ind
 from brian import ms, second, Connection
 from brian.connections.delayconnection import DelayConnection
@@ -64,17 +64,8 @@ def init_rand_weight_connection(pop1, pop2, target_name, min_weight, max_weight,
     delay = delay
     allow_self_conn = allow neuron to project to itself
     """
-    W=min_weight+np.random.rand(len(pop1),len(pop2))*(max_weight-min_weight)
-    conn=DelayConnection(pop1, pop2, target_name, sparseness=p, W=W, delay=delay)
-
-    # Remove self-connections
-    if not allow_self_conn and len(pop1)==len(pop2):
-        for j in xrange(len(pop1)):
-            conn[j,j]=0.0
-            conn.delay[j,j]=0.0
-            conn[j,j]=0.0
-            conn.delay[j,j]=0.0
-    return conn
+    W=random_sparse_matrix(len(pop1), len(pop2), p, min_weight, max_weight=max_weight, allow_self_conn=allow_self_conn)
+    return connection_from_sparse(pop1, pop2, target_name, W, delay=delay)
 
 def init_connection(pop1, pop2, target_name, weight, p, delay=None, allow_self_conn=True):
     """
@@ -87,22 +78,118 @@ def init_connection(pop1, pop2, target_name, weight, p, delay=None, allow_self_c
     delay = delay
     allow_self_conn = allow neuron to project to itself
     """
-    if delay is not None:
-        conn=DelayConnection(pop1, pop2, target_name, sparseness=p, weight=weight, delay=delay)
+    W=random_sparse_matrix(len(pop1), len(pop2), p, weight, allow_self_conn=allow_self_conn)
+    return connection_from_sparse(pop1, pop2, target_name, W, delay=delay)
+
+
+def random_sparse_matrix(n, m, p, weight, max_weight=None, allow_self_conn=True):
+    """
+    Generate a random connection matrix directly in CSR form, each pair of neurons being connected with probability p.
+    The connected pairs are found by accumulating geometrically distributed gaps between successive connections in the
+    flattened matrix, so only O(number of connections) memory and time is used.
+    n = number of neurons sending projections
+    m = number of neurons receiving projections
+    p = probability of connection between any two neurons
+    weight = weight of connection (min weight if max_weight is given)
+    max_weight = if given, weights are uniformly distributed between weight and max_weight
+    allow_self_conn = allow neuron to project to itself (only applies if n==m)
+    """
+    # When self-connections are excluded the diagonal is left out of the index space, so it is never drawn
+    exclude_diag=not allow_self_conn and n==m
+    row_len=m-1 if exclude_diag else m
+    total=n*row_len
+
+    if p<=0 or total==0:
+        idx=np.zeros(0, dtype=np.int64)
+    elif p>=1:
+        idx=np.arange(total, dtype=np.int64)
+    else:
+        expected=total*p
+        chunk_size=int(expected+5.0*np.sqrt(expected)+10)
+        idx=np.cumsum(np.random.geometric(p, size=chunk_size).astype(np.int64))-1
+        while idx[-1]<total:
+            idx=np.concatenate([idx, idx[-1]+np.cumsum(np.random.geometric(p, size=chunk_size).astype(np.int64))])
+        idx=idx[idx<total]
+
+    rows=idx//row_len
+    cols=idx%row_len
+    if exclude_diag:
+        cols[cols>=rows]+=1
+
+    if max_weight is None:
+        data=np.ones(len(idx))*float(weight)
+    else:
+        data=float(weight)+np.random.rand(len(idx))*(float(max_weight)-float(weight))
+
+    indptr=np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+    return sparse.csr_matrix((data, cols, indptr), shape=(n,m))
+
+
+def connection_to_sparse(conn):
+    """
+    Get the weight and delay matrices of a connection as CSR matrices
+    conn = connection (before it has been compressed by a network run)
+    Returns W, D - D is None if conn is not a DelayConnection
+    """
+    W=sparse.csr_matrix(conn.W)
+    D=None
+    if isinstance(conn, DelayConnection):
+        D=sparse.csr_matrix(conn.delayvec)
+    return W, D
+
+
+def connection_from_sparse(pop1, pop2, target_name, W, delay=None):
+    """
+    Initialize a connection between two populations from a sparse weight matrix, filling the connection's
+    construction matrix row by row from the CSR structure
+    pop1 = population sending projections
+    pop2 = populations receiving projections
+    target_name = name of synapse type to project to
+    W = weight matrix (len(pop1) x len(pop2), any scipy.sparse format)
+    delay = delay - a single value or a sparse matrix of per-synapse delays, None for a plain Connection
+    """
+    W=sparse.csr_matrix(W)
+    W.eliminate_zeros()
+    W.sort_indices()
+    if delay is None:
+        conn=Connection(pop1, pop2, target_name)
+        set_construction_rows(conn.W, W)
+        return conn
+
+    # Delays are stored with exactly the same sparsity pattern as the weights
+    D=W.copy()
+    if sparse.issparse(delay):
+        rows,cols=W.nonzero()
+        # Indexing with no rows and columns gives a sparse matrix rather than an empty one
+        if len(rows):
+            D.data=np.asarray(sparse.csr_matrix(delay)[rows,cols], dtype=float).ravel()
     else:
-        conn=Connection(pop1, pop2, sparseness=p, weight=weight)
-
-    # Remove self-connections
-    if not allow_self_conn and len(pop1)==len(pop2):
-        for j in xrange(len(pop1)):
-            conn[j,j]=0.0
-            conn[j,j]=0.0
-            if delay is not None:
-                conn.delay[j,j]=0.0
-                conn.delay[j,j]=0.0
+        D.data=np.ones(len(D.data))*float(delay)
+    max_delay=5*ms
+    if len(D.data) and np.max(D.data)*second>max_delay:
+        max_delay=np.max(D.data)*second
+    conn=DelayConnection(pop1, pop2, target_name, max_delay=max_delay)
+    set_construction_rows(conn.W, W)
+    set_construction_rows(conn.delayvec, D)
     return conn
 
 
+def set_construction_rows(M, W):
+    """
+    Hand the rows of a CSR matrix to a (lil-based) construction matrix. Brian compresses a construction matrix by
+    reading it one row at a time, so each row is set to views of the CSR column indices and data instead of being
+    copied into lists - the connection can be compressed (run) and converted to other formats, but not edited element
+    by element before that.
+    M = construction matrix to fill
+    W = CSR matrix with the same shape as M
+    """
+    for i in xrange(W.shape[0]):
+        start=W.indptr[i]
+        end=W.indptr[i+1]
+        M.rows[i]=W.indices[start:end]
+        M.data[i]=W.data[start:end]
+
+
 def weibull(x, alpha, beta):
     return 1.0-0.5*np.exp(-(x/alpha)**beta)
 
@@ -115,24 +202,57 @@ def exp_decay(x, n, lam):
     return n*np.exp(-lam*x)
 
 def get_response_time(e_firing_rates, stim_start_time, stim_end_time, upper_threshold=60, threshold_diff=None, dt=.1*ms):
-    rate_1=e_firing_rates[0]
-    rate_2=e_firing_rates[1]
-    times=np.array(range(len(rate_1)))*(dt/second)
-    rt=None
-    decision_idx=-1
-    for idx,time in enumerate(times):
-        time=time*second
-        if stim_start_time < time < stim_end_time:
-            if rt is None:
-                if rate_1[idx]>=upper_threshold and (threshold_diff is None or rate_1[idx]-rate_2[idx]>=threshold_diff):
-                    decision_idx=0
-                    rt=(time-stim_start_time)/ms
-                    break
-                elif rate_2[idx]>=upper_threshold and (threshold_diff is None or rate_2[idx]-rate_1[idx]>=threshold_diff):
-                    decision_idx=1
-                    rt=(time-stim_start_time)/ms
-                    break
-    return rt,decision_idx
+    """
+    Get the response time and choice of a single trial (see get_response_times)
+    e_firing_rates = group x time array of excitatory population firing rates
+    Returns the response time in ms (None if no decision was made) and the index of the chosen group (-1 if none)
+    """
+    rts,choices=get_response_times(np.array(e_firing_rates)[np.newaxis,:,:], stim_start_time, stim_end_time,
+        upper_threshold=upper_threshold, threshold_diff=threshold_diff, dt=dt)
+    if choices[0]<0:
+        return None,-1
+    return rts[0],int(choices[0])
+
+def get_response_times(e_firing_rates, stim_start_time, stim_end_time, upper_threshold=60, threshold_diff=None,
+                       dt=.1*ms):
+    """
+    Get the response times and choices of many trials at once. A decision is made at the first time step during the
+    stimulus (excluding its start and end) when the rate of the first or second group reaches the upper threshold (and
+    exceeds the other group's rate by threshold_diff, if given). If both groups cross at the same time step, the first
+    group is chosen.
+    e_firing_rates = trial x group x time array of excitatory population firing rates
+    stim_start_time = stimulus start time
+    stim_end_time = stimulus end time
+    upper_threshold = response threshold
+    threshold_diff = minimum difference between the rates of the groups at the response (ignored if None)
+    dt = time step of the firing rates
+    Returns an array of response times in ms (NaN if no decision was made) and an array of the index of the chosen
+    group in each trial (-1 if none)
+    """
+    # Convert everything to plain floats once so the comparisons below don't go through Brian units
+    rates=np.asarray(e_firing_rates, dtype=float)
+    stim_start=float(stim_start_time/second)
+    stim_end=float(stim_end_time/second)
+    times=np.arange(rates.shape[2])*float(dt/second)
+    upper_threshold=float(upper_threshold)
+
+    in_stim=(times>stim_start) & (times<stim_end)
+    rate_1=rates[:,0,:]
+    rate_2=rates[:,1,:]
+    cross_1=(rate_1>=upper_threshold) & in_stim
+    cross_2=(rate_2>=upper_threshold) & in_stim
+    if threshold_diff is not None:
+        threshold_diff=float(threshold_diff)
+        cross_1&=rate_1-rate_2>=threshold_diff
+        cross_2&=rate_2-rate_1>=threshold_diff
+    crossed=cross_1 | cross_2
+
+    # First crossing of each trial - argmax returns 0 for trials without a crossing, these are masked out below
+    decided=np.any(crossed, axis=1)
+    decision_idx=np.argmax(crossed, axis=1)
+    choices=np.where(decided, np.where(cross_1[np.arange(rates.shape[0]),decision_idx], 0, 1), -1)
+    rts=np.where(decided, (times[decision_idx]-stim_start)*1000.0, float('NaN'))
+    return rts,choices
 
 def mdm_outliers(dist):
     c=1.1926
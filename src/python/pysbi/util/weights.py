@@ -0,0 +1,137 @@
+import numpy as np
+from scipy import sparse
+
+def connection_weights(W):
+    """
+    Get the nonzero weights of a connection matrix as a CSR matrix without making a dense copy
+    W = connection weight matrix (compressed Brian sparse matrix, scipy.sparse matrix, or dense matrix)
+    """
+    if hasattr(W, 'alldata') and hasattr(W, 'rowind'):
+        # Compressed SparseConnectionMatrix - synapses are already stored row by row, rowind is the CSR index pointer
+        return sparse.csr_matrix((np.array(W.alldata, dtype=float), np.array(W.allj), np.array(W.rowind)),
+            shape=getattr(W, 'shape', None))
+    if sparse.issparse(W):
+        return sparse.csr_matrix(W, dtype=float)
+    return sparse.csr_matrix(np.asarray(W.todense(), dtype=float))
+
+def get_weight_record(W, last_W=None, keyframe=False):
+    """
+    Get the record of a weight snapshot - only the weights that changed since the last snapshot if the synapses are the
+    same (e.g. when STDP changes existing synapses), otherwise all nonzero weights
+    W = weights (CSR)
+    last_W = weights of the last snapshot (CSR, None if there is none)
+    keyframe = record all nonzero weights even if only some changed
+    Returns a dictionary with keyframe=True and data, indices, indptr, shape, or keyframe=False and changed_idx,
+    changed_data (indices into the CSR data of the last snapshot, and their new values)
+    """
+    if not keyframe and last_W is not None and last_W.shape==W.shape and np.array_equal(last_W.indptr, W.indptr) and \
+       np.array_equal(last_W.indices, W.indices):
+        changed_idx=np.where(W.data!=last_W.data)[0]
+        return {'keyframe': False, 'changed_idx': changed_idx.astype(np.uint32), 'changed_data': W.data[changed_idx]}
+    return {'keyframe': True, 'data': W.data, 'indices': W.indices, 'indptr': W.indptr, 'shape': W.shape}
+
+def apply_weight_record(record, last_W=None):
+    """
+    Reconstruct the weights of a snapshot from its record and the weights of the snapshot before it
+    """
+    if record['keyframe']:
+        return sparse.csr_matrix((np.array(record['data']), np.array(record['indices']), np.array(record['indptr'])),
+            shape=tuple(record['shape']))
+    W=last_W.copy()
+    W.data[np.array(record['changed_idx'], dtype=np.int64)]=record['changed_data']
+    return W
+
+def write_weight_record(f_group, record):
+    """
+    Write a weight record to an HDF5 group
+    """
+    f_group.attrs['keyframe']=record['keyframe']
+    if record['keyframe']:
+        f_group['data']=record['data']
+        f_group['indices']=record['indices']
+        f_group['indptr']=record['indptr']
+        f_group.attrs['shape']=record['shape']
+    else:
+        f_group['changed_idx']=record['changed_idx']
+        f_group['changed_data']=record['changed_data']
+
+def read_weight_record(f_group):
+    """
+    Read a weight record written by write_weight_record
+    """
+    # Groups without a keyframe attribute are plain CSR snapshots
+    record={'keyframe': bool(f_group.attrs.get('keyframe', True))}
+    names=['data', 'indices', 'indptr'] if record['keyframe'] else ['changed_idx', 'changed_data']
+    for name in names:
+        record[name]=np.array(f_group[name])
+    if record['keyframe']:
+        record['shape']=tuple(f_group.attrs['shape'])
+    return record
+
+def read_weights(f_records, names, idx):
+    """
+    Reconstruct the weights of a snapshot from the records written to an HDF5 group
+    f_records = group containing the records of each snapshot
+    names = names of the records in the order they were recorded (at least up to idx)
+    idx = index of the snapshot
+    """
+    # Find the last keyframe and apply the changes after it
+    keyframe_idx=idx
+    while not bool(f_records[names[keyframe_idx]].attrs.get('keyframe', True)):
+        keyframe_idx-=1
+    W=None
+    for record_idx in range(keyframe_idx, idx+1):
+        W=apply_weight_record(read_weight_record(f_records[names[record_idx]]), W)
+    return W
+
+
+class WeightHistory():
+    """
+    History of the weights of a connection, recorded as the weights that changed since the previous snapshot (with all
+    nonzero weights every keyframe_interval snapshots). Summary statistics of each snapshot are computed as it is
+    recorded.
+    keyframe_interval = number of snapshots between full snapshots
+    keep_records = keep the records in memory (if False, only the last snapshot is kept and records must be stored
+                   elsewhere, e.g. with write_weight_record)
+    """
+    def __init__(self, keyframe_interval=50, keep_records=True):
+        self.keyframe_interval=keyframe_interval
+        self.keep_records=keep_records
+        self.records=[]
+        self.last_W=None
+        self.num_snapshots=0
+        self.diag_means=[]
+        self.means=[]
+
+    def __len__(self):
+        return self.num_snapshots
+
+    def add(self, W):
+        """
+        Record a weight snapshot
+        W = weights (anything connection_weights accepts)
+        Returns the record of the snapshot
+        """
+        W=connection_weights(W)
+        record=get_weight_record(W, last_W=self.last_W, keyframe=self.num_snapshots % self.keyframe_interval==0)
+        if self.keep_records:
+            self.records.append(record)
+        self.last_W=W
+        self.num_snapshots+=1
+        self.diag_means.append(np.mean(W.diagonal()))
+        self.means.append(W.data.mean() if W.nnz else 0.0)
+        return record
+
+    def get(self, idx):
+        """
+        Reconstruct the weights of a snapshot (CSR)
+        """
+        if idx<0:
+            idx+=self.num_snapshots
+        if idx==self.num_snapshots-1:
+            return self.last_W.copy()
+        keyframe_idx=idx-idx % self.keyframe_interval
+        W=None
+        for record in self.records[keyframe_idx:idx+1]:
+            W=apply_weight_record(record, W)
+        return W
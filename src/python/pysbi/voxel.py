@@ -1,6 +1,5 @@
 from math import exp
-from brian import Equations, NeuronGroup, Parameters, second, network_operation, defaultclock, Network, reinit_default_clock, Clock
-from brian.monitor import MultiStateMonitor
+from brian import Equations, NeuronGroup, Parameters, second, defaultclock
 from brian.neurongroup import linked_var
 from brian.stdunits import nS, ms
 
@@ -270,28 +269,170 @@ class Voxel(NeuronGroup):
             self.G_total = linked_var(network, 'g_syn', func=sum)
             self.G_total_exc = linked_var(network, 'g_syn_exc', func=sum)
 
-def get_bold_signal(g_total, voxel_params, baseline_range, trial_duration):
-    simulation_clock=Clock(dt=1*ms)
-
-    voxel=Voxel(simulation_clock, params=voxel_params)
-    voxel.G_base=g_total[baseline_range[0]:baseline_range[1]].mean()
-    voxel_monitor = MultiStateMonitor(voxel, vars=['G_total','s','f_in','v','f_out','q','y'], record=True, clock=simulation_clock)
-
-    @network_operation(when='start', clock=simulation_clock)
-    def get_input():
-        idx=int(simulation_clock.t/simulation_clock.dt)
-        if idx<baseline_range[0]:
-            voxel.G_total=voxel.G_base
-        elif idx<len(g_total):
-            voxel.G_total=g_total[idx]
-        else:
-            voxel.G_total=voxel.G_base
-
-    net=Network(voxel, get_input, voxel_monitor)
-    #reinit_default_clock()
+# Linearized BOLD impulse responses, keyed by voxel parameters, time step, and number of steps
+bold_kernels={}
+
+# Smallest number of trials to integrate as arrays - fewer trials are integrated one at a time with floats, which have
+# less overhead per time step
+min_array_trials=20
+
+class StateRecord():
+    """
+    Recorded values of a voxel state variable - can be used like the variable's entry in a MultiStateMonitor
+    times = time of each sample (seconds)
+    values = recorded values (trials x time)
+    """
+    def __init__(self, times, values):
+        self.times=times
+        self.values=values
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __len__(self):
+        return len(self.values)
+
+
+def get_bold_constants(params):
+    """
+    Get the balloon model constants for the given voxel parameters as floats
+    """
+    s_e=params.s_e_0*exp(-params.TE/params.T_2E)
+    s_i=params.s_i_0*exp(-params.TE/params.T_2I)
+    beta=s_e/s_i
+    return {
+        'eta': float(params.eta),
+        'tau_s': float(params.tau_s),
+        'tau_f': float(params.tau_f),
+        'tau_o': float(params.tau_o),
+        'alpha': float(params.alpha),
+        'e_base': float(params.e_base),
+        'v_base': float(params.v_base),
+        'k1': float(params.k1),
+        'k2': float(beta*params.r_0*params.e_base*params.TE),
+        'k3': float(beta-1.0)
+    }
+
+def integrate_balloon(x, params, dt):
+    """
+    Integrate the balloon model of Voxel with the Euler method
+    x = normalized synaptic input (G_total-G_base)/G_base (trials x time)
+    params = voxel parameters
+    dt = time step (seconds)
+    Returns dictionary of state variable -> values (trials x time)
+    """
+    c=get_bold_constants(params)
+    eta, tau_s, tau_f, tau_o, e_base = c['eta'], c['tau_s'], c['tau_f'], c['tau_o'], c['e_base']
+    inv_alpha=1.0/c['alpha']
+    num_trials,num_steps=x.shape
+
+    if 1<num_trials<min_array_trials:
+        trial_states=[integrate_balloon(x[i:i+1,:], params, dt) for i in range(num_trials)]
+        return dict([(name, np.concatenate([states[name] for states in trial_states])) for name in trial_states[0]])
+
+    # Floats are much faster than one element arrays when there is a single trial
+    if num_trials==1:
+        inputs=(eta*x[0,:]).tolist()
+        s, f_in, v, q = 0.0, 1.0, 1.0, 1.0
+    else:
+        inputs=eta*x.T
+        s, f_in, v, q = np.zeros(num_trials), np.ones(num_trials), np.ones(num_trials), np.ones(num_trials)
+
+    s_rec=[]
+    f_in_rec=[]
+    v_rec=[]
+    q_rec=[]
+    for u in inputs:
+        f_out=v**inv_alpha
+        o_e=1.0-(1.0-e_base)**(1.0/f_in)
+        s, f_in, v, q = s+dt*(u-s/tau_s-(f_in-1.0)/tau_f), f_in+dt*s, v+dt*(f_in-f_out)/tau_o,\
+                        q+dt*((f_in*o_e/e_base)-f_out*q/v)/tau_o
+        s_rec.append(s)
+        f_in_rec.append(f_in)
+        v_rec.append(v)
+        q_rec.append(q)
+
+    states={}
+    for name,rec in [('s',s_rec),('f_in',f_in_rec),('v',v_rec),('q',q_rec)]:
+        states[name]=np.reshape(np.array(rec), (num_steps,num_trials)).T
+    return states
+
+def get_bold_kernels(params, num_steps, dt):
+    """
+    Get the impulse response of each balloon model state variable, linearized around rest
+    params = voxel parameters
+    num_steps = length of the impulse responses
+    dt = time step (seconds)
+    """
+    key=(tuple(sorted(get_bold_constants(params).items())), num_steps, dt)
+    if not key in bold_kernels:
+        # Response to a small impulse
+        delta=1e-6
+        x=np.zeros((1,num_steps))
+        x[0,0]=delta
+        states=integrate_balloon(x, params, dt)
+        rest={'s': 0.0, 'f_in': 1.0, 'v': 1.0, 'q': 1.0}
+        bold_kernels[key]=dict([(name, (states[name][0,:]-rest[name])/delta) for name in rest])
+    return bold_kernels[key]
+
+def convolve_bold_kernels(x, params, dt):
+    """
+    Compute the balloon model state variables by convolving the input with the linearized impulse responses
+    x = normalized synaptic input (trials x time)
+    params = voxel parameters
+    dt = time step (seconds)
+    Returns dictionary of state variable -> values (trials x time)
+    """
+    num_steps=x.shape[1]
+    kernels=get_bold_kernels(params, num_steps, dt)
+    n_fft=2**int(np.ceil(np.log2(2*num_steps)))
+    x_fft=np.fft.rfft(x, n=n_fft, axis=1)
+    rest={'s': 0.0, 'f_in': 1.0, 'v': 1.0, 'q': 1.0}
+    states={}
+    for name,kernel in kernels.iteritems():
+        states[name]=rest[name]+np.fft.irfft(x_fft*np.fft.rfft(kernel, n=n_fft), n=n_fft, axis=1)[:,:num_steps]
+    return states
+
+def get_bold_duration(trial_duration):
+    """
+    Duration to compute the BOLD signal for - at least 10s, and 6s after the end of the trial
+    """
     bold_trial_duration=10*second
     if trial_duration+6*second>bold_trial_duration:
         bold_trial_duration=trial_duration+6*second
-    net.run(bold_trial_duration)
+    return bold_trial_duration
+
+def get_bold_signal(g_total, voxel_params, baseline_range, trial_duration, dt=1*ms, linear=False):
+    """
+    Compute the BOLD signal produced by the balloon model of Voxel in response to its total synaptic conductance.
+    Before baseline_range[0] and after the end of g_total, the voxel gets the mean conductance in baseline_range.
+    g_total = total synaptic conductance, one value per time step (time, or trials x time for a batch of trials)
+    voxel_params = voxel parameters
+    baseline_range = range of time steps to compute the baseline conductance over
+    trial_duration = duration of the trial
+    dt = time step of g_total
+    linear = convolve with the linearized impulse response instead of integrating the balloon model if true -
+             accurate for small deviations from baseline
+    Returns dictionary of state variable (G_total, s, f_in, v, f_out, q, y) -> StateRecord
+    """
+    g_total=np.atleast_2d(np.array(g_total, dtype=float))
+    num_steps=int(get_bold_duration(trial_duration)/dt)
+
+    G_base=g_total[:,baseline_range[0]:baseline_range[1]].mean(axis=1)
+    G_total=np.tile(G_base, (num_steps,1)).T
+    end_idx=min(num_steps, g_total.shape[1])
+    G_total[:,baseline_range[0]:end_idx]=g_total[:,baseline_range[0]:end_idx]
+    x=(G_total-G_base[:,np.newaxis])/G_base[:,np.newaxis]
+
+    if linear:
+        states=convolve_bold_kernels(x, voxel_params, float(dt))
+    else:
+        states=integrate_balloon(x, voxel_params, float(dt))
+
+    c=get_bold_constants(voxel_params)
+    states['G_total']=G_total
+    states['f_out']=states['v']**(1.0/c['alpha'])
+    states['y']=c['v_base']*((c['k1']+c['k2'])*(1.0-states['q'])-(c['k2']+c['k3'])*(1.0-states['v']))
 
-    return voxel_monitor
\ No newline at end of file
+    times=np.arange(num_steps)*float(dt)
+    return dict([(name, StateRecord(times, values)) for name,values in states.iteritems()])
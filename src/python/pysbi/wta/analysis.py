@@ -18,8 +18,11 @@ import sys
 from pysbi import  voxel
 from pysbi.config import DATA_DIR, TEMPLATE_DIR
 from pysbi.reports.utils import make_report_dirs
+from pysbi.util.lazy_hdf5 import LazyDatasets, LazyDatasetList
+from pysbi.util.spikes import SpikeIndex
 from pysbi.util.utils import Struct, save_to_png, save_to_eps, weibull, rt_function, get_response_time, FitWeibull, FitRT
 from pysbi.wta import network
+from pysbi.wta.bold import read_bold
 from pysbi.wta.network import run_wta
 
 
@@ -39,9 +42,26 @@ def parse_output_file_name(output_file):
     return num_groups,input_pattern,duration,p_b_e,p_x_e,p_e_e,p_e_i,p_i_i,p_i_e,p_dcs,i_dcs
 
 class FileInfo():
-    def __init__(self, file_name, upper_resp_threshold=30, lower_resp_threshold=None, dt=.1*ms):
+    def __init__(self, file_name, upper_resp_threshold=30, lower_resp_threshold=None, dt=.1*ms, bold_file=None,
+                 lazy=False, mmap=False, group=None):
+        """
+        Load a trial data file
+        bold_file = file of recomputed BOLD signals (written by pysbi.wta.bold) to use instead of the BOLD signal
+                    recorded in the trial file
+        lazy = only read LFP, voxel, neuron state, and spike data when they are first accessed if true
+        mmap = memory-map lazily read datasets that are stored contiguously if true
+        group = path of the trial in the file if it is a sweep store (written by pysbi.wta.sweep_store)
+        """
         self.file_name=file_name
-        f = h5py.File(file_name)
+        self.lazy=lazy
+        self.mmap=mmap
+        self.group=group
+        if group is None:
+            f_file = h5py.File(file_name)
+            f = f_file
+        else:
+            f_file = h5py.File(file_name, 'r')
+            f = f_file[group]
 
         self.num_groups=int(f.attrs['num_groups'])
         self.input_freq=np.array(f.attrs['input_freq'])
@@ -102,8 +122,7 @@ class FileInfo():
         
         self.lfp_rec=None
         if 'lfp' in f:
-            f_lfp=f['lfp']
-            self.lfp_rec={'lfp': np.array(f_lfp['lfp'])}
+            self.lfp_rec=self.read_records(f, 'lfp', ['lfp'])
 
         if 'voxel' in f:
             f_vox=f['voxel']
@@ -141,58 +160,39 @@ class FileInfo():
 
             self.voxel_rec={}
             if 'total_syn' in f_vox:
-                total_vox=f_vox['total_syn']
-                if 'G_total' in total_vox:
-                    self.voxel_rec['G_total']=np.array(total_vox['G_total'])
-                if 's' in total_vox:
-                    self.voxel_rec['s']=np.array(total_vox['s'])
-                if 'f_in' in total_vox:
-                    self.voxel_rec['f_in']=np.array(total_vox['f_in'])
-                if 'v' in total_vox:
-                    self.voxel_rec['v']=np.array(total_vox['v'])
-                if 'q' in total_vox:
-                    self.voxel_rec['q']=np.array(total_vox['q'])
-                if 'y' in total_vox:
-                    self.voxel_rec['y']=np.array(total_vox['y'])
+                self.voxel_rec=self.read_records(f, 'voxel/total_syn', ['G_total','s','f_in','v','q','y'])
 
             self.voxel_exc_rec={}
             if 'exc_syn' in f_vox:
-                exc_vox=f_vox['exc_syn']
-                if 'G_total' in exc_vox:
-                    self.voxel_exc_rec['G_total']=np.array(exc_vox['G_total'])
-                if 's' in exc_vox:
-                    self.voxel_exc_rec['s']=np.array(exc_vox['s'])
-                if 'f_in' in exc_vox:
-                    self.voxel_exc_rec['f_in']=np.array(exc_vox['f_in'])
-                if 'v' in exc_vox:
-                    self.voxel_exc_rec['v']=np.array(exc_vox['v'])
-                if 'q' in exc_vox:
-                    self.voxel_exc_rec['q']=np.array(exc_vox['q'])
-                if 'y' in exc_vox:
-                    self.voxel_exc_rec['y']=np.array(exc_vox['y'])
+                self.voxel_exc_rec=self.read_records(f, 'voxel/exc_syn', ['G_total','s','f_in','v','q','y'])
+
+            if bold_file is not None:
+                total_states,exc_states=read_bold(bold_file, file_name if group is None else group)
+                if total_states is not None:
+                    self.voxel_rec.update(total_states)
+                if exc_states is not None:
+                    self.voxel_exc_rec.update(exc_states)
 
         self.neural_state_rec=None
         if 'neuron_state' in f:
-            f_state=f['neuron_state']
-            self.neural_state_rec={'g_ampa_r': np.array(f_state['g_ampa_r']),
-                                   'g_ampa_x': np.array(f_state['g_ampa_x']),
-                                   'g_ampa_b': np.array(f_state['g_ampa_b']),
-                                   'g_nmda':   np.array(f_state['g_nmda']),
-                                   'g_gaba_a': np.array(f_state['g_gaba_a']),
-                                   #'g_gaba_b': np.array(f_state['g_gaba_b']),
-                                   'vm':       np.array(f_state['vm']),
-                                   'record_idx': np.array(f_state['record_idx'])}
+            self.neural_state_rec=self.read_records(f, 'neuron_state', ['g_ampa_r','g_ampa_x','g_ampa_b','g_nmda',
+                                                                         'g_gaba_a',#'g_gaba_b',
+                                                                         'vm','record_idx'], required=True)
 
         self.e_firing_rates=None
         self.i_firing_rates=None
         self.rt=None
         self.choice=None
+        self.rate_dt=dt
         if 'firing_rates' in f:
             f_rates=f['firing_rates']
             self.e_firing_rates=np.array(f_rates['e_rates'])
             self.i_firing_rates=np.array(f_rates['i_rates'])
+            # Rates may have been recorded at a lower resolution
+            if 'dt' in f_rates.attrs:
+                self.rate_dt=float(f_rates.attrs['dt'])*second
             self.rt,self.choice=get_response_time(self.e_firing_rates, self.stim_start_time, self.stim_end_time,
-                upper_threshold=upper_resp_threshold, lower_threshold=lower_resp_threshold, dt=dt)
+                upper_threshold=upper_resp_threshold, dt=self.rate_dt)
 
         self.background_rate=None
         if 'background_rate' in f:
@@ -208,22 +208,27 @@ class FileInfo():
         self.e_spike_times=None
         self.i_spike_neurons=None
         self.i_spike_times=None
+        self.e_spike_offsets=None
+        self.i_spike_offsets=None
         if 'spikes' in f:
             f_spikes=f['spikes']
-            self.e_spike_neurons=[]
-            self.e_spike_times=[]
-            self.i_spike_neurons=[]
-            self.i_spike_times=[]
+            e_names=[]
+            i_names=[]
             for idx in range(self.num_groups):
                 if ('e.%d.spike_neurons' % idx) in f_spikes:
-                    self.e_spike_neurons.append(np.array(f_spikes['e.%d.spike_neurons' % idx]))
-                    self.e_spike_times.append(np.array(f_spikes['e.%d.spike_times' % idx]))
+                    e_names.append('e.%d' % idx)
                 if ('i.%d.spike_neurons' % idx) in f_spikes:
-                    self.i_spike_neurons.append(np.array(f_spikes['i.%d.spike_neurons' % idx]))
-                    self.i_spike_times.append(np.array(f_spikes['i.%d.spike_times' % idx]))
+                    i_names.append('i.%d' % idx)
             if 'i.spike_neurons' in f_spikes:
-                self.i_spike_neurons.append(np.array(f_spikes['i.spike_neurons']))
-                self.i_spike_times.append(np.array(f_spikes['i.spike_times']))
+                i_names.append('i')
+            self.e_spike_neurons=self.read_record_list(f, ['spikes/%s.spike_neurons' % name for name in e_names])
+            self.e_spike_times=self.read_record_list(f, ['spikes/%s.spike_times' % name for name in e_names])
+            self.i_spike_neurons=self.read_record_list(f, ['spikes/%s.spike_neurons' % name for name in i_names])
+            self.i_spike_times=self.read_record_list(f, ['spikes/%s.spike_times' % name for name in i_names])
+            # Files written with spikes sorted by neuron have an offsets index
+            if all([('%s.spike_offsets' % name) in f_spikes for name in e_names+i_names]):
+                self.e_spike_offsets=self.read_record_list(f, ['spikes/%s.spike_offsets' % name for name in e_names])
+                self.i_spike_offsets=self.read_record_list(f, ['spikes/%s.spike_offsets' % name for name in i_names])
 
         self.summary_data=Struct()
         if 'summary' in f:
@@ -235,8 +240,8 @@ class FileInfo():
             self.summary_data.bold_max=np.array(f_summary['bold_max'])
             self.summary_data.bold_exc_max=np.array(f_summary['bold_exc_max'])
         else:
-            end_idx=int(self.stim_end_time/dt)
-            start_idx=end_idx-1000
+            end_idx=int(self.stim_end_time/self.rate_dt)
+            start_idx=end_idx-int(round(1000*dt/self.rate_dt))
             e_mean_final=[]
             e_max=[]
             for i in range(self.e_firing_rates.shape[0]):
@@ -258,7 +263,92 @@ class FileInfo():
             if hasattr(self,'voxel_exc_rec'):
                 self.summary_data.bold_exc_max=np.max(self.voxel_exc_rec['y'])
 
-        f.close()
+        f_file.close()
+
+        # Don't keep data read to compute the summary
+        if self.lazy:
+            self.evict()
+
+    def read_records(self, f, group_path, names, required=False):
+        """
+        Read datasets of a group - returns a dictionary of name -> data, which is only read when first accessed if
+        this file is loaded lazily
+        f = open file
+        group_path = path of the group
+        names = names of datasets to read
+        required = raise an error if a dataset is missing if true, otherwise skip it
+        """
+        f_group=f[group_path]
+        missing=[name for name in names if not name in f_group]
+        if required and len(missing):
+            raise KeyError('Missing datasets in %s: %s' % (group_path, ', '.join(missing)))
+        names=[name for name in names if name in f_group]
+        if self.lazy:
+            return LazyDatasets(self.file_name, dict([(name, self.get_path('%s/%s' % (group_path, name)))
+                                                      for name in names]), mmap=self.mmap)
+        return dict([(name, np.array(f_group[name])) for name in names])
+
+    def read_record_list(self, f, paths):
+        """
+        Read a list of datasets - only read when first accessed if this file is loaded lazily
+        f = open file
+        paths = path of each dataset
+        """
+        if self.lazy:
+            return LazyDatasetList(self.file_name, [self.get_path(path) for path in paths], mmap=self.mmap)
+        return [np.array(f[path]) for path in paths]
+
+    def get_path(self, path):
+        """
+        Get the path of a dataset in the file
+        path = path of the dataset in the trial
+        """
+        if self.group is None:
+            return path
+        return '%s/%s' % (self.group, path)
+
+    def get_spike_index(self, population, idx):
+        """
+        Get the spikes of a population indexed by neuron
+        population = 'e' or 'i'
+        idx = index of the population in the spike lists
+        """
+        neurons=getattr(self, '%s_spike_neurons' % population)[idx]
+        times=getattr(self, '%s_spike_times' % population)[idx]
+        offsets=getattr(self, '%s_spike_offsets' % population)
+        if offsets is not None:
+            return SpikeIndex(offsets[idx], times)
+        if population=='e':
+            num_neurons=int(self.network_group_size*.8/self.num_groups)
+        else:
+            num_neurons=int(self.network_group_size*.2)
+        return SpikeIndex.from_spikes(neurons, times, num_neurons=num_neurons)
+
+    def evict(self):
+        """
+        Release lazily read data - it will be read again when next accessed
+        """
+        for rec in [self.lfp_rec, getattr(self, 'voxel_rec', None), getattr(self, 'voxel_exc_rec', None),
+                    self.neural_state_rec, self.e_spike_neurons, self.e_spike_times, self.i_spike_neurons,
+                    self.i_spike_times, self.e_spike_offsets, self.i_spike_offsets]:
+            if isinstance(rec, LazyDatasets) or isinstance(rec, LazyDatasetList):
+                rec.evict()
+
+
+def load_trial(prefix, contrast, trial, store=None, **kwargs):
+    """
+    Load a trial from its data file or from a sweep store
+    prefix = trial file prefix
+    store = SweepStore to load the trial from (if None, or the store only indexes trial files, the trial data file is
+            loaded)
+    kwargs = arguments passed to FileInfo
+    """
+    if store is None or not store.has_trials:
+        return FileInfo('%s.contrast.%0.4f.trial.%d.h5' % (prefix, contrast, trial), **kwargs)
+    group=store.get_trial_group(prefix, contrast, trial)
+    if group is None:
+        raise IOError('Trial not in store %s: %s.contrast.%0.4f.trial.%d' % (store.store_file, prefix, contrast, trial))
+    return FileInfo(store.store_file, group=group, **kwargs)
 
 
 def is_valid(high_contrast_e_rates, low_contrast_e_rates):
@@ -307,245 +397,111 @@ def run_posthoc_bayes_analysis(summary_file_name, perf_threshold, r_sqr_threshol
         p_i_e_range, p_i_i_range, p_x_e_range, perf_threshold, r_sqr_threshold)
 
 
+# Names of the swept parameters, in the order of the axes of summary arrays
+bayes_param_names=['p_b_e', 'p_x_e', 'p_e_e', 'p_e_i', 'p_i_i', 'p_i_e']
+
 def run_bayesian_analysis(auc, slope, intercept, r_sqr, num_trials, p_b_e_range, p_e_e_range, p_e_i_range, p_i_e_range,
                           p_i_i_range, p_x_e_range, perf_threshold=0.75, r_sqr_threshold=0.2):
+    param_ranges=[p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range]
+    if auc.shape!=tuple([len(param_range) for param_range in param_ranges]):
+        raise ValueError('Summary arrays of shape %s do not match the parameter ranges' % str(auc.shape))
+    return run_grid_bayesian_analysis(auc, slope, r_sqr, bayes_param_names, perf_threshold=perf_threshold,
+        r_sqr_threshold=r_sqr_threshold)
+
+
+def run_grid_bayesian_analysis(auc, slope, r_sqr, param_names, perf_threshold=0.75, r_sqr_threshold=0.2):
+    """
+    Bayesian analysis of a grid of parameter values with any number of dimensions. Level 1 models are whether or not
+    the network performs above threshold (AUC), level 2 models are the sign of the BOLD regression slope.
+    auc = AUC at each grid point
+    slope = regression slope at each grid point
+    r_sqr = regression r^2 at each grid point
+    param_names = name of the parameter of each grid axis
+    """
     bayes_analysis = Struct()
-    # p(AUC | p_b_e, p_x_e, p_e_e, p_e_i, p_i_i, p_i_e, M)
+    valid_slope=~np.isnan(slope)
     # p(AUC | theta, M)
-    bayes_analysis.l1_pos_likelihood = np.zeros(auc.shape)
-    bayes_analysis.l1_neg_likelihood = np.zeros(auc.shape)
-    bayes_analysis.l1_dist=[]
-    bayes_analysis.l1_pos_dist=[]
-    bayes_analysis.l1_neg_dist=[]
-    for i, p_b_e in enumerate(p_b_e_range):
-        for j, p_x_e in enumerate(p_x_e_range):
-            for k, p_e_e in enumerate(p_e_e_range):
-                for l, p_e_i in enumerate(p_e_i_range):
-                    for m, p_i_i in enumerate(p_i_i_range):
-                        for n, p_i_e in enumerate(p_i_e_range):
-                            if not math.isnan(slope[i,j,k,l,m,n]):
-                                bayes_analysis.l1_dist.append(slope[i,j,k,l,m,n])
-                            if auc[i, j, k, l, m, n] >= perf_threshold:
-                                if not math.isnan(slope[i,j,k,l,m,n]):
-                                    bayes_analysis.l1_pos_dist.append(slope[i,j,k,l,m,n])
-                                bayes_analysis.l1_pos_likelihood[i, j, k, l, m, n] = 1.0
-                            else:
-                                if not math.isnan(slope[i,j,k,l,m,n]):
-                                    bayes_analysis.l1_neg_dist.append(slope[i,j,k,l,m,n])
-                                bayes_analysis.l1_neg_likelihood[i, j, k, l, m, n] = 1.0
-
-    # Number of parameter values tested
-    n_param_vals = len(p_b_e_range) * len(p_x_e_range) * len(p_e_e_range) * len(p_e_i_range) * len(p_i_i_range) * len(
-        p_i_e_range)
+    l1_pos=auc>=perf_threshold
+    l1_neg=~l1_pos
+    bayes_analysis.l1_pos_likelihood = l1_pos.astype(float)
+    bayes_analysis.l1_neg_likelihood = l1_neg.astype(float)
+    bayes_analysis.l1_dist=list(slope[valid_slope])
+    bayes_analysis.l1_pos_dist=list(slope[valid_slope & l1_pos])
+    bayes_analysis.l1_neg_dist=list(slope[valid_slope & l1_neg])
+
     # Priors are uniform
-    # p(p_b_e, p_x_e, p_e_e, p_e_i, p_i_i, p_i_e | M)
     # p(theta | M)
-    bayes_analysis.l1_pos_priors = np.ones([len(p_b_e_range), len(p_x_e_range), len(p_e_e_range), len(p_e_i_range),
-                                            len(p_i_i_range), len(p_i_e_range)]) * 1.0 / float(n_param_vals)
-    bayes_analysis.l1_neg_priors = np.ones([len(p_b_e_range), len(p_x_e_range), len(p_e_e_range), len(p_e_i_range),
-                                            len(p_i_i_range), len(p_i_e_range)]) * 1.0 / float(n_param_vals)
+    bayes_analysis.l1_pos_priors = np.ones(auc.shape) / float(auc.size)
+    bayes_analysis.l1_neg_priors = np.ones(auc.shape) / float(auc.size)
     # p(AUC | M) = INT( p(AUC | theta, M)*p(theta | M) d theta
     bayes_analysis.l1_pos_evidence = np.sum(bayes_analysis.l1_pos_likelihood * bayes_analysis.l1_pos_priors)
     bayes_analysis.l1_neg_evidence = np.sum(bayes_analysis.l1_neg_likelihood * bayes_analysis.l1_neg_priors)
-    # p(p_b_e, p_x_e, p_e_e, p_e_i, p_i_i, p_i_e | AUC, M)
+    # p(theta | AUC, M)
     bayes_analysis.l1_pos_posterior = (bayes_analysis.l1_pos_likelihood * bayes_analysis.l1_pos_priors) / bayes_analysis.l1_pos_evidence
     bayes_analysis.l1_neg_posterior = (bayes_analysis.l1_neg_likelihood * bayes_analysis.l1_neg_priors) / bayes_analysis.l1_neg_evidence
-    bayes_analysis.l1_pos_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_pos_priors, bayes_analysis.l1_pos_likelihood,
-        bayes_analysis.l1_pos_posterior, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_neg_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_neg_priors, bayes_analysis.l1_neg_likelihood,
-        bayes_analysis.l1_neg_posterior, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range)
+    bayes_analysis.l1_pos_marginals = get_marginals(bayes_analysis.l1_pos_priors, bayes_analysis.l1_pos_likelihood,
+        bayes_analysis.l1_pos_posterior, param_names)
+    bayes_analysis.l1_neg_marginals = get_marginals(bayes_analysis.l1_neg_priors, bayes_analysis.l1_neg_likelihood,
+        bayes_analysis.l1_neg_posterior, param_names)
 
     bayes_analysis.l1_pos_l2_priors = bayes_analysis.l1_pos_posterior
     bayes_analysis.l1_neg_l2_priors = bayes_analysis.l1_neg_posterior
 
-    bayes_analysis.l1_pos_l2_neg_likelihood = np.zeros(bayes_analysis.l1_pos_likelihood.shape)
-    bayes_analysis.l1_pos_l2_pos_likelihood = np.zeros(bayes_analysis.l1_pos_likelihood.shape)
-    bayes_analysis.l1_pos_l2_zero_likelihood = np.zeros(bayes_analysis.l1_pos_likelihood.shape)
-    bayes_analysis.l1_neg_l2_neg_likelihood = np.zeros(bayes_analysis.l1_neg_likelihood.shape)
-    bayes_analysis.l1_neg_l2_pos_likelihood = np.zeros(bayes_analysis.l1_neg_likelihood.shape)
-    bayes_analysis.l1_neg_l2_zero_likelihood = np.zeros(bayes_analysis.l1_neg_likelihood.shape)
-
-    for i, p_b_e in enumerate(p_b_e_range):
-        for j, p_x_e in enumerate(p_x_e_range):
-            for k, p_e_e in enumerate(p_e_e_range):
-                for l, p_e_i in enumerate(p_e_i_range):
-                    for m, p_i_i in enumerate(p_i_i_range):
-                        for n, p_i_e in enumerate(p_i_e_range):
-                            if r_sqr[i,j,k,l,m,n] > r_sqr_threshold:
-                                if slope[i,j,k,l,m,n] > 0.0:
-                                    bayes_analysis.l1_pos_l2_pos_likelihood[i, j, k, l, m, n] = 1.0
-                                    bayes_analysis.l1_neg_l2_pos_likelihood[i, j, k, l, m, n] = 1.0
-                                elif slope[i,j,k,l,m,n] < 0.0:
-                                    bayes_analysis.l1_pos_l2_neg_likelihood[i, j, k, l, m, n] = 1.0
-                                    bayes_analysis.l1_neg_l2_neg_likelihood[i, j, k, l, m, n] = 1.0
-                                else:
-                                    bayes_analysis.l1_pos_l2_zero_likelihood[i, j, k, l, m, n] = 1.0
-                                    bayes_analysis.l1_neg_l2_zero_likelihood[i, j, k, l, m, n] = 1.0
-                            else:
-                                bayes_analysis.l1_pos_l2_zero_likelihood[i, j, k, l, m, n] = 1.0
-                                bayes_analysis.l1_neg_l2_zero_likelihood[i, j, k, l, m, n] = 1.0
-
-    bayes_analysis.l1_pos_l2_pos_evidence = np.sum(bayes_analysis.l1_pos_l2_pos_likelihood * bayes_analysis.l1_pos_l2_priors)
-    bayes_analysis.l1_pos_l2_neg_evidence = np.sum(bayes_analysis.l1_pos_l2_neg_likelihood * bayes_analysis.l1_pos_l2_priors)
-    bayes_analysis.l1_pos_l2_zero_evidence = np.sum(bayes_analysis.l1_pos_l2_zero_likelihood * bayes_analysis.l1_pos_l2_priors)
-    bayes_analysis.l1_neg_l2_pos_evidence = np.sum(bayes_analysis.l1_neg_l2_pos_likelihood * bayes_analysis.l1_neg_l2_priors)
-    bayes_analysis.l1_neg_l2_neg_evidence = np.sum(bayes_analysis.l1_neg_l2_neg_likelihood * bayes_analysis.l1_neg_l2_priors)
-    bayes_analysis.l1_neg_l2_zero_evidence = np.sum(bayes_analysis.l1_neg_l2_zero_likelihood * bayes_analysis.l1_neg_l2_priors)
-
-    bayes_analysis.l1_pos_l2_pos_posterior = np.zeros(bayes_analysis.l1_pos_l2_pos_likelihood.shape)
-    if bayes_analysis.l1_pos_l2_pos_evidence>0:
-        bayes_analysis.l1_pos_l2_pos_posterior = (bayes_analysis.l1_pos_l2_pos_likelihood * bayes_analysis.l1_pos_l2_priors) / bayes_analysis.l1_pos_l2_pos_evidence
-    bayes_analysis.l1_pos_l2_neg_posterior = np.zeros(bayes_analysis.l1_pos_l2_neg_likelihood.shape)
-    if bayes_analysis.l1_pos_l2_neg_evidence>0:
-        bayes_analysis.l1_pos_l2_neg_posterior = (bayes_analysis.l1_pos_l2_neg_likelihood * bayes_analysis.l1_pos_l2_priors) / bayes_analysis.l1_pos_l2_neg_evidence
-    bayes_analysis.l1_pos_l2_zero_posterior = np.zeros(bayes_analysis.l1_pos_l2_zero_likelihood.shape)
-    if bayes_analysis.l1_pos_l2_zero_evidence>0:
-        bayes_analysis.l1_pos_l2_zero_posterior = (bayes_analysis.l1_pos_l2_zero_likelihood * bayes_analysis.l1_pos_l2_priors) / bayes_analysis.l1_pos_l2_zero_evidence
-    bayes_analysis.l1_neg_l2_pos_posterior = np.zeros(bayes_analysis.l1_neg_l2_pos_likelihood.shape)
-    if bayes_analysis.l1_neg_l2_pos_evidence>0:
-        bayes_analysis.l1_neg_l2_pos_posterior = (bayes_analysis.l1_neg_l2_pos_likelihood * bayes_analysis.l1_neg_l2_priors) / bayes_analysis.l1_neg_l2_pos_evidence
-    bayes_analysis.l1_neg_l2_neg_posterior = np.zeros(bayes_analysis.l1_neg_l2_neg_likelihood.shape)
-    if bayes_analysis.l1_neg_l2_neg_evidence>0:
-        bayes_analysis.l1_neg_l2_neg_posterior = (bayes_analysis.l1_neg_l2_neg_likelihood * bayes_analysis.l1_neg_l2_priors) / bayes_analysis.l1_neg_l2_neg_evidence
-    bayes_analysis.l1_neg_l2_zero_posterior = np.zeros(bayes_analysis.l1_neg_l2_zero_likelihood.shape)
-    if bayes_analysis.l1_neg_l2_zero_evidence>0:
-        bayes_analysis.l1_neg_l2_zero_posterior = (bayes_analysis.l1_neg_l2_zero_likelihood * bayes_analysis.l1_neg_l2_priors) / bayes_analysis.l1_neg_l2_zero_evidence
-
-    bayes_analysis.l1_pos_l2_neg_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_pos_l2_priors,
-        bayes_analysis.l1_pos_l2_neg_likelihood, bayes_analysis.l1_pos_l2_neg_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_pos_l2_pos_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_pos_l2_priors,
-        bayes_analysis.l1_pos_l2_pos_likelihood, bayes_analysis.l1_pos_l2_pos_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_pos_l2_zero_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_pos_l2_priors,
-        bayes_analysis.l1_pos_l2_zero_likelihood, bayes_analysis.l1_pos_l2_zero_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_neg_l2_neg_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_neg_l2_priors,
-        bayes_analysis.l1_neg_l2_neg_likelihood, bayes_analysis.l1_neg_l2_neg_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_neg_l2_pos_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_neg_l2_priors,
-        bayes_analysis.l1_neg_l2_pos_likelihood, bayes_analysis.l1_neg_l2_pos_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
-    bayes_analysis.l1_neg_l2_zero_marginals = run_bayesian_marginal_analysis(bayes_analysis.l1_neg_l2_priors,
-        bayes_analysis.l1_neg_l2_zero_likelihood, bayes_analysis.l1_neg_l2_zero_posterior, p_b_e_range, p_x_e_range, p_e_e_range,
-        p_e_i_range, p_i_i_range, p_i_e_range)
+    # Slopes of regressions that don't explain enough variance count as zero
+    significant=r_sqr>r_sqr_threshold
+    l2_likelihoods={
+        'pos': (significant & (slope>0.0)).astype(float),
+        'neg': (significant & (slope<0.0)).astype(float)
+    }
+    l2_likelihoods['zero']=1.0-l2_likelihoods['pos']-l2_likelihoods['neg']
+
+    for l1 in ['pos', 'neg']:
+        l2_priors=getattr(bayes_analysis, 'l1_%s_l2_priors' % l1)
+        for l2 in ['pos', 'neg', 'zero']:
+            likelihood=np.array(l2_likelihoods[l2])
+            evidence=np.sum(likelihood * l2_priors)
+            posterior=np.zeros(likelihood.shape)
+            if evidence>0:
+                posterior=(likelihood * l2_priors) / evidence
+            setattr(bayes_analysis, 'l1_%s_l2_%s_likelihood' % (l1, l2), likelihood)
+            setattr(bayes_analysis, 'l1_%s_l2_%s_evidence' % (l1, l2), evidence)
+            setattr(bayes_analysis, 'l1_%s_l2_%s_posterior' % (l1, l2), posterior)
+            setattr(bayes_analysis, 'l1_%s_l2_%s_marginals' % (l1, l2), get_marginals(l2_priors, likelihood, posterior,
+                param_names))
     return bayes_analysis
 
 
 def run_bayesian_marginal_analysis(priors, likelihood, posterior, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range,
                                    p_i_i_range, p_i_e_range):
-    marginal_analysis=Struct()
+    return get_marginals(priors, likelihood, posterior, bayes_param_names)
 
-    marginal_analysis.posterior_p_b_e=np.zeros([len(p_b_e_range)])
-    marginal_analysis.posterior_p_x_e=np.zeros([len(p_x_e_range)])
-    marginal_analysis.posterior_p_e_e=np.zeros([len(p_e_e_range)])
-    marginal_analysis.posterior_p_e_i=np.zeros([len(p_e_i_range)])
-    marginal_analysis.posterior_p_i_i=np.zeros([len(p_i_i_range)])
-    marginal_analysis.posterior_p_i_e=np.zeros([len(p_i_e_range)])
-    marginal_analysis.prior_p_b_e=np.zeros([len(p_b_e_range)])
-    marginal_analysis.prior_p_x_e=np.zeros([len(p_x_e_range)])
-    marginal_analysis.prior_p_e_e=np.zeros([len(p_e_e_range)])
-    marginal_analysis.prior_p_e_i=np.zeros([len(p_e_i_range)])
-    marginal_analysis.prior_p_i_i=np.zeros([len(p_i_i_range)])
-    marginal_analysis.prior_p_i_e=np.zeros([len(p_i_e_range)])
-    marginal_analysis.likelihood_p_b_e=np.zeros([len(p_b_e_range)])
-    marginal_analysis.likelihood_p_x_e=np.zeros([len(p_x_e_range)])
-    marginal_analysis.likelihood_p_e_e=np.zeros([len(p_e_e_range)])
-    marginal_analysis.likelihood_p_e_i=np.zeros([len(p_e_i_range)])
-    marginal_analysis.likelihood_p_i_i=np.zeros([len(p_i_i_range)])
-    marginal_analysis.likelihood_p_i_e=np.zeros([len(p_i_e_range)])
-    for j,p_x_e in enumerate(p_x_e_range):
-        for k,p_e_e in enumerate(p_e_e_range):
-            for l,p_e_i in enumerate(p_e_i_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    for n,p_i_e in enumerate(p_i_e_range):
-                        marginal_analysis.posterior_p_b_e+=posterior[:,j,k,l,m,n]
-                        marginal_analysis.prior_p_b_e+=priors[:,j,k,l,m,n]
-                        marginal_analysis.likelihood_p_b_e+=likelihood[:,j,k,l,m,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for k,p_e_e in enumerate(p_e_e_range):
-            for l,p_e_i in enumerate(p_e_i_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    for n,p_i_e in enumerate(p_i_e_range):
-                        marginal_analysis.posterior_p_x_e+=posterior[i,:,k,l,m,n]
-                        marginal_analysis.prior_p_x_e+=priors[i,:,k,l,m,n]
-                        marginal_analysis.likelihood_p_x_e+=likelihood[i,:,k,l,m,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for l,p_e_i in enumerate(p_e_i_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    for n,p_i_e in enumerate(p_i_e_range):
-                        marginal_analysis.posterior_p_e_e+=posterior[i,j,:,l,m,n]
-                        marginal_analysis.prior_p_e_e+=priors[i,j,:,l,m,n]
-                        marginal_analysis.likelihood_p_e_e+=likelihood[i,j,:,l,m,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for l,p_e_i in enumerate(p_e_i_range):
-                    for m,p_i_i in enumerate(p_i_i_range):
-                        marginal_analysis.posterior_p_i_e+=posterior[i,j,k,l,m,:]
-                        marginal_analysis.prior_p_i_e+=priors[i,j,k,l,m,:]
-                        marginal_analysis.likelihood_p_i_e+=likelihood[i,j,k,l,m,:]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for l,p_e_i in enumerate(p_e_i_range):
-                    for n,p_i_e in enumerate(p_i_e_range):
-                        marginal_analysis.posterior_p_i_i+=posterior[i,j,k,l,:,n]
-                        marginal_analysis.prior_p_i_i+=priors[i,j,k,l,:,n]
-                        marginal_analysis.likelihood_p_i_i+=likelihood[i,j,k,l,:,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    for n,p_i_e in enumerate(p_i_e_range):
-                        marginal_analysis.posterior_p_e_i+=posterior[i,j,k,:,m,n]
-                        marginal_analysis.prior_p_e_i+=priors[i,j,k,:,m,n]
-                        marginal_analysis.likelihood_p_e_i+=likelihood[i,j,k,:,m,n]
-
-    marginal_analysis.posterior_p_b_e_p_x_e=np.zeros([len(p_b_e_range), len(p_x_e_range)])
-    marginal_analysis.posterior_p_e_e_p_e_i=np.zeros([len(p_e_e_range), len(p_e_i_range)])
-    marginal_analysis.posterior_p_e_e_p_i_i=np.zeros([len(p_e_e_range), len(p_i_i_range)])
-    marginal_analysis.posterior_p_e_e_p_i_e=np.zeros([len(p_e_e_range), len(p_i_e_range)])
-    marginal_analysis.posterior_p_e_i_p_i_i=np.zeros([len(p_e_i_range), len(p_i_i_range)])
-    marginal_analysis.posterior_p_e_i_p_i_e=np.zeros([len(p_e_i_range), len(p_i_e_range)])
-    marginal_analysis.posterior_p_i_i_p_i_e=np.zeros([len(p_i_i_range), len(p_i_e_range)])
-    for k,p_e_e in enumerate(p_e_e_range):
-        for l,p_e_i in enumerate(p_e_i_range):
-            for m,p_i_i in enumerate(p_i_i_range):
-                for n,p_i_e in enumerate(p_i_e_range):
-                    marginal_analysis.posterior_p_b_e_p_x_e+=posterior[:,:,k,l,m,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for m,p_i_i in enumerate(p_i_i_range):
-                for n,p_i_e in enumerate(p_i_e_range):
-                    marginal_analysis.posterior_p_e_e_p_e_i+=posterior[i,j,:,:,m,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for l,p_e_i in enumerate(p_e_i_range):
-                for n,p_i_e in enumerate(p_i_e_range):
-                    marginal_analysis.posterior_p_e_e_p_i_i+=posterior[i,j,:,l,:,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for l,p_e_i in enumerate(p_e_i_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    marginal_analysis.posterior_p_e_e_p_i_e+=posterior[i,j,:,l,m,:]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for n,p_i_e in enumerate(p_i_e_range):
-                    marginal_analysis.posterior_p_e_i_p_i_i+=posterior[i,j,k,:,:,n]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for m,p_i_i in enumerate(p_i_i_range):
-                    marginal_analysis.posterior_p_e_i_p_i_e+=posterior[i,j,k,:,m,:]
-    for i,p_b_e in enumerate(p_b_e_range):
-        for j,p_x_e in enumerate(p_x_e_range):
-            for k,p_e_e in enumerate(p_e_e_range):
-                for l,p_e_i in enumerate(p_e_i_range):
-                    marginal_analysis.posterior_p_i_i_p_i_e+=posterior[i,j,k,l,:,:]
 
+def get_marginals(priors, likelihood, posterior, param_names):
+    """
+    Compute the 1-D marginal prior, likelihood, and posterior of each parameter, and the 2-D marginal posterior of each
+    pair of parameters (e.g. posterior_p_e_e_p_e_i)
+    priors, likelihood, posterior = arrays over the parameter grid
+    param_names = name of the parameter of each grid axis
+    """
+    marginal_analysis=Struct()
+    num_dims=len(param_names)
+    for i,param_name in enumerate(param_names):
+        other_axes=tuple([axis for axis in range(num_dims) if axis!=i])
+        setattr(marginal_analysis, 'prior_%s' % param_name, np.sum(priors, axis=other_axes))
+        setattr(marginal_analysis, 'likelihood_%s' % param_name, np.sum(likelihood, axis=other_axes))
+    for i in range(num_dims):
+        for j in range(i+1,num_dims):
+            other_axes=tuple([axis for axis in range(num_dims) if axis!=i and axis!=j])
+            setattr(marginal_analysis, 'posterior_%s_%s' % (param_names[i], param_names[j]),
+                np.sum(posterior, axis=other_axes))
+    # 1-D posterior marginals are reduced from 2-D marginals instead of the full grid
+    for i,param_name in enumerate(param_names):
+        if num_dims>1:
+            j=1 if i==0 else 0
+            pair_posterior=getattr(marginal_analysis, 'posterior_%s_%s' % (param_names[min(i,j)], param_names[max(i,j)]))
+            setattr(marginal_analysis, 'posterior_%s' % param_name, np.sum(pair_posterior, axis=1 if i<j else 0))
+        else:
+            setattr(marginal_analysis, 'posterior_%s' % param_name, np.array(posterior))
     return marginal_analysis
 
 
@@ -560,7 +516,7 @@ def get_lfp_signal(wta_data, plot=False):
         plt.show()
     return lfp
 
-def get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=.1*ms):
+def get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=.1*ms, store=None):
     l = []
     p = 0
     n = 0
@@ -568,7 +524,7 @@ def get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefi
         for trial in range(num_trials):
             data_path = '%s.contrast.%0.4f.trial.%d.h5' % (prefix, contrast, trial)
             print(data_path)
-            data = FileInfo(data_path)
+            data = load_trial(prefix, contrast, trial, store=store)
             stim_end_idx=(data.stim_end_time*dt)/second
             example = 0
             if data.input_freq[option_idx] > data.input_freq[1 - option_idx]:
@@ -603,14 +559,14 @@ def get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefi
     l_sorted = sorted(l, key=lambda example: example[1], reverse=True)
     return l_sorted, n, p
 
-def get_auc(prefix, contrast_range, num_trials, num_extra_trials, num_groups, dt=.1*ms):
+def get_auc(prefix, contrast_range, num_trials, num_extra_trials, num_groups, dt=.1*ms, store=None):
     total_auc=0
     total_p=0
     single_auc=[]
     single_p=[]
     for i in range(num_groups):
-        l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, i, prefix, dt=dt)
-        single_auc.append(get_auc_single_option(prefix, contrast_range, num_trials, num_extra_trials, i))
+        l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, i, prefix, dt=dt, store=store)
+        single_auc.append(get_auc_single_option(prefix, contrast_range, num_trials, num_extra_trials, i, store=store))
         single_p.append(p)
         total_p+=p
     for i in range(num_groups):
@@ -618,8 +574,8 @@ def get_auc(prefix, contrast_range, num_trials, num_extra_trials, num_groups, dt
 
     return total_auc
 
-def get_auc_single_option(prefix, contrast_range, num_trials, num_extra_trials, option_idx, dt=.1*ms):
-    l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=dt)
+def get_auc_single_option(prefix, contrast_range, num_trials, num_extra_trials, option_idx, dt=.1*ms, store=None):
+    l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=dt, store=store)
     fp=0
     tp=0
     fp_prev=0
@@ -640,9 +596,9 @@ def get_auc_single_option(prefix, contrast_range, num_trials, num_extra_trials,
     a=float(a)/(float(max(p,.001))*float(max(n,.001)))
     return a
 
-def get_roc_single_option(prefix, contrast_range, num_trials, num_extra_trials, option_idx, dt=.1*ms):
+def get_roc_single_option(prefix, contrast_range, num_trials, num_extra_trials, option_idx, dt=.1*ms, store=None):
 
-    l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=dt)
+    l_sorted, n, p = get_roc_init(contrast_range, num_trials, num_extra_trials, option_idx, prefix, dt=dt, store=store)
 
     fp=0
     tp=0
@@ -795,13 +751,16 @@ class TrialSeries:
     """
 
     def __init__(self, dir, prefix, num_trials, contrast_range=(0.0, 0.0625, 0.125, 0.25, 0.5, 1.0),
-                 upper_resp_threshold=30, lower_resp_threshold=None, dt=.1*ms):
+                 upper_resp_threshold=30, lower_resp_threshold=None, dt=.1*ms, bold_file=None, lazy=True, store=None):
         """
         Load trial data files
         dir = directory to load files from
         prefix = file prefix
         num_trials = number of trials per contrast level
         contrast_range = range of contrast values tested
+        bold_file = file of recomputed BOLD signals to use instead of the recorded BOLD signals
+        lazy = only read LFP, voxel, neuron state, and spike data of each trial when it is accessed if true
+        store = SweepStore to load trials from instead of trial data files in dir
         """
         self.contrast_range=contrast_range
         self.num_trials=num_trials
@@ -815,13 +774,16 @@ class TrialSeries:
 
                 file_name=os.path.join(dir,'%s.contrast.%0.4f.trial.%d.h5' % (prefix, contrast, trial_idx))
                 trial_summary=None
-                if not os.path.exists(file_name):
+                if store is None and not os.path.exists(file_name):
                     print('file does not exist: %s' % file_name)
+                elif store is not None and store.get_row(prefix, contrast, trial_idx) is None:
+                    print('trial not in store: %s' % file_name)
                 else:
                     try:
                         trial_summary=TrialSummary(contrast, trial_idx,
-                            FileInfo(file_name,upper_resp_threshold=upper_resp_threshold,
-                                lower_resp_threshold=lower_resp_threshold,  dt=dt), dt)
+                            load_trial(os.path.join(dir, prefix), contrast, trial_idx, store=store,
+                                upper_resp_threshold=upper_resp_threshold, lower_resp_threshold=lower_resp_threshold,
+                                dt=dt, bold_file=bold_file, lazy=lazy), dt)
                     except:
                         exc_type, exc_value, exc_traceback = sys.exc_info()
                         traceback.print_exception(exc_type, exc_value, exc_traceback,
@@ -1940,13 +1902,10 @@ class TrialReport:
 
 
 def get_fanos(spike_times, spike_neurons, num_neurons, start_time, end_time):
-    fano_factors=np.zeros(num_neurons)
-    for i in range(num_neurons):
-        idx=np.where((spike_times>=start_time) & (spike_times<end_time) & (spike_neurons==i))[0]
-        isis=np.array(np.diff([spike_times[j] for j in idx]))
-        if len(isis)>1:
-            fano_factors[i]=float(isis.std())/abs(float(isis.mean()))
-    return fano_factors
+    """
+    Coefficient of variation of the interspike intervals of each neuron in [start_time, end_time)
+    """
+    return SpikeIndex.from_spikes(spike_neurons, spike_times, num_neurons=num_neurons).isi_cvs(start_time, end_time)
 
 def test_fano3(file_name, time_window):
     data=FileInfo(file_name)
@@ -1958,12 +1917,14 @@ def test_fano3(file_name, time_window):
     slide_width=time_window/10.0
     e0_fanos=np.zeros((data.trial_duration/slide_width,e_size))
     e1_fanos=np.zeros((data.trial_duration/slide_width,e_size))
+    e0_spikes=data.get_spike_index('e',0)
+    e1_spikes=data.get_spike_index('e',1)
 
     while end_time<data.trial_duration:
         print(end_time)
-        e0_fanos[idx,:]=get_fanos(data.e_spike_times[0],data.e_spike_neurons[0],e_size,start_time,end_time)
+        e0_fanos[idx,:]=e0_spikes.isi_cvs(start_time,end_time)
 
-        e1_fanos[idx,:]=get_fanos(data.e_spike_times[1],data.e_spike_neurons[1],e_size,start_time,end_time)
+        e1_fanos[idx,:]=e1_spikes.isi_cvs(start_time,end_time)
 
         idx+=1
         start_time+=slide_width
@@ -1999,44 +1960,14 @@ def test_fano2(file_name, time_window):
     slide_width=10*ms
     e_0_fano=np.zeros((data.trial_duration/slide_width))
     e_1_fano=np.zeros((data.trial_duration/slide_width))
-    start_idx_1=0
-    start_idx_2=0
+    e0_spikes=data.get_spike_index('e',0)
+    e1_spikes=data.get_spike_index('e',1)
 
     while end_time<data.trial_duration:
         print(end_time)
-        # Analyze data for each specific neuron:
-        e0_timesDict = {}
-        e1_timesDict = {}
-        for neuron in range(e_size):
-            e0_timesDict[neuron] = []
-            e1_timesDict[neuron] = []
-        for bin in range(bins):
-            # We iterate over the bins to calculate the spike counts
-            lower_time = start_time+time_window/bins*bin
-            upper_time = start_time+time_window/bins*(bin+1)
-            for j in range(start_idx_1,len(data.e_spike_times[0])):
-                if lower_time > data.e_spike_times[0][j]*second:
-                    start_idx_1=j
-                if lower_time <= data.e_spike_times[0][j] * second < upper_time:
-                    e0_timesDict[data.e_spike_neurons[0][j]].append(data.e_spike_times[0][j])
-                elif data.e_spike_times[0][j]*second>upper_time:
-                    break
-
-            for j in range(start_idx_2,len(data.e_spike_times[1])):
-                if lower_time > data.e_spike_times[1][j]*second:
-                    start_idx_2=j
-                if lower_time <= data.e_spike_times[1][j] * second < upper_time:
-                    e1_timesDict[data.e_spike_neurons[1][j]].append(data.e_spike_times[1][j])
-                elif data.e_spike_times[1][j]*second>upper_time:
-                    break
-
-        e0_isis=[]
-        e1_isis=[]
-        for neuron in range(e_size):
-            e0_isis.extend(np.diff(e0_timesDict[neuron]))
-            e1_isis.extend(np.diff(e1_timesDict[neuron]))
-        e0_isis=np.array(e0_isis)
-        e1_isis=np.array(e1_isis)
+        # Interspike intervals of all neurons in the window
+        e0_neurons,e0_isis=e0_spikes.isis(start_time,start_time+time_window)
+        e1_neurons,e1_isis=e1_spikes.isis(start_time,start_time+time_window)
         if len(e0_isis)>1:
             e_0_fano[idx]=float(e0_isis.var())/abs(float(e0_isis.mean()))
         if len(e1_isis)>1:
@@ -2078,60 +2009,16 @@ def test_fano(file_name, time_window):
     e_0_fano=np.zeros((data.trial_duration/slide_width,int(data.network_group_size*.8/2)))
     e_1_fano=np.zeros((data.trial_duration/slide_width,int(data.network_group_size*.8/2)))
     i_fano=np.zeros((data.trial_duration/slide_width,int(data.network_group_size*.2)))
-
-    start_idx_1=0
-    start_idx_2=0
-    start_idx_3=0
+    e0_spikes=data.get_spike_index('e',0)
+    e1_spikes=data.get_spike_index('e',1)
+    i_spikes=data.get_spike_index('i',0)
 
     while end_time<data.trial_duration:
         print(end_time)
-        #for i in range(data.network_group_size):
-        # Arrays for binning of spike counts
-        e0_binned_spikes = np.zeros((int(data.network_group_size*.8/2),bins))
-        e1_binned_spikes = np.zeros((int(data.network_group_size*.8/2),bins))
-        i_binned_spikes = np.zeros((int(data.network_group_size*.2),bins))
-        for bin in range(bins):
-            # We iterate over the bins to calculate the spike counts
-            lower_time = start_time+time_window/bins*bin
-            upper_time = start_time+time_window/bins*(bin+1)
-            for j in range(start_idx_1,len(data.e_spike_times[0])):
-                if lower_time > data.e_spike_times[0][j]*second:
-                    start_idx_1=j
-                if lower_time <= data.e_spike_times[0][j] * second < upper_time:
-                    e0_binned_spikes[data.e_spike_neurons[0][j],bin]+=1.0
-                elif data.e_spike_times[0][j]*second>upper_time:
-                    break
-
-            for j in range(start_idx_2,len(data.e_spike_times[1])):
-                if lower_time > data.e_spike_times[1][j]*second:
-                    start_idx_2=j
-                if lower_time <= data.e_spike_times[1][j] * second < upper_time:
-                    e1_binned_spikes[data.e_spike_neurons[1][j],bin]+=1.0
-                elif data.e_spike_times[1][j]*second>upper_time:
-                    break
-
-            for j in range(start_idx_3,len(data.i_spike_times[0])):
-                if lower_time > data.i_spike_times[0][j]*second:
-                    start_idx_3=j
-                if lower_time <= data.i_spike_times[0][j] * second < upper_time:
-                    i_binned_spikes[data.i_spike_neurons[0][j],bin]+=1.0
-                elif data.i_spike_times[0][j]*second>upper_time:
-                    break
-
-        var = np.var(e0_binned_spikes,axis=1)
-        avg = np.mean(e0_binned_spikes,axis=1)
-        nz_idx=np.where(avg>0)
-        e_0_fano[idx,nz_idx[0]]=var[nz_idx[0]]/avg[nz_idx[0]]
-
-        var = np.var(e1_binned_spikes,axis=1)
-        avg = np.mean(e1_binned_spikes,axis=1)
-        nz_idx=np.where(avg>0)
-        e_1_fano[idx,nz_idx[0]]=var[nz_idx[0]]/avg[nz_idx[0]]
-
-        var = np.var(i_binned_spikes,axis=1)
-        avg = np.mean(i_binned_spikes,axis=1)
-        nz_idx=np.where(avg>0)
-        i_fano[idx,nz_idx[0]]=var[nz_idx[0]]/avg[nz_idx[0]]
+        # Fano factor of the spike counts of each neuron over the bins of the window
+        e_0_fano[idx,:]=e0_spikes.count_fanos(start_time,start_time+time_window,bins)
+        e_1_fano[idx,:]=e1_spikes.count_fanos(start_time,start_time+time_window,bins)
+        i_fano[idx,:]=i_spikes.count_fanos(start_time,start_time+time_window,bins)
 
         #print(np.mean(e_0_fano,axis=1))
         idx+=1
@@ -0,0 +1,201 @@
+import argparse
+import os
+from multiprocessing import Pool, cpu_count
+from time import time
+import h5py
+import numpy as np
+from brian.stdunits import ms
+from brian.units import second
+from pysbi import voxel
+from pysbi.util.utils import Struct
+from pysbi.voxel import get_bold_signal
+from pysbi.wta.sweep_store import get_sim_param
+
+# Voxel state variables that can be written to the BOLD store
+bold_states=['s', 'f_in', 'v', 'q', 'y']
+
+# Voxel parameters used by the balloon model
+balloon_params=['eta', 'tau_s', 'tau_f', 'tau_o', 'alpha', 'e_base', 'v_base', 'k1', 'r_0', 's_e_0', 's_i_0', 'TE',
+                'T_2E', 'T_2I']
+
+def get_balloon_params(voxel_params):
+    """
+    Get the balloon model parameters (including computed ones) as floats, so they can be sent to other processes
+    """
+    params=Struct()
+    for name in balloon_params:
+        setattr(params, name, float(getattr(voxel_params, name)))
+    return params
+
+def read_conductance(file_name):
+    """
+    Read the total and excitatory synaptic conductance recorded by the voxel of a trial
+    file_name = trial output file
+    Returns (trial duration, time step, G_total, G_total_exc) - G_total_exc is None if not recorded, or None if no voxel
+    data
+    """
+    f=h5py.File(file_name, 'r')
+    conductance=None
+    if 'voxel' in f and 'total_syn' in f['voxel'] and 'G_total' in f['voxel']['total_syn']:
+        trial_duration=float(get_sim_param(f, 'trial_duration'))
+        # Trial files written without a voxel time step computed the BOLD signal at 1ms
+        dt=float(f['voxel'].attrs['dt']) if 'dt' in f['voxel'].attrs else float(1*ms)
+        g_total=np.array(f['voxel']['total_syn']['G_total'])[0,:]
+        g_total_exc=None
+        if 'exc_syn' in f['voxel'] and 'G_total' in f['voxel']['exc_syn']:
+            g_total_exc=np.array(f['voxel']['exc_syn']['G_total'])[0,:]
+        conductance=(trial_duration, dt, g_total, g_total_exc)
+    f.close()
+    return conductance
+
+def compute_bold_batch(args):
+    """
+    Recompute the BOLD signal for a batch of trial files
+    args = (list of trial files, voxel parameters, baseline range (ms), linear)
+    Returns a list of (file name, BOLD states for total conductance, BOLD states for excitatory conductance or None)
+    """
+    file_names, voxel_params, baseline_range, linear = args
+
+    # Group trials with the same duration, time step, and number of samples so that each group can be computed as one
+    # batch
+    trials={}
+    for file_name in file_names:
+        try:
+            conductance=read_conductance(file_name)
+        except IOError as e:
+            print('cannot load file %s: %s' % (file_name, str(e)))
+            continue
+        if conductance is None:
+            print('no voxel data in %s' % file_name)
+            continue
+        trial_duration, dt, g_total, g_total_exc = conductance
+        key=(trial_duration, dt, len(g_total))
+        if not key in trials:
+            trials[key]=[]
+        trials[key].append((file_name, g_total, g_total_exc))
+
+    results=[]
+    for (trial_duration, dt, num_samples), group_trials in trials.iteritems():
+        baseline_steps=[int(baseline_range[0]*ms/(dt*second)), int(baseline_range[1]*ms/(dt*second))]
+        bold=get_bold_signal(np.array([g_total for (file_name, g_total, g_total_exc) in group_trials]), voxel_params,
+            baseline_steps, trial_duration*second, dt=dt*second, linear=linear)
+        exc_trials=[idx for idx,trial in enumerate(group_trials) if trial[2] is not None]
+        bold_exc=None
+        if len(exc_trials):
+            bold_exc=get_bold_signal(np.array([group_trials[idx][2] for idx in exc_trials]), voxel_params,
+                baseline_steps, trial_duration*second, dt=dt*second, linear=linear)
+        for idx,(file_name, g_total, g_total_exc) in enumerate(group_trials):
+            states=dict([(name, bold[name].values[idx,:]) for name in bold_states])
+            exc_states=None
+            if idx in exc_trials:
+                exc_idx=exc_trials.index(idx)
+                exc_states=dict([(name, bold_exc[name].values[exc_idx,:]) for name in bold_states])
+            results.append((file_name, states, exc_states))
+    return results
+
+def recompute_bold(data_dir, output_file, voxel_params, file_prefix='', baseline_range=[500, 2500], linear=False,
+                   num_processes=None, batch_size=50, save_states=False):
+    """
+    Recompute the BOLD signal of all trial files in a directory from their recorded synaptic conductance, and write it
+    to a separate HDF5 file that can be passed to FileInfo or TrialSeries as bold_file
+    data_dir = directory containing trial files
+    output_file = file to write BOLD signals to
+    voxel_params = voxel parameters to compute the BOLD signal with
+    file_prefix = only process trial files starting with this prefix
+    baseline_range = range of time (ms) to compute baseline conductance over - converted to time steps of each trial's
+                     voxel time step
+    linear = use the linearized balloon model if true
+    num_processes = number of processes to use (defaults to the number of cores)
+    batch_size = number of trial files processed together by each process
+    save_states = save all balloon model state variables and not just the BOLD signal if true
+    """
+    file_names=sorted([os.path.join(data_dir, file_name) for file_name in os.listdir(data_dir)
+                       if file_name.startswith(file_prefix) and file_name.endswith('.h5') and
+                          os.path.abspath(os.path.join(data_dir, file_name))!=os.path.abspath(output_file)])
+    batches=[(file_names[i:i+batch_size], get_balloon_params(voxel_params), baseline_range, linear) for i in range(0, len(file_names),
+                                                                                              batch_size)]
+    if num_processes is None:
+        num_processes=cpu_count()
+    print('Recomputing BOLD for %d files in %d batches on %d processes' % (len(file_names), len(batches),
+                                                                           num_processes))
+
+    written_states=bold_states if save_states else ['y']
+
+    start_time=time()
+    f=h5py.File(output_file, 'w')
+    f_params=f.create_group('voxel_params')
+    for name in balloon_params:
+        f_params.attrs[name]=float(getattr(voxel_params, name))
+    f.attrs['baseline_range']=np.array(baseline_range)
+    f.attrs['linear']=linear
+
+    num_written=0
+    pool=Pool(processes=num_processes)
+    try:
+        for results in pool.imap(compute_bold_batch, batches):
+            for file_name, states, exc_states in results:
+                f_trial=f.create_group(os.path.basename(file_name))
+                f_total=f_trial.create_group('total_syn')
+                for name in written_states:
+                    f_total[name]=states[name]
+                if exc_states is not None:
+                    f_exc=f_trial.create_group('exc_syn')
+                    for name in written_states:
+                        f_exc[name]=exc_states[name]
+                num_written+=1
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        f.close()
+    pool.join()
+    print('Wrote BOLD for %d files to %s: %.2fs' % (num_written, output_file, time()-start_time))
+
+def read_bold(bold_file, file_name):
+    """
+    Read the recomputed BOLD signal of a trial
+    bold_file = file written by recompute_bold
+    file_name = trial output file
+    Returns (states for total conductance, states for excitatory conductance) - each a dictionary of state variable ->
+    values (1 x time) or None if not found
+    """
+    f=h5py.File(bold_file, 'r')
+    total_states=None
+    exc_states=None
+    trial_name=os.path.basename(file_name)
+    if trial_name in f:
+        f_trial=f[trial_name]
+        total_states=dict([(name, np.array([f_trial['total_syn'][name]])) for name in f_trial['total_syn']])
+        if 'exc_syn' in f_trial:
+            exc_states=dict([(name, np.array([f_trial['exc_syn'][name]])) for name in f_trial['exc_syn']])
+    f.close()
+    return total_states, exc_states
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Recompute the BOLD signal of trial files from recorded conductance')
+    ap.add_argument('--data_dir', type=str, required=True, help='Directory containing trial files')
+    ap.add_argument('--output_file', type=str, required=True, help='File to write BOLD signals to')
+    ap.add_argument('--file_prefix', type=str, default='', help='Only process trial files starting with this prefix')
+    ap.add_argument('--param', type=str, action='append', default=[],
+        help='Voxel parameter to change from the default, in SI units (e.g. --param B0=3 --param TE=.03)')
+    ap.add_argument('--baseline_start', type=float, default=500, help='Start of baseline (ms)')
+    ap.add_argument('--baseline_end', type=float, default=2500, help='End of baseline (ms)')
+    ap.add_argument('--linear', action='store_true', default=False, help='Use the linearized balloon model')
+    ap.add_argument('--num_processes', type=int, default=None, help='Number of processes')
+    ap.add_argument('--batch_size', type=int, default=50, help='Number of trial files per batch')
+    ap.add_argument('--save_states', action='store_true', default=False,
+        help='Save all balloon model state variables')
+
+    argvals = ap.parse_args()
+
+    voxel_params=voxel.default_params()
+    for param in argvals.param:
+        name,value=param.split('=')
+        if not name in voxel_params:
+            ap.error('Unknown voxel parameter: %s' % name)
+        setattr(voxel_params, name, float(value))
+
+    recompute_bold(argvals.data_dir, argvals.output_file, voxel_params, file_prefix=argvals.file_prefix,
+        baseline_range=[argvals.baseline_start, argvals.baseline_end], linear=argvals.linear,
+        num_processes=argvals.num_processes, batch_size=argvals.batch_size, save_states=argvals.save_states)
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import random
+import h5py
+import numpy as np
+from scipy import sparse
+
+class ConnectivityCache():
+    """
+    Cache of generated WTA network connectivity. Connections are stored as sparse weight (and delay) matrices keyed by
+    the parameters that determine them, in memory and, if a cache directory is given, on disk so that other processes
+    can reuse them.
+    cache_dir = directory to store connectivity files in (None to only cache within this process)
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir=cache_dir
+        self.connections={}
+        self.hits=0
+        self.misses=0
+        if self.cache_dir is not None and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_key(self, params, pyr_params, inh_params, seed=None):
+        """
+        Get the cache key for a network
+        params = network parameters
+        pyr_params = pyramidal cell parameters
+        inh_params = interneuron parameters
+        seed = random seed used to generate the connectivity (None to reuse whatever was generated first for these
+               parameters)
+        """
+        key_values=[params.network_group_size, params.num_groups, params.f, params.background_input_size,
+                    params.task_input_size, params.p_e_e, params.p_e_i, params.p_i_e, params.p_i_i]
+        # Only synaptic weights affect the connectivity
+        key_values.extend([float(pyr_params[name]) for name in sorted(pyr_params.keys()) if name.startswith('w_')])
+        key_values.extend([float(inh_params[name]) for name in sorted(inh_params.keys()) if name.startswith('w_')])
+        key_values.append(seed)
+        return hashlib.md5(repr(tuple(key_values))).hexdigest()
+
+    def get_file_name(self, key):
+        return os.path.join(self.cache_dir, 'wta.connectivity.%s.h5' % key)
+
+    def get(self, key):
+        """
+        Get cached connectivity - dictionary of connection name -> (W, D) or None if not cached
+        key = cache key
+        """
+        if key not in self.connections and self.cache_dir is not None and os.path.exists(self.get_file_name(key)):
+            self.connections[key]=self.read_file(self.get_file_name(key))
+        if key in self.connections:
+            self.hits+=1
+            return self.connections[key]
+        self.misses+=1
+        return None
+
+    def put(self, key, connections):
+        """
+        Add connectivity to the cache
+        key = cache key
+        connections = dictionary of connection name -> (W, D)
+        """
+        self.connections[key]=connections
+        if self.cache_dir is not None:
+            # Write to a temporary file first so that concurrent jobs never read a partial file
+            tmp_file='%s.%d.tmp' % (self.get_file_name(key), os.getpid())
+            self.write_file(tmp_file, connections)
+            os.rename(tmp_file, self.get_file_name(key))
+
+    def read_file(self, file_name):
+        connections={}
+        f=h5py.File(file_name, 'r')
+        for name in f:
+            f_conn=f[name]
+            W=read_sparse(f_conn['W'])
+            D=None
+            if 'D' in f_conn:
+                D=read_sparse(f_conn['D'])
+            connections[name]=(W,D)
+        f.close()
+        return connections
+
+    def write_file(self, file_name, connections):
+        f=h5py.File(file_name, 'w')
+        for name,(W,D) in connections.iteritems():
+            f_conn=f.create_group(name)
+            write_sparse(f_conn.create_group('W'), W)
+            if D is not None:
+                write_sparse(f_conn.create_group('D'), D)
+        f.close()
+
+
+def read_sparse(f_group):
+    """
+    Read a CSR matrix from an HDF5 group
+    """
+    return sparse.csr_matrix((np.array(f_group['data']), np.array(f_group['indices']), np.array(f_group['indptr'])),
+        shape=tuple(f_group.attrs['shape']))
+
+
+def write_sparse(f_group, W):
+    """
+    Write a sparse matrix to an HDF5 group in CSR form
+    """
+    W=sparse.csr_matrix(W)
+    f_group.attrs['shape']=np.array(W.shape)
+    f_group['data']=W.data
+    f_group['indices']=W.indices
+    f_group['indptr']=W.indptr
+
+
+class seeded_random():
+    """
+    Context manager that seeds the numpy and python random number generators (used by Brian's connection
+    construction) and restores their previous state on exit, so that seeding the connectivity does not make the rest of
+    the simulation deterministic
+    seed = random seed (None for no seeding)
+    """
+    def __init__(self, seed):
+        self.seed=seed
+
+    def __enter__(self):
+        if self.seed is not None:
+            self.np_state=np.random.get_state()
+            self.py_state=random.getstate()
+            np.random.seed(self.seed)
+            random.seed(self.seed)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.seed is not None:
+            np.random.set_state(self.np_state)
+            random.setstate(self.py_state)
@@ -0,0 +1,279 @@
+import argparse
+import os
+import h5py
+import numpy as np
+from pysbi.util.utils import Struct
+from pysbi.wta.network import simulation_params
+from pysbi.wta.run import get_wta_point_jobs, get_local_jobs, run_jobs_local, get_wta_file_desc
+from pysbi.wta.sweep_store import read_trial_summary
+
+# Parameters estimated by default
+estimate_params=['p_e_e', 'p_e_i', 'p_i_i', 'p_i_e']
+
+class LikelihoodCache():
+    """
+    Persistent cache of simulated likelihoods keyed by parameter vectors rounded to a fixed number of decimals. Only
+    the process running the chains reads and writes the cache file.
+    cache_file = HDF5 file to store likelihoods in
+    param_names = names of the parameters in the parameter vectors
+    decimals = number of decimals parameter vectors are rounded to
+    """
+    def __init__(self, cache_file, param_names, decimals=3):
+        self.cache_file=cache_file
+        self.param_names=param_names
+        self.decimals=decimals
+        self.likelihoods={}
+        if os.path.exists(cache_file):
+            f=h5py.File(cache_file, 'r')
+            if list(f.attrs['param_names'])!=list(param_names) or int(f.attrs['decimals'])!=decimals:
+                f.close()
+                raise ValueError('Cache %s is for parameters %s with %d decimals' % (cache_file,
+                                                                                     ', '.join(param_names), decimals))
+            for params,likelihood in zip(np.array(f['params']), np.array(f['likelihood'])):
+                self.likelihoods[self.get_key(params)]=likelihood
+            f.close()
+
+    def __contains__(self, params):
+        return self.get_key(params) in self.likelihoods
+
+    def __len__(self):
+        return len(self.likelihoods)
+
+    def get_key(self, params):
+        return tuple([round(float(value), self.decimals) for value in params])
+
+    def get(self, params):
+        return self.likelihoods[self.get_key(params)]
+
+    def update(self, params_likelihoods):
+        """
+        Add likelihoods to the cache and write them to the cache file - failed evaluations (NaN) are not cached so
+        that they are simulated again
+        params_likelihoods = list of (parameter vector, likelihood)
+        """
+        new_items=[(self.get_key(params), likelihood) for params,likelihood in params_likelihoods
+                   if not self.get_key(params) in self.likelihoods and np.isfinite(likelihood)]
+        if not len(new_items):
+            return
+        for key,likelihood in new_items:
+            self.likelihoods[key]=likelihood
+
+        f=h5py.File(self.cache_file, 'a')
+        if not 'params' in f:
+            f.attrs['param_names']=np.array(self.param_names)
+            f.attrs['decimals']=self.decimals
+            f.create_dataset('params', (0, len(self.param_names)), dtype=float, maxshape=(None, len(self.param_names)))
+            f.create_dataset('likelihood', (0,), dtype=float, maxshape=(None,))
+        num_rows=f['params'].shape[0]
+        f['params'].resize(num_rows+len(new_items), axis=0)
+        f['likelihood'].resize(num_rows+len(new_items), axis=0)
+        f['params'][num_rows:,:]=np.array([key for key,likelihood in new_items])
+        f['likelihood'][num_rows:]=np.array([likelihood for key,likelihood in new_items])
+        f.close()
+
+
+def get_trial_files_auc(trial_files, num_extra_trials=10):
+    """
+    Compute the AUC of a parameter point from the summary data of its trial files
+    """
+    from pysbi.reports.wta import get_summary_auc
+    input_freq=[]
+    e_final_mean=[]
+    e_final_max=[]
+    truncated=[]
+    for trial_file in trial_files:
+        f=h5py.File(trial_file, 'r')
+        row=read_trial_summary(f)
+        f.close()
+        input_freq.append(row['input_freq'])
+        e_final_mean.append(row['e_final_mean'][:2])
+        e_final_max.append(row['e_final_max'][:2])
+        truncated.append(row['truncated']==1)
+    return get_summary_auc(np.array(input_freq), np.array(e_final_mean), np.array(e_final_max),
+        truncated=np.array(truncated), num_extra_trials=num_extra_trials)
+
+def evaluate_likelihoods(points, param_names, output_dir, sim_params, num_trials, contrast_range, seed=0,
+                         num_processes=None, cache_connectivity=False, compile_cache_dir=None):
+    """
+    Simulate parameter points and compute their likelihood (AUC). The trials of all points are run together on one
+    pool of worker processes. Trial files that already exist are reused.
+    points = list of parameter vectors
+    Returns the likelihood of each point (NaN if it could not be computed)
+    """
+    # Every point is simulated with the same trial inputs and seeds
+    wta_jobs=[]
+    for point in points:
+        np.random.seed(seed)
+        wta_jobs.extend(get_wta_point_jobs([dict(zip(param_names, point))], num_trials, contrast_range=contrast_range))
+    record={
+        'record_lfp': False,
+        'record_voxel': True,
+        'record_neuron_state': False,
+        'record_spikes': False,
+        'record_firing_rate': True,
+        'save_summary_only': True
+    }
+    point_jobs=len(contrast_range)*num_trials
+    jobs=[]
+    for idx in range(len(points)):
+        jobs.extend(get_local_jobs(output_dir, wta_jobs[idx*point_jobs:(idx+1)*point_jobs], sim_params, record,
+            seed=seed))
+    if len(jobs):
+        run_jobs_local(jobs, num_processes=num_processes, cache_connectivity=cache_connectivity,
+            compile_cache_dir=compile_cache_dir)
+
+    likelihoods=[]
+    for idx in range(len(points)):
+        trial_files=[os.path.join(output_dir, '%s.h5' % get_wta_file_desc(wta_params, sim_params, contrast, t))
+                     for (wta_params, inputs, contrast, t) in wta_jobs[idx*point_jobs:(idx+1)*point_jobs]]
+        try:
+            likelihoods.append(get_trial_files_auc(trial_files))
+        except Exception as e:
+            print('cannot compute likelihood of %s: %s' % (str(points[idx]), str(e)))
+            likelihoods.append(float('NaN'))
+    return likelihoods
+
+def write_checkpoint(checkpoint_file, chains, rng):
+    """
+    Write the state of the chains so that estimation can be restarted
+    """
+    f=h5py.File('%s.tmp' % checkpoint_file, 'w')
+    f['samples']=chains.samples[:,:chains.iteration+1,:]
+    f['sample_likelihoods']=chains.sample_likelihoods[:,:chains.iteration+1]
+    f['accepted']=chains.accepted
+    f.attrs['iteration']=chains.iteration
+    rng_state=rng.get_state()
+    f_rng=f.create_group('rng_state')
+    f_rng.attrs['name']=rng_state[0]
+    f_rng['keys']=rng_state[1]
+    f_rng.attrs['pos']=rng_state[2]
+    f_rng.attrs['has_gauss']=rng_state[3]
+    f_rng.attrs['cached_gaussian']=rng_state[4]
+    f.close()
+    # Replace the previous checkpoint only once the new one is complete
+    os.rename('%s.tmp' % checkpoint_file, checkpoint_file)
+
+def read_checkpoint(checkpoint_file, chains, rng):
+    """
+    Restore the state of the chains from a checkpoint
+    """
+    f=h5py.File(checkpoint_file, 'r')
+    iteration=int(f.attrs['iteration'])
+    chains.samples[:,:iteration+1,:]=np.array(f['samples'])
+    chains.sample_likelihoods[:,:iteration+1]=np.array(f['sample_likelihoods'])
+    chains.accepted=np.array(f['accepted'])
+    chains.iteration=iteration
+    f_rng=f['rng_state']
+    rng.set_state((str(f_rng.attrs['name']), np.array(f_rng['keys']), int(f_rng.attrs['pos']),
+                         int(f_rng.attrs['has_gauss']), float(f_rng.attrs['cached_gaussian'])))
+    f.close()
+
+def run_mcmc(output_dir, num_chains=4, num_iterations=1000, param_names=estimate_params, param_bounds=(0.0, 0.1),
+             proposal_sd=0.01, num_trials=5, contrast_range=[0.0, 0.0625, 0.125, 0.25, 0.5, 1.0], decimals=3,
+             cache_file=None, checkpoint_file=None, checkpoint_interval=10, seed=0, num_processes=None,
+             cache_connectivity=False, compile_cache_dir=None):
+    """
+    Estimate the distribution of network parameters given performance (AUC) with Metropolis sampling. The chains
+    advance together - the candidates of all chains are simulated in parallel at each iteration, and the likelihood of
+    every simulated parameter vector is stored in a persistent cache shared by all chains and runs.
+    output_dir = directory to write trial files to
+    num_chains = number of chains
+    num_iterations = number of iterations of each chain
+    param_names = names of the estimated parameters
+    param_bounds = (min, max) of the parameters
+    proposal_sd = standard deviation of the random walk proposal
+    num_trials = number of trials per contrast simulated for each likelihood evaluation
+    decimals = parameter vectors are rounded to this many decimals (trial files are named with 3 decimals)
+    cache_file = likelihood cache (defaults to likelihood_cache.h5 in output_dir)
+    checkpoint_file = checkpoint to restart from and write to (defaults to mcmc_checkpoint.h5 in output_dir)
+    checkpoint_interval = number of iterations between checkpoints
+    seed = random seed
+    Returns a Struct with the samples (chain x iteration x parameter) and their likelihoods
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if cache_file is None:
+        cache_file=os.path.join(output_dir, 'likelihood_cache.h5')
+    if checkpoint_file is None:
+        checkpoint_file=os.path.join(output_dir, 'mcmc_checkpoint.h5')
+    cache=LikelihoodCache(cache_file, param_names, decimals=decimals)
+    sim_params=simulation_params()
+
+    def get_likelihoods(points):
+        new_points=[]
+        for point in points:
+            if not point in cache and not cache.get_key(point) in [cache.get_key(new_point) for new_point in new_points]:
+                new_points.append(point)
+        if len(new_points):
+            cache.update(zip(new_points, evaluate_likelihoods(new_points, param_names, output_dir, sim_params,
+                num_trials, contrast_range, seed=seed, num_processes=num_processes,
+                cache_connectivity=cache_connectivity, compile_cache_dir=compile_cache_dir)))
+        # Points whose evaluation failed are not in the cache
+        return np.array([cache.get(point) if point in cache else float('NaN') for point in points])
+
+    chains=Struct()
+    chains.samples=np.zeros([num_chains, num_iterations, len(param_names)])
+    chains.sample_likelihoods=np.zeros([num_chains, num_iterations])
+    chains.accepted=np.zeros(num_chains)
+    # Chains have their own random state, trial inputs are generated with the global one
+    rng=np.random.RandomState(seed)
+    if os.path.exists(checkpoint_file):
+        read_checkpoint(checkpoint_file, chains, rng)
+        print('Restarting from iteration %d' % chains.iteration)
+    else:
+        chains.iteration=0
+        chains.samples[:,0,:]=np.round(rng.uniform(param_bounds[0], param_bounds[1],
+            size=(num_chains, len(param_names))), decimals)
+        chains.sample_likelihoods[:,0]=get_likelihoods(list(chains.samples[:,0,:]))
+
+    while chains.iteration<num_iterations-1:
+        x=chains.samples[:,chains.iteration,:]
+        x_likelihood=chains.sample_likelihoods[:,chains.iteration]
+        candidates=np.round(np.clip(x+proposal_sd*rng.randn(num_chains, len(param_names)), param_bounds[0],
+            param_bounds[1]), decimals)
+        candidate_likelihoods=get_likelihoods(list(candidates))
+
+        # Metropolis acceptance - candidates whose likelihood could not be computed are rejected, chains at a point
+        # whose likelihood could not be computed accept any other candidate
+        ratio=np.ones(num_chains)
+        nonzero=x_likelihood>0
+        ratio[nonzero]=candidate_likelihoods[nonzero]/x_likelihood[nonzero]
+        ratio[np.isnan(candidate_likelihoods)]=0.0
+        accept=rng.random_sample(num_chains)<np.minimum(1.0, ratio)
+        chains.accepted+=accept
+        chains.iteration+=1
+        chains.samples[:,chains.iteration,:]=np.where(accept[:,np.newaxis], candidates, x)
+        chains.sample_likelihoods[:,chains.iteration]=np.where(accept, candidate_likelihoods, x_likelihood)
+        print('iteration %d: %s' % (chains.iteration, ', '.join(['(%s) likelihood=%0.3f' %
+                                                                  (','.join(['%0.3f' % value for value in sample]),
+                                                                   likelihood) for sample,likelihood in
+                                                                  zip(chains.samples[:,chains.iteration,:],
+                                                                      chains.sample_likelihoods[:,chains.iteration])])))
+
+        if chains.iteration % checkpoint_interval==0 or chains.iteration==num_iterations-1:
+            write_checkpoint(checkpoint_file, chains, rng)
+
+    print('%d cached likelihoods, acceptance rate: %s' % (len(cache), ', '.join(['%0.3f' % rate for rate in
+                                                                                 chains.accepted/float(num_iterations-1)])))
+    return chains
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Estimate the distribution of WTA network parameters with parallel MCMC')
+    ap.add_argument('--output_dir', type=str, default='/tmp/wta-output', help='Directory to write trial files to')
+    ap.add_argument('--num_chains', type=int, default=4, help='Number of chains')
+    ap.add_argument('--num_iterations', type=int, default=1000, help='Number of iterations of each chain')
+    ap.add_argument('--proposal_sd', type=float, default=0.01, help='Standard deviation of the proposal')
+    ap.add_argument('--num_trials', type=int, default=5, help='Number of trials per contrast per evaluation')
+    ap.add_argument('--cache_file', type=str, default=None, help='Likelihood cache file')
+    ap.add_argument('--checkpoint_file', type=str, default=None, help='Checkpoint file')
+    ap.add_argument('--checkpoint_interval', type=int, default=10, help='Iterations between checkpoints')
+    ap.add_argument('--seed', type=int, default=0, help='Random seed')
+    ap.add_argument('--num_processes', type=int, default=None, help='Number of worker processes')
+    ap.add_argument('--compile_cache_dir', type=str, default=None, help='Directory to share compiled code in')
+
+    argvals = ap.parse_args()
+
+    run_mcmc(argvals.output_dir, num_chains=argvals.num_chains, num_iterations=argvals.num_iterations,
+        proposal_sd=argvals.proposal_sd, num_trials=argvals.num_trials, cache_file=argvals.cache_file,
+        checkpoint_file=argvals.checkpoint_file, checkpoint_interval=argvals.checkpoint_interval, seed=argvals.seed,
+        num_processes=argvals.num_processes, compile_cache_dir=argvals.compile_cache_dir)
@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import os
+import numpy as np
+from brian.stdunits import nS
+from pysbi.util.utils import Struct
+from pysbi.wta.analysis import run_grid_bayesian_analysis
+from pysbi.wta.network import simulation_params, default_params
+from pysbi.wta.run import get_wta_point_jobs, get_wta_point_desc, get_local_jobs, run_jobs_local
+from pysbi.wta.sweep_store import SweepStore, update_index
+
+# Parameters that can be explored - parameters that are part of the trial file names
+explore_params=['p_e_e', 'p_e_i', 'p_i_i', 'p_i_e']
+
+# Smallest step between explored values - parameter values are written to file names with 3 decimals
+min_step=.001
+
+def get_grid_points(param_bounds, num_levels):
+    """
+    Get the points of an evenly spaced grid
+    param_bounds = dictionary of parameter name -> (min, max)
+    num_levels = number of values of each parameter
+    Returns a list of tuples of parameter values (ordered by parameter name)
+    """
+    names=sorted(param_bounds.keys())
+    ranges=[np.linspace(param_bounds[name][0], param_bounds[name][1], num_levels) for name in names]
+    return sorted(set([tuple([round(value,3) for value in point]) for point in itertools.product(*ranges)]))
+
+def get_neighbours(point, steps, param_bounds):
+    """
+    Get the points one step away from a point along each parameter axis, within the parameter bounds
+    point = tuple of parameter values (ordered by parameter name)
+    steps = step size of each parameter
+    """
+    names=sorted(param_bounds.keys())
+    neighbours=[]
+    for i,name in enumerate(names):
+        for direction in [-1, 1]:
+            value=round(point[i]+direction*steps[i],3)
+            if param_bounds[name][0]<=value<=param_bounds[name][1]:
+                neighbour=list(point)
+                neighbour[i]=value
+                neighbours.append(tuple(neighbour))
+    return neighbours
+
+def score_points(store, points, param_names, sim_params, e_desc, contrast_range, num_trials, perf_threshold=0.75,
+                 r_sqr_threshold=0.2, slope_sign='pos', regression='bold_contrast'):
+    """
+    Compute the AUC and BOLD regression of each point from the trial index, and the posterior of each point under
+    the model of above threshold performance with a BOLD regression slope of the given sign
+    store = SweepStore of the trial index
+    points = list of tuples of parameter values
+    param_names = name of each parameter in the points
+    slope_sign = sign of the BOLD regression slope of the model ('pos', 'neg', or 'zero')
+    regression = BOLD regression to use ('bold_contrast' or 'bold_firing_rate')
+    Returns a Struct with arrays of the auc, slope, r_sqr, and posterior of each point (NaN/0 for points without all
+    trials)
+    """
+    from pysbi.reports.wta import get_index_network_summary
+    scores=Struct()
+    scores.auc=np.zeros(len(points))*float('NaN')
+    scores.slope=np.zeros(len(points))*float('NaN')
+    scores.r_sqr=np.zeros(len(points))
+    for idx,point in enumerate(points):
+        point_desc=get_point_desc(point, param_names, sim_params, e_desc)
+        if store.all_trials_exist(point_desc, contrast_range, num_trials):
+            summary=get_index_network_summary(store, point_desc, contrast_range, num_trials)
+            scores.auc[idx]=summary.roc.auc
+            scores.slope[idx]=getattr(summary.bold, '%s_slope' % regression)
+            scores.r_sqr[idx]=getattr(summary.bold, '%s_r_sqr' % regression)
+
+    # Points are a one dimensional grid with a uniform prior
+    bayes_analysis=run_grid_bayesian_analysis(np.nan_to_num(scores.auc), scores.slope, scores.r_sqr, ['point'],
+        perf_threshold=perf_threshold, r_sqr_threshold=r_sqr_threshold)
+    scores.posterior=getattr(bayes_analysis, 'l1_pos_l2_%s_posterior' % slope_sign)
+    if not np.all(np.isfinite(scores.posterior)):
+        scores.posterior=np.zeros(len(points))
+    return scores
+
+def get_point_desc(point, param_names, sim_params, e_desc):
+    wta_params=default_params()
+    for name,value in zip(param_names, point):
+        setattr(wta_params, name, value)
+    return get_wta_point_desc(wta_params, sim_params, e_desc=e_desc)
+
+def explore(output_dir, param_bounds, num_trials, num_levels=3, max_rounds=5, batch_size=20, num_refine=5,
+            contrast_range=[0.0, 0.0625, 0.125, 0.25, 0.5, 1.0], perf_threshold=0.75, r_sqr_threshold=0.2,
+            slope_sign='pos', regression='bold_contrast', muscimol_amount=0*nS, injection_site=0, num_processes=None,
+            seed=0, cache_connectivity=False, compile_cache_dir=None, index_file=None):
+    """
+    Explore a parameter space by successive refinement instead of simulating a full grid. A coarse grid is simulated
+    first, then each round simulates the neighbours (at half the previous step) of the points with the most posterior
+    mass under the model of interest - or of the points with the highest AUC if no points fit the model yet. Trial
+    files and the trial index are reused, so an exploration can be resumed or extended.
+    output_dir = directory to write trial files to
+    param_bounds = dictionary of parameter name -> (min, max) for the explored parameters (others are set to defaults)
+    num_trials = number of trials per parameter point and contrast
+    num_levels = number of values of each parameter in the initial grid
+    max_rounds = maximum number of refinement rounds
+    batch_size = maximum number of parameter points simulated in each refinement round
+    num_refine = number of points to refine around each round
+    slope_sign = sign of the BOLD regression slope of the model of interest ('pos', 'neg', or 'zero')
+    regression = BOLD regression to use ('bold_contrast' or 'bold_firing_rate')
+    index_file = trial index to update (defaults to trial_index.h5 in output_dir)
+    Returns a Struct with the explored points and their scores
+    """
+    for name in param_bounds:
+        if not name in explore_params:
+            raise ValueError('Cannot explore %s - parameters that can be explored: %s' % (name,
+                                                                                       ', '.join(explore_params)))
+    param_names=sorted(param_bounds.keys())
+    if index_file is None:
+        index_file=os.path.join(output_dir, 'trial_index.h5')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    sim_params=simulation_params()
+    sim_params.muscimol_amount=muscimol_amount
+    sim_params.injection_site=injection_site
+    record={
+        'record_lfp': False,
+        'record_voxel': True,
+        'record_neuron_state': False,
+        'record_spikes': False,
+        'record_firing_rate': True,
+        'save_summary_only': True
+    }
+
+    steps=[(param_bounds[name][1]-param_bounds[name][0])/float(max(num_levels-1,1)) for name in param_names]
+    points=[]
+    proposed=get_grid_points(param_bounds, num_levels)
+    job_seed=seed
+    for round_idx in range(max_rounds+1):
+        print('Round %d: simulating %d parameter points' % (round_idx, len(proposed)))
+        np.random.seed(seed+round_idx)
+        wta_jobs=get_wta_point_jobs([dict(zip(param_names, point)) for point in proposed], num_trials,
+            contrast_range=contrast_range)
+        jobs=get_local_jobs(output_dir, wta_jobs, sim_params, record, seed=job_seed)
+        job_seed+=len(wta_jobs)
+        run_jobs_local(jobs, num_processes=num_processes, cache_connectivity=cache_connectivity,
+            compile_cache_dir=compile_cache_dir)
+        points.extend(proposed)
+
+        update_index(output_dir, index_file)
+        scores=score_points(SweepStore(index_file), points, param_names, sim_params, '', contrast_range, num_trials,
+            perf_threshold=perf_threshold, r_sqr_threshold=r_sqr_threshold, slope_sign=slope_sign,
+            regression=regression)
+        print('Round %d: %d points explored, %d fit the model' % (round_idx, len(points), np.sum(scores.posterior>0)))
+
+        if round_idx==max_rounds:
+            break
+        # Refine around the points with the most posterior mass, or the best performing points
+        steps=[max(step/2.0, min_step) for step in steps]
+        if np.sum(scores.posterior>0):
+            order=np.argsort(-scores.posterior)[:min(num_refine, np.sum(scores.posterior>0))]
+        else:
+            order=np.argsort(-np.nan_to_num(scores.auc))[:num_refine]
+        explored=set(points)
+        proposed=[]
+        for idx in order:
+            for neighbour in get_neighbours(points[idx], steps, param_bounds):
+                if not neighbour in explored and not neighbour in proposed:
+                    proposed.append(neighbour)
+        proposed=proposed[:batch_size]
+        if not len(proposed):
+            print('No new parameter points to explore')
+            break
+
+    results=Struct()
+    results.param_names=param_names
+    results.points=np.array(points)
+    results.auc=scores.auc
+    results.slope=scores.slope
+    results.r_sqr=scores.r_sqr
+    results.posterior=scores.posterior
+    return results
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Explore the WTA parameter space by successive refinement')
+    ap.add_argument('--output_dir', type=str, default='/tmp/wta-output', help='Directory to write trial files to')
+    for name in explore_params:
+        ap.add_argument('--%s' % name, type=float, nargs=2, default=None, metavar=('MIN', 'MAX'),
+            help='Range of %s to explore (set to the default if not given)' % name)
+    ap.add_argument('--num_trials', type=int, default=10, help='Number of trials per parameter point and contrast')
+    ap.add_argument('--num_levels', type=int, default=3, help='Number of values of each parameter in the initial grid')
+    ap.add_argument('--max_rounds', type=int, default=5, help='Maximum number of refinement rounds')
+    ap.add_argument('--batch_size', type=int, default=20, help='Maximum number of parameter points per round')
+    ap.add_argument('--num_refine', type=int, default=5, help='Number of points to refine around each round')
+    ap.add_argument('--slope_sign', type=str, default='pos', choices=['pos', 'neg', 'zero'],
+        help='Sign of the BOLD regression slope of the model of interest')
+    ap.add_argument('--regression', type=str, default='bold_contrast', choices=['bold_contrast', 'bold_firing_rate'],
+        help='BOLD regression to use')
+    ap.add_argument('--num_processes', type=int, default=None, help='Number of worker processes')
+    ap.add_argument('--seed', type=int, default=0, help='Base random seed')
+    ap.add_argument('--compile_cache_dir', type=str, default=None, help='Directory to share compiled code in')
+
+    argvals = ap.parse_args()
+
+    param_bounds={}
+    for name in explore_params:
+        if getattr(argvals, name) is not None:
+            param_bounds[name]=tuple(getattr(argvals, name))
+    if not len(param_bounds):
+        ap.error('No parameter ranges to explore')
+
+    results=explore(argvals.output_dir, param_bounds, argvals.num_trials, num_levels=argvals.num_levels,
+        max_rounds=argvals.max_rounds, batch_size=argvals.batch_size, num_refine=argvals.num_refine,
+        slope_sign=argvals.slope_sign, regression=argvals.regression, num_processes=argvals.num_processes,
+        seed=argvals.seed, compile_cache_dir=argvals.compile_cache_dir)
+    for idx in np.argsort(-results.posterior):
+        if results.posterior[idx]>0:
+            print('%s: auc=%.3f slope=%.3f r_sqr=%.3f' % (', '.join(['%s=%.3f' % (name, value) for name, value in
+                                                                      zip(results.param_names, results.points[idx])]),
+                                                           results.auc[idx], results.slope[idx], results.r_sqr[idx]))
@@ -1,19 +1,442 @@
 import h5py
 from brian.experimental.connectionmonitor import ConnectionMonitor
 import math
+import os
 from matplotlib.patches import Rectangle
 import numpy as np
 from brian import StateMonitor, MultiStateMonitor, PopulationRateMonitor, SpikeMonitor, raster_plot, ms, hertz, nS, nA, mA, defaultclock, second, Clock
+from brian.network import NetworkOperation, stop
+from brian.tools.parameters import Parameters
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import figure, subplot, ylim, legend, ylabel, xlabel, show, title
 # Collection of monitors for WTA network
 from pysbi.util.plot import plot_network_firing_rates, plot_condition_choice_probability
 from pysbi.util.utils import get_response_time, FitRT, FitWeibull
+from pysbi.util.spikes import write_spikes
+from pysbi.util.weights import WeightHistory, connection_weights, write_weight_record, read_weights
+from pysbi.wta.sweep_store import final_window, get_window_summary
+
+# Recording resolution (None for the simulation time step) and precision (None for float64) of each signal
+default_record_params=Parameters(
+    lfp_dt=None,
+    lfp_dtype=None,
+    voxel_dt=None,
+    voxel_dtype=None,
+    neuron_state_dt=None,
+    neuron_state_dtype=None,
+    rate_dt=None,
+    rate_dtype=None
+)
+
+
+class BatchPopulationRateMonitor(SpikeMonitor):
+    """
+    Monitors the population rate of many populations of the same group at once (e.g. every population of every trial of a
+    WTANetworkBatch). Spikes are binned by neuron label with a single bincount per time step.
+    source = group to monitor
+    labels = population label of each neuron in the group (-1 for neurons that are not monitored)
+    """
+    def __init__(self, source, labels):
+        SpikeMonitor.__init__(self, source, record=False)
+        self._clock=source.clock
+        self.labels=np.array(labels, dtype=int)
+        self.num_labels=np.max(self.labels)+1
+        self.sizes=np.bincount(self.labels[self.labels>-1], minlength=self.num_labels)
+        self._factor=1.0/(self.sizes*float(self._clock.dt))
+        self._rate=[]
+        self._times=[]
+
+    def reinit(self):
+        SpikeMonitor.reinit(self)
+        self._rate=[]
+        self._times=[]
+
+    def propagate(self, spikes):
+        # Shift labels by one so that unmonitored neurons fall in the first (discarded) bin
+        counts=np.bincount(self.labels[spikes]+1, minlength=self.num_labels+1)[1:]
+        self._rate.append(counts*self._factor)
+        self._times.append(self._clock._t)
+
+    @property
+    def times(self):
+        return np.array(self._times)
+
+    @property
+    def rate(self):
+        """
+        Rate of each population (populations x time) in Hz
+        """
+        if not len(self._rate):
+            return np.zeros((self.num_labels,0))
+        return np.array(self._rate).T
+
+    def smooth_rate(self, width, filter='gaussian'):
+        """
+        Smoothed rate of each population (populations x time) - same filters as PopulationRateMonitor.smooth_rate
+        width = filter width
+        filter = gaussian or flat
+        """
+        width_dt=get_width_dt(width, self._clock.dt)
+        window={'gaussian': np.exp(-np.arange(-2*width_dt, 2*width_dt+1)**2*1./(2*width_dt**2)),
+                'flat': np.ones(width_dt)}[filter]
+        window=window*1./np.sum(window)
+        rate=self.rate
+        smoothed=np.zeros(rate.shape)
+        for i in range(rate.shape[0]):
+            smoothed[i,:]=np.convolve(rate[i,:], window, mode='same')
+        return smoothed
+
+
+def get_width_dt(width, bin_dt):
+    """
+    Width of a smoothing filter in rate bins - at least one bin, so that rates recorded in bins wider than the filter
+    are not smoothed into NaN
+    """
+    return max(1, int(width/bin_dt))
+
+def get_rate_dt(rate_monitor):
+    """
+    Bin width of a population rate monitor
+    """
+    return rate_monitor._bin*rate_monitor._clock.dt
+
+
+class SmoothedPopulationRateMonitor(PopulationRateMonitor):
+    """
+    Population rate monitor that smooths the rate with a gaussian filter while the simulation runs. Each smoothed value
+    is computed once, as soon as the bins it depends on (half the filter length ahead) are complete, and is identical to
+    the value PopulationRateMonitor.smooth_rate computes from the full rate history.
+    source = group to monitor
+    bin = bin size (None for the clock time step)
+    width = width of the smoothing filter
+    """
+    def __init__(self, source, bin=None, width=5*ms):
+        PopulationRateMonitor.__init__(self, source, bin=bin)
+        self.width=width
+        self.width_dt=get_width_dt(width, get_rate_dt(self))
+        self.lag=2*self.width_dt
+        self.window=np.exp(-np.arange(-2*self.width_dt, 2*self.width_dt+1)**2*1./(2*self.width_dt**2))
+        self.window=self.window/np.sum(self.window)
+        self._smoothed=[]
+        self._smoothed_cache=None
+
+    def reinit(self):
+        PopulationRateMonitor.reinit(self)
+        self._smoothed=[]
+        self._smoothed_cache=None
+
+    def propagate(self, spikes):
+        PopulationRateMonitor.propagate(self, spikes)
+        # The last bin is still being filled until its step count runs out
+        num_complete=len(self._rate)-(1 if self._curstep>0 else 0)
+        while len(self._smoothed)<num_complete-self.lag:
+            self._smoothed.append(self.smooth_sample(len(self._smoothed), num_complete))
+
+    def smooth_sample(self, idx, num_samples):
+        """
+        Smoothed rate of one bin given the first num_samples bins (bins before the start or after num_samples are zero)
+        """
+        start=max(0, idx-self.lag)
+        end=min(num_samples, idx+self.lag+1)
+        return np.dot(self._rate[start:end], self.window[start-idx+self.lag:end-idx+self.lag])
+
+    def smooth_rate(self, width=5*ms, filter='gaussian'):
+        """
+        Smoothed rate - the rate smoothed online if the filter is the same as this monitor's, otherwise smoothed from
+        the full rate history. Only the bins at the end of the trace that are within half a filter length of the last
+        bin are smoothed here, and the result is cached until more bins are recorded.
+        width = filter width
+        filter = gaussian or flat
+        """
+        if filter!='gaussian' or get_width_dt(width, get_rate_dt(self))!=self.width_dt:
+            return PopulationRateMonitor.smooth_rate(self, width=width, filter=filter)
+        num_samples=len(self._rate)
+        if self._smoothed_cache is None or len(self._smoothed_cache)!=num_samples:
+            # The end of the trace is zero padded, as in PopulationRateMonitor.smooth_rate
+            tail=[self.smooth_sample(idx, num_samples) for idx in range(len(self._smoothed), num_samples)]
+            self._smoothed_cache=np.array(self._smoothed[:num_samples]+tail)
+        return self._smoothed_cache
+
+
+def get_dtype(dtype):
+    """
+    Get the dtype to record a signal in (float64 if None)
+    """
+    if dtype is None:
+        return np.float64
+    return dtype
+
+
+class SampledStateMonitor(NetworkOperation):
+    """
+    Records a state variable every dt in the given precision - like StateMonitor, but signals that do not need the
+    full simulation resolution take less memory and disk space
+    source = group to monitor
+    varname = variable to record
+    record = index or list of indices of neurons to record (True for all)
+    dt = recording time step (None for every clock step)
+    dtype = precision to record in
+    clock = clock of the source
+    """
+    def __init__(self, source, varname, record=True, dt=None, dtype=np.float64, clock=defaultclock):
+        NetworkOperation.__init__(self, clock=clock, when='end')
+        self.source=source
+        self.varname=varname
+        if record is True:
+            self.record=slice(None)
+        elif isinstance(record, int):
+            self.record=[record]
+        else:
+            self.record=record
+        self.timestep=1
+        if dt is not None:
+            self.timestep=max(1, int(round(dt/clock.dt)))
+        self.dt=self.timestep*clock.dt
+        self.dtype=dtype
+        self.reinit()
+
+    def reinit(self):
+        self._values=[]
+        self._times=[]
+        self._step=0
+
+    def __call__(self):
+        if self._step % self.timestep == 0:
+            self._values.append(np.array(self.source.state_(self.varname)[self.record], dtype=self.dtype))
+            self._times.append(float(self.clock.t))
+        self._step+=1
+
+    @property
+    def values(self):
+        """
+        Recorded values (neurons x time)
+        """
+        return np.array(self._values, dtype=self.dtype).T
+
+    @property
+    def times(self):
+        return np.array(self._times)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+
+class MultiSampledStateMonitor(NetworkOperation):
+    """
+    Records several state variables every dt in the given precision - like MultiStateMonitor
+    source = group to monitor
+    vars = variables to record
+    record = index or list of indices of neurons to record (True for all)
+    dt = recording time step (None for every clock step)
+    dtype = precision to record in
+    clock = clock of the source
+    """
+    def __init__(self, source, vars, record=True, dt=None, dtype=np.float64, clock=defaultclock):
+        NetworkOperation.__init__(self, clock=clock, when='end')
+        self.monitors={}
+        for varname in vars:
+            self.monitors[varname]=SampledStateMonitor(source, varname, record=record, dt=dt, dtype=dtype, clock=clock)
+
+    def reinit(self):
+        for monitor in self.monitors.itervalues():
+            monitor.reinit()
+
+    def __call__(self):
+        for monitor in self.monitors.itervalues():
+            monitor()
+
+    def __getitem__(self, varname):
+        return self.monitors[varname]
+
+
+class DecisionDetector(NetworkOperation):
+    """
+    Online decision detector that stops the simulation once a decision has been reached. The excitatory population rates
+    are smoothed with the same gaussian filter as PopulationRateMonitor.smooth_rate, lagged by half the filter length so
+    that each smoothed value is identical to the offline one (or taken from SmoothedPopulationRateMonitors), and the decision is the first crossing of the response
+    threshold during the stimulus (as in get_response_time).
+    rate_monitors = population rate monitors of each excitatory group
+    sim_params = simulation parameters
+    upper_threshold = response threshold
+    threshold_diff = minimum difference between the winning group's rate and the other group's rate
+    post_decision_margin = time to continue simulating after the decision before stopping
+    width = width of the rate smoothing filter
+    clock = simulation clock
+    """
+    def __init__(self, rate_monitors, sim_params, upper_threshold=60, threshold_diff=None, post_decision_margin=100*ms,
+                 width=5*ms, clock=defaultclock):
+        NetworkOperation.__init__(self, clock=clock, when='end')
+        self.rate_monitors=rate_monitors
+        self.sim_params=sim_params
+        self.upper_threshold=upper_threshold
+        self.threshold_diff=threshold_diff
+        self.post_decision_margin=post_decision_margin
+        # Rate monitors may average over bins of several time steps
+        self.bin_dt=getattr(rate_monitors[0], '_bin', 1)*clock.dt
+        width_dt=get_width_dt(width, self.bin_dt)
+        self.lag=2*width_dt
+        self.window=np.exp(-np.arange(-2*width_dt, 2*width_dt+1)**2*1./(2*width_dt**2))
+        self.window=self.window/np.sum(self.window)
+        self.reinit()
+
+    def reinit(self):
+        self.rt=None
+        self.decision_idx=-1
+        self.truncated=False
+        self.stop_time=None
+
+    def __call__(self):
+        if self.stop_time is not None:
+            if self.clock.t>=self.stop_time:
+                self.truncated=True
+                stop()
+            return
+
+        # Index and time of the latest sample whose smoothed rate can be computed exactly
+        num_samples=len(self.rate_monitors[0]._rate)
+        idx=num_samples-1-self.lag
+        if idx<self.lag:
+            return
+        time=idx*self.bin_dt
+        if not self.sim_params.stim_start_time < time < self.sim_params.stim_end_time:
+            return
+
+        rates=[]
+        for monitor in self.rate_monitors:
+            if isinstance(monitor, SmoothedPopulationRateMonitor) and monitor.lag==self.lag and \
+               len(monitor._smoothed)>idx:
+                # Already smoothed by the monitor
+                rates.append(monitor._smoothed[idx])
+            else:
+                rates.append(np.dot(monitor._rate[-len(self.window):], self.window))
+        for i,rate in enumerate(rates):
+            other_rate=max(rates[:i]+rates[i+1:]) if len(rates)>1 else 0
+            if rate>=self.upper_threshold and (self.threshold_diff is None or rate-other_rate>=self.threshold_diff):
+                self.decision_idx=i
+                self.rt=(time-self.sim_params.stim_start_time)/ms
+                self.stop_time=time+self.post_decision_margin
+                break
+
+
+class SessionWriter():
+    """
+    Append-only HDF5 writer for a session. The session file is created up front and each trial is written as soon as
+    it is recorded - behavior into datasets pre-allocated for all trials, firing rates into chunked, compressed
+    trials x time datasets that grow along both axes, and connection weights as the weights that changed since the
+    last trial (see WeightHistory) - so nothing accumulates in memory and trials that were recorded survive a crash.
+    output_file = HDF5 file to write to
+    session_monitor = SessionMonitor of the session (for its parameters)
+    compression = gzip compression level of the firing rates
+    """
+    def __init__(self, output_file, session_monitor, compression=4):
+        self.output_file=output_file
+        self.compression=compression
+        self.ntrials=session_monitor.sim_params.ntrials
+        self.f=h5py.File(output_file, 'w')
+        f=self.f
+
+        # Write basic parameters
+        f.attrs['conv_window']=session_monitor.conv_window
+
+        for name,params in [('sim_params',session_monitor.sim_params), ('network_params',session_monitor.network_params),
+                            ('pyr_params',session_monitor.pyr_params), ('inh_params',session_monitor.inh_params),
+                            ('plasticity_params',session_monitor.plasticity_params)]:
+            f_params=f.create_group(name)
+            for attr, value in params.iteritems():
+                f_params.attrs[attr] = value
+
+        f_behav=f.create_group('behavior')
+        f_behav['num_no_response']=0
+        for name in ['trial_rt','trial_resp','trial_correct']:
+            f_behav.create_dataset(name, (1,self.ntrials), maxshape=(1,None), dtype=float, fillvalue=float('NaN'))
+
+        f_neur=f.create_group('neural')
+        f_neur.create_dataset('trial_inputs', (session_monitor.network_params.num_groups,self.ntrials),
+            maxshape=(session_monitor.network_params.num_groups,None), dtype=float, fillvalue=float('NaN'))
+        f_neur.create_group('connections')
+        f_rates=f_neur.create_group('firing_rates')
+        f_rates.create_dataset('num_samples', (self.ntrials,), maxshape=(None,), dtype=int)
+        f.flush()
+
+    def grow(self, dataset, size, axis):
+        """
+        Make sure a dataset is at least size long along an axis
+        """
+        if dataset.shape[axis]<size:
+            dataset.resize(size, axis=axis)
+
+    def write_trial(self, trial_idx, inputs, rt, choice, correct, pop_rates, weight_records):
+        """
+        Write a trial
+        pop_rates = dictionary of population name -> firing rate
+        weight_records = dictionary of connection name -> weight record (see WeightHistory)
+        """
+        f_behav=self.f['behavior']
+        f_neur=self.f['neural']
+        for name,value in [('trial_rt',rt), ('trial_resp',choice), ('trial_correct',correct)]:
+            self.grow(f_behav[name], trial_idx+1, 1)
+            f_behav[name][0,trial_idx]=float(np.squeeze(value)) if value is not None else float('NaN')
+        self.grow(f_neur['trial_inputs'], trial_idx+1, 1)
+        f_neur['trial_inputs'][:,trial_idx]=inputs
+
+        f_rates=f_neur['firing_rates']
+        num_samples=0
+        for name,rate in pop_rates.iteritems():
+            if not name in f_rates:
+                f_rates.create_dataset(name, (self.ntrials,len(rate)), maxshape=(None,None), dtype=float,
+                    chunks=(1,max(1,len(rate))), compression='gzip', compression_opts=self.compression,
+                    fillvalue=float('NaN'))
+            self.grow(f_rates[name], trial_idx+1, 0)
+            self.grow(f_rates[name], len(rate), 1)
+            f_rates[name][trial_idx,:len(rate)]=rate
+            num_samples=max(num_samples, len(rate))
+        self.grow(f_rates['num_samples'], trial_idx+1, 0)
+        f_rates['num_samples'][trial_idx]=num_samples
+
+        f_conns=f_neur['connections']
+        for conn,record in weight_records.iteritems():
+            f_conn=f_conns.require_group(conn)
+            if 'trial_%d' % trial_idx in f_conn:
+                del f_conn['trial_%d' % trial_idx]
+            write_weight_record(f_conn.create_group('trial_%d' % trial_idx), record)
+        self.f.flush()
+
+    def read_rates(self, name):
+        """
+        Firing rates of a population in every recorded trial (trials x time, NaN after the end of shorter trials)
+        """
+        if self.f is not None:
+            return np.array(self.f['neural/firing_rates/%s' % name])
+        f=h5py.File(self.output_file, 'r')
+        rates=np.array(f['neural/firing_rates/%s' % name])
+        f.close()
+        return rates
+
+    def read_weights(self, conn, trial_idx):
+        """
+        Weight matrix of a connection after a trial (CSR)
+        """
+        f=self.f if self.f is not None else h5py.File(self.output_file, 'r')
+        W=read_weights(f['neural/connections/%s' % conn], ['trial_%d' % idx for idx in range(trial_idx+1)], trial_idx)
+        if self.f is None:
+            f.close()
+        return W
+
+    def close(self, num_no_response):
+        f_behav=self.f['behavior']
+        del f_behav['num_no_response']
+        f_behav['num_no_response']=num_no_response
+        self.f.close()
+        self.f=None
 
 
 class SessionMonitor():
     def __init__(self, network, sim_params, plasticity_params, record_connections=[], conv_window=10,
-                 record_firing_rates=False):
+                 record_firing_rates=False, output_file=None):
+        """
+        Records the behavior, firing rates, and connection weights of each trial of a session
+        output_file = if not None, each trial is written to this file as it is recorded instead of being kept in memory
+        """
         self.sim_params=sim_params
         self.plasticity_params=plasticity_params
         self.network_params=network.params
@@ -27,9 +450,10 @@ class SessionMonitor():
         self.trial_correct=np.zeros((1,sim_params.ntrials))
         self.record_connections=record_connections
         self.record_firing_rates=record_firing_rates
-        self.trial_weights={}
+        # Weights are kept as the changes between trials, or only written to the output file if there is one
+        self.weight_histories={}
         for conn in self.record_connections:
-            self.trial_weights[conn]=[]
+            self.weight_histories[conn]=WeightHistory(keep_records=output_file is None)
         self.correct_avg = np.zeros((1, sim_params.ntrials))
         self.pop_rates={}
         if self.record_firing_rates:
@@ -38,6 +462,10 @@ class SessionMonitor():
 
                 self.pop_rates['inhibitory_rate']=[]
         self.num_no_response=0
+        self.num_recorded=0
+        self.writer=None
+        if output_file is not None:
+            self.writer=SessionWriter(output_file, self)
 
     def record_trial(self, trial_idx, inputs, correct_input, wta_net, wta_monitor):
         self.trial_inputs[:,trial_idx]=inputs
@@ -46,14 +474,21 @@ class SessionMonitor():
         e_rate_1 = wta_monitor.monitors['excitatory_rate_1'].smooth_rate(width= 5 * ms, filter = 'gaussian')
         i_rate = wta_monitor.monitors['inhibitory_rate'].smooth_rate(width= 5 * ms, filter = 'gaussian')
 
+        trial_rates={}
         if self.record_firing_rates:
-            self.pop_rates['excitatory_rate_0'].append(e_rate_0)
-            self.pop_rates['excitatory_rate_1'].append(e_rate_1)
-            self.pop_rates['inhibitory_rate'].append(i_rate)
-
-        rt, choice = get_response_time(np.array([e_rate_0, e_rate_1]), self.sim_params.stim_start_time,
-            self.sim_params.stim_end_time, upper_threshold = self.network_params.resp_threshold,
-            dt = self.sim_params.dt)
+            trial_rates={'excitatory_rate_0': e_rate_0, 'excitatory_rate_1': e_rate_1, 'inhibitory_rate': i_rate}
+            if self.writer is None:
+                for name,rate in trial_rates.iteritems():
+                    self.pop_rates[name].append(rate)
+
+        if 'decision' in wta_monitor.monitors:
+            # Decision already detected online
+            rt = wta_monitor.monitors['decision'].rt
+            choice = wta_monitor.monitors['decision'].decision_idx
+        else:
+            rt, choice = get_response_time(np.array([e_rate_0, e_rate_1]), self.sim_params.stim_start_time,
+                self.sim_params.stim_end_time, upper_threshold = self.network_params.resp_threshold,
+                dt = get_rate_dt(wta_monitor.monitors['excitatory_rate_0']))
 
         correct = choice == correct_input
         if choice>-1:
@@ -65,18 +500,41 @@ class SessionMonitor():
         self.trial_resp[0,trial_idx]=choice
         self.trial_correct[0,trial_idx]=correct
         self.correct_avg[0,trial_idx] = (np.sum(self.trial_correct))/(trial_idx+1)
+        weight_records={}
         for conn in self.record_connections:
-            self.trial_weights[conn].append(wta_net.connections[conn].W.todense())
+            weight_records[conn]=self.weight_histories[conn].add(wta_net.connections[conn].W)
+        if self.writer is not None:
+            self.writer.write_trial(trial_idx, inputs, rt, choice, correct, trial_rates, weight_records)
+        self.num_recorded=max(self.num_recorded, trial_idx+1)
+
+    def get_pop_rates(self, name):
+        """
+        Firing rates of a population in every trial (trials x time)
+        """
+        if self.writer is not None:
+            return self.writer.read_rates(name)
+        return np.array(self.pop_rates[name])
+
+    def get_trial_weights(self, conn, trial_idx):
+        """
+        Weight matrix of a connection after a trial (CSR)
+        """
+        if self.writer is not None and trial_idx<len(self.weight_histories[conn])-1:
+            return self.writer.read_weights(conn, trial_idx)
+        return self.weight_histories[conn].get(trial_idx)
 
     def get_correct_ma(self):
         correct_ma = np.convolve(self.trial_correct[0, :], np.ones((self.conv_window,)) / self.conv_window, mode='valid')
         return correct_ma
 
     def get_trial_diag_weights(self):
+        """
+        Mean diagonal weight of each recorded connection after each trial (computed as the trials are recorded)
+        """
         trial_diag_weights = np.zeros((len(self.record_connections), self.sim_params.ntrials))
         for i, conn in enumerate(self.record_connections):
-            for trial_idx in range(self.sim_params.ntrials):
-                trial_diag_weights[i, trial_idx] = np.mean(np.diagonal(self.trial_weights[conn][trial_idx]))
+            diag_means=self.weight_histories[conn].diag_means
+            trial_diag_weights[i, :len(diag_means)] = diag_means
         return trial_diag_weights
 
     def get_perc_correct(self):
@@ -101,12 +559,12 @@ class SessionMonitor():
             mean_e_pop_rates=[]
             std_e_pop_rates=[]
             for i in range(self.network_params.num_groups):
-                pop_rate_mat=np.array(self.pop_rates['excitatory_rate_%d' % i])
+                pop_rate_mat=self.get_pop_rates('excitatory_rate_%d' % i)
                 mean_e_pop_rates.append(np.mean(pop_rate_mat[trials,:],axis=0))
                 std_e_pop_rates.append(np.std(pop_rate_mat[trials,:],axis=0)/np.sqrt(len(trials)))
             mean_e_pop_rates=np.array(mean_e_pop_rates)
             std_e_pop_rates=np.array(std_e_pop_rates)
-            pop_rate_mat=np.array(self.pop_rates['inhibitory_rate'])
+            pop_rate_mat=self.get_pop_rates('inhibitory_rate')
             mean_i_pop_rate=np.mean(pop_rate_mat[trials,:],axis=0)
             std_i_pop_rate=np.std(pop_rate_mat[trials,:],axis=0)/np.sqrt(len(trials))
             plot_network_firing_rates(np.array(mean_e_pop_rates), self.sim_params, self.network_params,
@@ -114,13 +572,14 @@ class SessionMonitor():
 
     def plot_sorted_mean_firing_rates(self, trials, plt_title='Mean Firing Rates'):
         if self.record_firing_rates:
+            e_pop_rates=[self.get_pop_rates('excitatory_rate_%d' % i) for i in range(2)]
             chosen_pop_rates=[]
             unchosen_pop_rates=[]
             for trial_idx in trials:
-                resp=self.trial_resp[0,trial_idx]
+                resp=int(self.trial_resp[0,trial_idx])
                 if resp>-1:
-                    chosen_pop_rates.append(self.pop_rates['excitatory_rate_%d' % resp][trial_idx])
-                    unchosen_pop_rates.append(self.pop_rates['excitatory_rate_%d' % (1-resp)][trial_idx])
+                    chosen_pop_rates.append(e_pop_rates[resp][trial_idx])
+                    unchosen_pop_rates.append(e_pop_rates[1-resp][trial_idx])
             if len(chosen_pop_rates)>1:
                 chosen_pop_rates=np.array(chosen_pop_rates)
                 unchosen_pop_rates=np.array(unchosen_pop_rates)
@@ -316,56 +775,31 @@ class SessionMonitor():
         plt.ylabel('choice e0=0 e1=1')
         #plt.show()
 
-    def write_output(self, output_file):
-
-        f = h5py.File(output_file, 'w')
-
-        # Write basic parameters
-
-        f.attrs['conv_window']=self.conv_window
-
-        f_sim_params=f.create_group('sim_params')
-        for attr, value in self.sim_params.iteritems():
-            f_sim_params.attrs[attr] = value
-
-        f_network_params=f.create_group('network_params')
-        for attr, value in self.network_params.iteritems():
-            f_network_params.attrs[attr] = value
-
-        f_pyr_params=f.create_group('pyr_params')
-        for attr, value in self.pyr_params.iteritems():
-            f_pyr_params.attrs[attr] = value
-
-        f_inh_params=f.create_group('inh_params')
-        for attr, value in self.inh_params.iteritems():
-            f_inh_params.attrs[attr] = value
-
-        f_plasticity_params=f.create_group('plasticity_params')
-        for attr, value in self.plasticity_params.iteritems():
-            f_plasticity_params.attrs[attr] = value
-
-        f_behav=f.create_group('behavior')
-        f_behav['num_no_response']=self.num_no_response
-        f_behav['trial_rt']=self.trial_rt
-        f_behav['trial_resp']=self.trial_resp
-        f_behav['trial_correct']=self.trial_correct
-
-        f_neur=f.create_group('neural')
-        f_neur['trial_inputs']=self.trial_inputs
-        f_conns=f_neur.create_group('connections')
-        for conn in self.record_connections:
-            f_conn=f_conns.create_group(conn)
-            for trial_idx in range(self.sim_params.ntrials):
-                f_conn['trial_%d' % trial_idx]=self.trial_weights[conn][trial_idx]
-
-        f_rates=f_neur.create_group('firing_rates')
-        if self.record_firing_rates:
-            for trial_idx in range(self.sim_params.ntrials):
-                f_trial=f_rates.create_group('trial_%d' % trial_idx)
-                f_trial['inhibitory_rate']=self.pop_rates['inhibitory_rate'][trial_idx]
-                for i in range(self.network_params.num_groups):
-                    f_trial['excitatory_rate_%d' % i]=self.pop_rates['excitatory_rate_%d' % i][trial_idx]
-        f.close()
+    def write_output(self, output_file=None):
+        """
+        Write the session - if trials were written as they were recorded, only finishes the session file
+        output_file = file to write to (must be the session file if trials were written as they were recorded)
+        """
+        if self.writer is not None:
+            if output_file is not None and os.path.abspath(output_file)!=os.path.abspath(self.writer.output_file):
+                raise ValueError('Session is being written to %s, cannot write it to %s' % (self.writer.output_file,
+                                                                                            output_file))
+            if self.writer.f is not None:
+                self.writer.close(self.num_no_response)
+            return
+
+        if output_file is None:
+            raise ValueError('No output file to write the session to')
+        writer=SessionWriter(output_file, self)
+        for trial_idx in range(self.num_recorded):
+            trial_rates={}
+            if self.record_firing_rates:
+                trial_rates=dict([(name, rates[trial_idx]) for name,rates in self.pop_rates.iteritems()])
+            weight_records=dict([(conn, self.weight_histories[conn].records[trial_idx]) for conn in
+                                 self.record_connections])
+            writer.write_trial(trial_idx, self.trial_inputs[:,trial_idx], self.trial_rt[0,trial_idx],
+                self.trial_resp[0,trial_idx], self.trial_correct[0,trial_idx], trial_rates, weight_records)
+        writer.close(self.num_no_response)
 
 
 class WTAMonitor():
@@ -380,9 +814,15 @@ class WTAMonitor():
     #       record_spikes = record spikes if true
     #       record_firing_rate = record firing rate if true
     #       record_inputs = record inputs if true
+    #       stop_on_decision = stop the simulation post_decision_margin after a decision is detected if true (requires
+    #                          record_firing_rate)
+    #       record_params = recording resolution and precision of each signal (see default_record_params)
     def __init__(self, network, lfp_source, voxel, sim_params, record_lfp=True, record_voxel=True, record_neuron_state=False,
                  record_spikes=True, record_firing_rate=True, record_inputs=False, record_connections=None,
-                 save_summary_only=False, clock=defaultclock):
+                 save_summary_only=False, clock=defaultclock, stop_on_decision=False, post_decision_margin=100*ms,
+                 record_params=default_record_params):
+        if stop_on_decision and not record_firing_rate:
+            raise ValueError('stop_on_decision requires record_firing_rate')
         self.network_params=network.params
         self.pyr_params=network.pyr_params
         self.inh_params=network.inh_params
@@ -402,15 +842,28 @@ class WTAMonitor():
         self.record_inputs=record_inputs
         self.record_connections=record_connections
         self.save_summary_only=save_summary_only
+        self.stop_on_decision=stop_on_decision
+        self.record_params=record_params
 
         # LFP monitor
         if self.record_lfp:
-            self.monitors['lfp'] = StateMonitor(lfp_source, 'LFP', record=0, clock=clock)
+            if record_params.lfp_dt is None and record_params.lfp_dtype is None:
+                self.monitors['lfp'] = StateMonitor(lfp_source, 'LFP', record=0, clock=clock)
+            else:
+                self.monitors['lfp'] = SampledStateMonitor(lfp_source, 'LFP', record=0, dt=record_params.lfp_dt,
+                    dtype=get_dtype(record_params.lfp_dtype), clock=clock)
 
         # Voxel monitor
+        self.voxel_dt=None
         if self.record_voxel:
-            self.monitors['voxel'] = MultiStateMonitor(voxel, vars=['G_total','G_total_exc','y'],
-                record=True, clock=clock)
+            if record_params.voxel_dt is None and record_params.voxel_dtype is None:
+                self.monitors['voxel'] = MultiStateMonitor(voxel, vars=['G_total','G_total_exc','y'],
+                    record=True, clock=clock)
+            else:
+                self.monitors['voxel'] = MultiSampledStateMonitor(voxel, ['G_total','G_total_exc','y'],
+                    dt=record_params.voxel_dt, dtype=get_dtype(record_params.voxel_dtype), clock=clock)
+                if record_params.voxel_dt is not None:
+                    self.voxel_dt=self.monitors['voxel']['y'].dt
 
         # Network monitor
         if self.record_neuron_state:
@@ -420,17 +873,29 @@ class WTAMonitor():
                 self.record_idx.append(e_idx)
             i_idx=int(.8*self.network_params.network_group_size)
             self.record_idx.append(i_idx)
-            self.monitors['network'] = MultiStateMonitor(network, vars=['vm','g_ampa_r','g_ampa_x','g_ampa_b',
-                                                                        'g_gaba_a', 'g_nmda','I_ampa_r','I_ampa_x',
-                                                                        'I_ampa_b','I_gaba_a','I_nmda'],
-                record=self.record_idx, clock=clock)
+            state_vars=['vm','g_ampa_r','g_ampa_x','g_ampa_b','g_gaba_a', 'g_nmda','I_ampa_r','I_ampa_x','I_ampa_b',
+                        'I_gaba_a','I_nmda']
+            if record_params.neuron_state_dt is None and record_params.neuron_state_dtype is None:
+                self.monitors['network'] = MultiStateMonitor(network, vars=state_vars, record=self.record_idx,
+                    clock=clock)
+            else:
+                self.monitors['network'] = MultiSampledStateMonitor(network, state_vars, record=self.record_idx,
+                    dt=record_params.neuron_state_dt, dtype=get_dtype(record_params.neuron_state_dtype), clock=clock)
 
-        # Population rate monitors
+        # Population rate monitors - averaged over bins of rate_dt and smoothed online
         if self.record_firing_rate:
             for i,group_e in enumerate(network.groups_e):
-                self.monitors['excitatory_rate_%d' % i]=PopulationRateMonitor(group_e)
+                self.monitors['excitatory_rate_%d' % i]=SmoothedPopulationRateMonitor(group_e,
+                    bin=record_params.rate_dt)
+
+            self.monitors['inhibitory_rate']=SmoothedPopulationRateMonitor(network.group_i, bin=record_params.rate_dt)
 
-            self.monitors['inhibitory_rate']=PopulationRateMonitor(network.group_i)
+            # Decision detector
+            if self.stop_on_decision:
+                self.monitors['decision']=DecisionDetector([self.monitors['excitatory_rate_%d' % i] for i in
+                                                            range(self.network_params.num_groups)], sim_params,
+                    upper_threshold=self.network_params.resp_threshold, post_decision_margin=post_decision_margin,
+                    clock=clock)
 
         # Input rate monitors
         if record_inputs:
@@ -451,6 +916,20 @@ class WTAMonitor():
                 self.monitors['connection_%s' % connection]=ConnectionMonitor(network.connections[connection], store=True,
                     clock=Clock(dt=.5*second))
 
+    ## Get the time step a signal is recorded at
+    #       dt = requested recording time step (None for the clock time step)
+    def get_record_dt(self, dt):
+        if dt is None:
+            return float(self.clock.dt)
+        return max(1, int(round(dt/self.clock.dt)))*float(self.clock.dt)
+
+    ## Get the time step the BOLD signal is computed at - the voxel recording time step if the conductance is recorded
+    ## at a lower resolution, otherwise 1ms
+    def get_bold_dt(self):
+        if self.voxel_dt is not None:
+            return self.voxel_dt
+        return 1*ms
+
     # Plot monitor data
     def plot(self):
 
@@ -669,9 +1148,7 @@ class WTAMonitor():
                     conns=np.zeros((len(self.monitors[mon].values),1))
                     conn_times=[]
                     for idx, (time, conn_matrix) in enumerate(self.monitors[mon].values):
-                        conn_diag=np.diagonal(conn_matrix.todense())
-                        mean_w=np.mean(conn_diag)
-                        conns[idx,0]=mean_w
+                        conns[idx,0]=np.mean(connection_weights(conn_matrix).diagonal())
                         conn_times.append(time)
                     ax.plot(np.array(conn_times) / ms, conns[:,0]/nS, label=conn_name)
             legend(loc='best')
@@ -708,6 +1185,13 @@ class WTAMonitor():
         # Write basic parameters
         f.attrs['input_freq'] = input_freq
 
+        # Write online decision
+        if self.stop_on_decision:
+            decision=self.monitors['decision']
+            f.attrs['truncated'] = decision.truncated
+            f.attrs['rt'] = decision.rt if decision.rt is not None else float('NaN')
+            f.attrs['choice'] = decision.decision_idx
+
         f_sim_params=f.create_group('sim_params')
         for attr, value in self.sim_params.iteritems():
             f_sim_params.attrs[attr] = value
@@ -724,7 +1208,7 @@ class WTAMonitor():
         for attr, value in self.inh_params.iteritems():
             f_inh_params.attrs[attr] = value
 
-        f_plasticity_params=f.create_cgroup('plasticity_params')
+        f_plasticity_params=f.create_group('plasticity_params')
         for attr, value in self.plasticity_params.iteritems():
             f_plasticity_params.attrs[attr] = value
 
@@ -733,6 +1217,7 @@ class WTAMonitor():
             if self.record_lfp:
                 f_lfp = f.create_group('lfp')
                 f_lfp['lfp']=self.monitors['lfp'].values
+                f_lfp.attrs['dt']=self.get_record_dt(self.record_params.lfp_dt)
 
             # Write voxel data
             if self.record_voxel:
@@ -741,21 +1226,13 @@ class WTAMonitor():
                 for attr, value in self.voxel_params.iteritems():
                     f_vox_params.attrs[attr] = value
 
+                voxel_dtype=get_dtype(self.record_params.voxel_dtype)
+                f_vox.attrs['dt']=float(self.get_bold_dt())
                 f_vox_total=f_vox.create_group('total_syn')
-                f_vox_total['G_total'] = self.monitors['voxel']['G_total'].values
-                f_vox_total['s'] = self.monitors['voxel']['s'].values
-                f_vox_total['f_in'] = self.monitors['voxel']['f_in'].values
-                f_vox_total['v'] = self.monitors['voxel']['v'].values
-                f_vox_total['q'] = self.monitors['voxel']['q'].values
-                f_vox_total['y'] = self.monitors['voxel']['y'].values
-
                 f_vox_exc=f_vox.create_group('exc_syn')
-                f_vox_exc['G_total'] = self.monitors['voxel_exc']['G_total'].values
-                f_vox_exc['s'] = self.monitors['voxel_exc']['s'].values
-                f_vox_exc['f_in'] = self.monitors['voxel_exc']['f_in'].values
-                f_vox_exc['v'] = self.monitors['voxel_exc']['v'].values
-                f_vox_exc['q'] = self.monitors['voxel_exc']['q'].values
-                f_vox_exc['y'] = self.monitors['voxel_exc']['y'].values
+                for var in ['G_total', 's', 'f_in', 'v', 'q', 'y']:
+                    f_vox_total[var] = self.monitors['voxel'][var].values.astype(voxel_dtype)
+                    f_vox_exc[var] = self.monitors['voxel_exc'][var].values.astype(voxel_dtype)
 
             # Write neuron state data
             if self.record_neuron_state:
@@ -774,17 +1251,20 @@ class WTAMonitor():
                 #f_state['I_gaba_b'] = self.monitors['network']['I_gaba_b'].values
                 f_state['vm'] = self.monitors['network']['vm'].values
                 f_state['record_idx'] = np.array(self.record_idx)
+                f_state.attrs['dt']=self.get_record_dt(self.record_params.neuron_state_dt)
 
             # Write network firing rate data
             if self.record_firing_rate:
                 f_rates = f.create_group('firing_rates')
+                rate_dtype=get_dtype(self.record_params.rate_dtype)
+                f_rates.attrs['dt']=self.monitors['inhibitory_rate']._bin*float(self.clock.dt)
                 e_rates = []
                 for i in range(self.network_params.num_groups):
                     e_rates.append(self.monitors['excitatory_rate_%d' % i].smooth_rate(width=5 * ms, filter='gaussian'))
-                f_rates['e_rates'] = np.array(e_rates)
+                f_rates['e_rates'] = np.array(e_rates, dtype=rate_dtype)
 
                 i_rates = [self.monitors['inhibitory_rate'].smooth_rate(width=5 * ms, filter='gaussian')]
-                f_rates['i_rates'] = np.array(i_rates)
+                f_rates['i_rates'] = np.array(i_rates, dtype=rate_dtype)
 
             # Write input firing rate data
             if self.record_inputs:
@@ -802,13 +1282,11 @@ class WTAMonitor():
                 for idx in range(self.network_params.num_groups):
                     spike_monitor=self.monitors['excitatory_spike_%d' % idx]
                     if len(spike_monitor.spikes):
-                        f_spikes['e.%d.spike_neurons' % idx] = np.array([s[0] for s in spike_monitor.spikes])
-                        f_spikes['e.%d.spike_times' % idx] = np.array([s[1] for s in spike_monitor.spikes])
+                        write_spikes(f_spikes, 'e.%d' % idx, spike_monitor.spikes, len(spike_monitor.source))
 
                 spike_monitor=self.monitors['inhibitory_spike']
                 if len(spike_monitor.spikes):
-                    f_spikes['i.spike_neurons'] = np.array([s[0] for s in spike_monitor.spikes])
-                    f_spikes['i.spike_times'] = np.array([s[1] for s in spike_monitor.spikes])
+                    write_spikes(f_spikes, 'i', spike_monitor.spikes, len(spike_monitor.source))
 
             # Write connection data
             if self.record_connections:
@@ -817,28 +1295,44 @@ class WTAMonitor():
                     if mon.startswith('connection_'):
                         conn_name=mon[11:]
                         f_conn=f_conns.create_group(conn_name)
+                        # Snapshots are stored as the weights that changed since the previous one
+                        history=WeightHistory(keep_records=False)
+                        times=[]
                         for idx, (time, conn_matrix) in enumerate(self.monitors[mon].values):
-                            f_conn['time_%.4f' % time]=conn_matrix.todense()
+                            write_weight_record(f_conn.create_group('time_%.4f' % time), history.add(conn_matrix))
+                            times.append(time)
+                        f_conn['times']=np.array(times)
 
         else:
             f_summary=f.create_group('summary')
-            endIdx=int(self.sim_params.stim_end_time/self.clock.dt)
-            startIdx=endIdx-500
+            rate_dt=self.monitors['inhibitory_rate']._bin*float(self.clock.dt)
+            endIdx=int(self.sim_params.stim_end_time/rate_dt)
+            startIdx=endIdx-int(round(500*self.clock.dt/rate_dt))
+            # Window that trial AUCs are computed from (see sweep_store.final_window)
+            finalStartIdx=endIdx-int(round(float(final_window)/rate_dt))
+            # Trials stopped after a decision end before the stimulus does - windows without rates are stored as NaN
             e_mean_final=[]
             e_max=[]
+            e_final_window_mean=[]
+            e_final_window_max=[]
             for idx in range(self.network_params.num_groups):
                 rate_monitor=self.monitors['excitatory_rate_%d' % idx]
                 e_rate=rate_monitor.smooth_rate(width=5*ms, filter='gaussian')
-                e_mean_final.append(np.mean(e_rate[startIdx:endIdx]))
+                e_mean_final.append(get_window_summary(e_rate, startIdx, endIdx)[0][0])
                 e_max.append(np.max(e_rate))
+                final_mean,final_max=get_window_summary(e_rate, finalStartIdx, endIdx)
+                e_final_window_mean.append(final_mean[0])
+                e_final_window_max.append(final_max[0])
             rate_monitor=self.monitors['inhibitory_rate']
             i_rate=rate_monitor.smooth_rate(width=5*ms, filter='gaussian')
-            i_mean_final=[np.mean(i_rate[startIdx:endIdx])]
+            i_mean_final=[get_window_summary(i_rate, startIdx, endIdx)[0][0]]
             i_max=[np.max(i_rate)]
             f_summary['e_mean']=np.array(e_mean_final)
             f_summary['e_max']=np.array(e_max)
             f_summary['i_mean']=np.array(i_mean_final)
             f_summary['i_max']=np.array(i_max)
+            f_summary['e_final_mean']=np.array(e_final_window_mean)
+            f_summary['e_final_max']=np.array(e_final_window_max)
             f_summary['bold_max']=np.max(self.monitors['voxel']['y'].values)
             f_summary['bold_exc_max']=np.max(self.monitors['voxel_exc']['y'].values)
 
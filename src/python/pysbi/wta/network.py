@@ -1,6 +1,7 @@
 from brian.stdp import ExponentialSTDP
 from numpy.matlib import randn, rand
 from time import time
+import os
 import brian
 from brian.clock import defaultclock, Clock
 from brian.directcontrol import PoissonGroup
@@ -17,12 +18,19 @@ from brian.tools.parameters import Parameters
 from brian.units import siemens, second
 import argparse
 import numpy as np
-from pysbi.util.utils import init_connection
+from scipy import sparse
+from pysbi.util.compile_cache import use_compile_cache, CompileCacheMonitor
+from pysbi.util.utils import init_connection, get_response_times, Struct, connection_from_sparse, connection_to_sparse, \
+    random_sparse_matrix
 from pysbi.voxel import Voxel, LFPSource, get_bold_signal
-from pysbi.wta.monitor import WTAMonitor
+from pysbi.wta.connectivity import ConnectivityCache, seeded_random
+from pysbi.wta.monitor import WTAMonitor, BatchPopulationRateMonitor, default_record_params
 brian.set_global_preferences(useweave=True,openmp=True,useweave_linear_diffeq =True,
                              gcc_options = ['-ffast-math','-march=native'],usecodegenweave = True,
                              usecodegenreset = True)
+# Share compiled code between processes (see pysbi.wta.warmup)
+if 'PYSBI_COMPILE_CACHE' in os.environ:
+    use_compile_cache(os.environ['PYSBI_COMPILE_CACHE'])
 
 pyr_params=Parameters(
     C=0.5*nF,
@@ -127,9 +135,16 @@ class WTANetworkGroup(NeuronGroup):
     #       params = network parameters
     #       background_input = background input source
     #       task_inputs = task input sources
+    #       num_trials = number of independent network replicas in the group (see WTANetworkBatch)
+    #       connectivity_cache = ConnectivityCache to reuse generated connectivity from (None to always generate it)
+    #       connectivity_seed = random seed for generating the connectivity (None for unseeded)
     def __init__(self, params=default_params, pyr_params=pyr_params(), inh_params=inh_params(),
-                 plasticity_params=plasticity_params(), background_input=None, task_inputs=None, clock=defaultclock):
+                 plasticity_params=plasticity_params(), background_input=None, task_inputs=None, clock=defaultclock,
+                 num_trials=1, connectivity_cache=None, connectivity_seed=None):
         self.params=params
+        self.num_trials=num_trials
+        self.connectivity_cache=connectivity_cache
+        self.connectivity_seed=connectivity_seed
         self.pyr_params=pyr_params
         self.inh_params=inh_params
         self.plasticity_params=plasticity_params
@@ -171,7 +186,7 @@ class WTANetworkGroup(NeuronGroup):
         # Total synaptic current
         eqs += Equations('I_abs=(I_ampa_r**2)**.5+(I_ampa_b**2)**.5+(I_ampa_x**2)**.5+(I_nmda**2)**.5+(I_gaba_a**2)**.5 : amp')
 
-        NeuronGroup.__init__(self, params.network_group_size, model=eqs, threshold=-20*mV, refractory=1*ms,
+        NeuronGroup.__init__(self, params.network_group_size*num_trials, model=eqs, threshold=-20*mV, refractory=1*ms,
             reset=params.Vr, compile=True, freeze=True, clock=clock)
 
         self.init_subpopulations()
@@ -212,11 +227,60 @@ class WTANetworkGroup(NeuronGroup):
         self.group_i.g_gaba_a = rand(self.i_size)*self.inh_params.w_gaba*2.0
 
 
-    ## Initialize network connectivity
+    ## Initialize network connectivity - restored from the connectivity cache if one is given and it contains
+    ## connectivity generated with the same parameters (and seed)
     def init_connectivity(self, clock):
         self.connections={}
         self.stdp={}
 
+        cached_connections=None
+        if self.connectivity_cache is not None:
+            cache_key=self.connectivity_cache.get_key(self.params, self.pyr_params, self.inh_params,
+                seed=self.connectivity_seed)
+            cached_connections=self.connectivity_cache.get(cache_key)
+
+        projections=self.get_projections()
+        if cached_connections is not None and all([name in cached_connections for name in projections]):
+            for name,(pop1,pop2,target_name) in projections.iteritems():
+                W,D=cached_connections[name]
+                self.connections[name]=connection_from_sparse(pop1, pop2, target_name, W, delay=D)
+        else:
+            with seeded_random(self.connectivity_seed):
+                self.generate_connections()
+            if self.connectivity_cache is not None:
+                self.connectivity_cache.put(cache_key, dict([(name,connection_to_sparse(conn)) for name,conn in
+                                                             self.connections.iteritems()]))
+
+        if self.task_inputs is not None:
+            for i in range(self.params.num_groups):
+                # Input projections plasticity
+                self.stdp['stdp%d_%d' % (i,i)] = ExponentialSTDP(self.connections['t%d->e%d_ampa' % (i, i)],
+                    self.plasticity_params.tau_pre, self.plasticity_params.tau_post, self.plasticity_params.dA_pre,
+                    self.plasticity_params.dA_post, wmax=self.plasticity_params.gmax, update='additive', clock=clock)
+                self.stdp['stdp%d_%d' % (i,1-i)] = ExponentialSTDP(self.connections['t%d->e%d_ampa' % (i, 1-i)],
+                    self.plasticity_params.tau_pre, self.plasticity_params.tau_post, self.plasticity_params.dA_pre,
+                    self.plasticity_params.dA_post, wmax=self.plasticity_params.gmax, update='additive', clock=clock)
+
+    ## Source, target and target state variable of each connection in the network
+    def get_projections(self):
+        projections={}
+        for i in range(self.params.num_groups):
+            projections['e%d->e%d_ampa' % (i,i)]=(self.groups_e[i], self.groups_e[i], 'g_ampa_r')
+            projections['e%d->e%d_nmda' % (i,i)]=(self.groups_e[i], self.groups_e[i], 'g_nmda')
+        projections['e->i_ampa']=(self.group_e, self.group_i, 'g_ampa_r')
+        projections['e->i_nmda']=(self.group_e, self.group_i, 'g_nmda')
+        projections['i->e_gabaa']=(self.group_i, self.group_e, 'g_gaba_a')
+        projections['i->i_gabaa']=(self.group_i, self.group_i, 'g_gaba_a')
+        if self.background_input is not None:
+            projections['b->ampa']=(self.background_input, self, 'g_ampa_b')
+        if self.task_inputs is not None:
+            for i in range(self.params.num_groups):
+                projections['t%d->e%d_ampa' % (i,i)]=(self.task_inputs[i], self.groups_e[i], 'g_ampa_x')
+                projections['t%d->e%d_ampa' % (i,1-i)]=(self.task_inputs[i], self.groups_e[1-i], 'g_ampa_x')
+        return projections
+
+    ## Generate new random network connectivity
+    def generate_connections(self):
         # Iterate over input groups
         for i in range(self.params.num_groups):
 
@@ -262,19 +326,163 @@ class WTANetworkGroup(NeuronGroup):
                 self.connections['t%d->e%d_ampa' % (i,1-i)].connect_one_to_one(weight=self.pyr_params.w_ampa_ext_incorrect,
                     delay=.5*ms)
 
-                # Input projections plasticity
-                self.stdp['stdp%d_%d' % (i,i)] = ExponentialSTDP(self.connections['t%d->e%d_ampa' % (i, i)],
-                    self.plasticity_params.tau_pre, self.plasticity_params.tau_post, self.plasticity_params.dA_pre,
-                    self.plasticity_params.dA_post, wmax=self.plasticity_params.gmax, update='additive', clock=clock)
-                self.stdp['stdp%d_%d' % (i,1-i)] = ExponentialSTDP(self.connections['t%d->e%d_ampa' % (i, 1-i)],
-                    self.plasticity_params.tau_pre, self.plasticity_params.tau_post, self.plasticity_params.dA_pre,
-                    self.plasticity_params.dA_post, wmax=self.plasticity_params.gmax, update='additive', clock=clock)
+
+# Batch of independent WTA networks (one per trial) simulated as a single block-diagonal NeuronGroup
+class WTANetworkBatch(WTANetworkGroup):
+
+    ### Constructor
+    #       num_trials = number of trials (network replicas) to simulate together
+    #       params = network parameters
+    #       background_input = background input source (background_input_size neurons per trial)
+    #       task_inputs = task input sources (task_input_size neurons per trial)
+    def __init__(self, num_trials, params=default_params, pyr_params=pyr_params(), inh_params=inh_params(),
+                 plasticity_params=plasticity_params(), background_input=None, task_inputs=None, clock=defaultclock):
+        WTANetworkGroup.__init__(self, params=params, pyr_params=pyr_params, inh_params=inh_params,
+            plasticity_params=plasticity_params, background_input=background_input, task_inputs=task_inputs,
+            clock=clock, num_trials=num_trials)
+
+    ## Initialize excitatory and inhibitory subpopulations of each trial
+    def init_subpopulations(self):
+        self.e_size=int(self.params.network_group_size*.8)
+        self.i_size=int(self.params.network_group_size*.2)
+
+        self.trial_group_e=[]
+        self.trial_group_i=[]
+        self.trial_groups_e=[]
+        for k in range(self.num_trials):
+            # Each trial occupies a contiguous block of network_group_size neurons: excitatory then inhibitory
+            trial_group=self.subgroup(self.params.network_group_size)
+
+            group_e=trial_group.subgroup(self.e_size)
+            group_e.C=self.pyr_params.C
+            group_e.gL=self.pyr_params.gL
+            group_e._refractory_time=self.pyr_params.refractory
+
+            group_i=trial_group.subgroup(self.i_size)
+            group_i.C=self.inh_params.C
+            group_i.gL=self.inh_params.gL
+            group_i._refractory_time=self.inh_params.refractory
+
+            groups_e=[]
+            for i in range(self.params.num_groups):
+                groups_e.append(group_e.subgroup(int(self.params.f*self.e_size)))
+
+            # Initialize state variables
+            group_e.g_ampa_b = rand(self.e_size)*self.pyr_params.w_ampa_ext_correct*2.0
+            group_e.g_nmda = rand(self.e_size)*self.pyr_params.w_nmda*2.0
+            group_e.g_gaba_a = rand(self.e_size)*self.pyr_params.w_gaba*2.0
+            group_i.g_ampa_r = rand(self.i_size)*self.inh_params.w_ampa_rec*2.0
+            group_i.g_ampa_b = rand(self.i_size)*self.inh_params.w_ampa_ext*2.0
+            group_i.g_nmda = rand(self.i_size)*self.inh_params.w_nmda*2.0
+            group_i.g_gaba_a = rand(self.i_size)*self.inh_params.w_gaba*2.0
+
+            self.trial_group_e.append(group_e)
+            self.trial_group_i.append(group_i)
+            self.trial_groups_e.append(groups_e)
+
+        self.vm = self.params.EL+randn(len(self))*mV
+
+    ## Initialize network connectivity - one connection object per projection type, with a diagonal block per trial so
+    ## that trials never interact
+    def init_connectivity(self, clock):
+        self.connections={}
+        self.stdp={}
+
+        # Weight matrix blocks of each recurrent connection: (weight matrix, presynaptic group, postsynaptic group)
+        blocks={}
+        for k in range(self.num_trials):
+            group_e=self.trial_group_e[k]
+            group_i=self.trial_group_i[k]
+
+            # E population - recurrent connections
+            for i,group in enumerate(self.trial_groups_e[k]):
+                blocks.setdefault(('e%d->e%d_ampa' % (i,i), 'g_ampa_r'),[]).append((random_sparse_matrix(len(group),
+                    len(group), self.params.p_e_e, self.pyr_params.w_ampa_rec, allow_self_conn=False), group, group))
+                blocks.setdefault(('e%d->e%d_nmda' % (i,i), 'g_nmda'),[]).append((random_sparse_matrix(len(group),
+                    len(group), self.params.p_e_e, self.pyr_params.w_nmda, allow_self_conn=False), group, group))
+
+            # E -> I excitatory connections
+            blocks.setdefault(('e->i_ampa', 'g_ampa_r'),[]).append((random_sparse_matrix(self.e_size, self.i_size,
+                self.params.p_e_i, self.inh_params.w_ampa_rec), group_e, group_i))
+            blocks.setdefault(('e->i_nmda', 'g_nmda'),[]).append((random_sparse_matrix(self.e_size, self.i_size,
+                self.params.p_e_i, self.inh_params.w_nmda), group_e, group_i))
+
+            # I -> E - inhibitory connections
+            blocks.setdefault(('i->e_gabaa', 'g_gaba_a'),[]).append((random_sparse_matrix(self.i_size, self.e_size,
+                self.params.p_i_e, self.pyr_params.w_gaba), group_i, group_e))
+
+            # I population - recurrent connections
+            blocks.setdefault(('i->i_gabaa', 'g_gaba_a'),[]).append((random_sparse_matrix(self.i_size, self.i_size,
+                self.params.p_i_i, self.inh_params.w_gaba, allow_self_conn=False), group_i, group_i))
+
+        for (name,target_name),conn_blocks in blocks.iteritems():
+            self.connections[name]=connection_from_sparse(self, self, target_name,
+                self.assemble_blocks(conn_blocks, self, self), delay=.5*ms)
+
+        if self.background_input is not None:
+            # Background -> E+I population connections, one-to-one within each trial
+            background_blocks=[]
+            for k in range(self.num_trials):
+                background_e=self.background_input.subgroup(self.e_size)
+                background_i=self.background_input.subgroup(self.i_size)
+                background_blocks.append((sparse.identity(self.e_size)*float(self.pyr_params.w_ampa_bak), background_e,
+                                          self.trial_group_e[k]))
+                background_blocks.append((sparse.identity(self.i_size)*float(self.inh_params.w_ampa_bak), background_i,
+                                          self.trial_group_i[k]))
+            self.connections['b->ampa']=connection_from_sparse(self.background_input, self, 'g_ampa_b',
+                self.assemble_blocks(background_blocks, self.background_input, self), delay=.5*ms)
+
+        if self.task_inputs is not None:
+            # Task input -> E population connections
+            for i in range(self.params.num_groups):
+                correct_blocks=[]
+                incorrect_blocks=[]
+                for k in range(self.num_trials):
+                    task_input=self.task_inputs[i].subgroup(self.params.task_input_size)
+                    correct_blocks.append((sparse.identity(len(task_input))*float(self.pyr_params.w_ampa_ext_correct),
+                                           task_input, self.trial_groups_e[k][i]))
+                    incorrect_blocks.append((sparse.identity(len(task_input))*float(self.pyr_params.w_ampa_ext_incorrect),
+                                             task_input, self.trial_groups_e[k][1-i]))
+                self.connections['t%d->e%d_ampa' % (i,i)]=connection_from_sparse(self.task_inputs[i], self,
+                    'g_ampa_x', self.assemble_blocks(correct_blocks, self.task_inputs[i], self), delay=.5*ms)
+                self.connections['t%d->e%d_ampa' % (i,1-i)]=connection_from_sparse(self.task_inputs[i], self,
+                    'g_ampa_x', self.assemble_blocks(incorrect_blocks, self.task_inputs[i], self), delay=.5*ms)
+
+    ## Assemble a sparse weight matrix between two groups from blocks connecting their subgroups
+    #       blocks = list of (weight matrix, presynaptic subgroup, postsynaptic subgroup)
+    #       source = presynaptic group
+    #       target = postsynaptic group
+    def assemble_blocks(self, blocks, source, target):
+        rows=[]
+        cols=[]
+        data=[]
+        for W,pop1,pop2 in blocks:
+            W=sparse.coo_matrix(W)
+            rows.append(W.row+pop1._origin-source._origin)
+            cols.append(W.col+pop2._origin-target._origin)
+            data.append(W.data)
+        return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(source),len(target)))
+
+    ## Label of each neuron for batch rate monitoring: trial k, excitatory group i -> k*(num_groups+1)+i, trial k
+    ## inhibitory population -> k*(num_groups+1)+num_groups, unlabeled (-1) otherwise
+    def get_rate_labels(self):
+        labels=-np.ones(len(self), dtype=int)
+        for k in range(self.num_trials):
+            for i,group in enumerate(self.trial_groups_e[k]):
+                start=group._origin-self._origin
+                labels[start:start+len(group)]=k*(self.params.num_groups+1)+i
+            start=self.trial_group_i[k]._origin-self._origin
+            labels[start:start+self.i_size]=k*(self.params.num_groups+1)+self.params.num_groups
+        return labels
 
 
 def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_params=inh_params(),
             plasticity_params=plasticity_params(), output_file=None, save_summary_only=False, record_lfp=True,
             record_voxel=True, record_neuron_state=False, record_spikes=True, record_firing_rate=True,
-            record_inputs=False, record_connections=None, plot_output=False, report='text'):
+            record_inputs=False, record_connections=None, plot_output=False, report='text', connectivity_cache=None,
+            connectivity_seed=None, stop_on_decision=False, post_decision_margin=100*ms,
+            record_params=default_record_params):
     """
     Run WTA network
        wta_params = network parameters
@@ -288,8 +496,17 @@ def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_par
        record_firing_rate = record network firing rates if true
        record_inputs = record input firing rates if true
        plot_output = plot outputs if true
+       connectivity_cache = ConnectivityCache to reuse network connectivity from (None to generate new connectivity)
+       connectivity_seed = random seed for generating network connectivity
+       stop_on_decision = stop the simulation post_decision_margin after the network reaches a decision if true
+       post_decision_margin = time to continue simulating after a decision when stop_on_decision is true
+       record_params = recording resolution and precision of each signal (see monitor.default_record_params)
     """
 
+    # The decision detector reads the smoothed firing rates
+    if stop_on_decision and not record_firing_rate:
+        raise ValueError('stop_on_decision requires record_firing_rate')
+
     start_time = time()
 
     simulation_clock=Clock(dt=sim_params.dt)
@@ -304,7 +521,8 @@ def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_par
 
     # Create WTA network
     wta_network=WTANetworkGroup(params=wta_params, background_input=background_input, task_inputs=task_inputs,
-        pyr_params=pyr_params, inh_params=inh_params, plasticity_params=plasticity_params, clock=simulation_clock)
+        pyr_params=pyr_params, inh_params=inh_params, plasticity_params=plasticity_params, clock=simulation_clock,
+        connectivity_cache=connectivity_cache, connectivity_seed=connectivity_seed)
 
     @network_operation(when='start', clock=input_update_clock)
     def set_task_inputs():
@@ -332,7 +550,8 @@ def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_par
     wta_monitor=WTAMonitor(wta_network, lfp_source, voxel, sim_params, record_lfp=record_lfp, record_voxel=record_voxel,
         record_neuron_state=record_neuron_state, record_spikes=record_spikes, record_firing_rate=record_firing_rate,
         record_inputs=record_inputs, record_connections=record_connections, save_summary_only=save_summary_only,
-        clock=simulation_clock)
+        clock=simulation_clock, stop_on_decision=stop_on_decision, post_decision_margin=post_decision_margin,
+        record_params=record_params)
 
     @network_operation(when='start', clock=simulation_clock)
     def inject_muscimol():
@@ -364,18 +583,28 @@ def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_par
 #        labels[monitor]=(name,str(monitor))
 #    writer.document_network(net=net, labels=labels)
 
-    # Run simulation
+    # Run simulation - code is compiled when the network is first run
     start_time = time()
-    net.run(sim_params.trial_duration, report=report)
+    compile_monitor=CompileCacheMonitor()
+    try:
+        net.run(sim_params.trial_duration, report=report)
+    finally:
+        compile_monitor.close()
     print "Simulation time: %.2fs" % (time() - start_time)
+    print compile_monitor.report()
+    if stop_on_decision and wta_monitor.monitors['decision'].truncated:
+        print "Stopped at %.3fs after decision (rt=%.1fms)" % (simulation_clock.t, wta_monitor.monitors['decision'].rt)
 
     # Compute BOLD signal
     if record_voxel:
         start_time = time()
+        # Conductance may be recorded at a lower resolution - compute the BOLD signal at that resolution
+        bold_dt=wta_monitor.get_bold_dt()
+        baseline_range=[int(500*ms/bold_dt), int(2500*ms/bold_dt)]
         wta_monitor.monitors['voxel_exc']=get_bold_signal(wta_monitor.monitors['voxel']['G_total_exc'].values[0],
-            voxel.params, [500, 2500], sim_params.trial_duration)
+            voxel.params, baseline_range, sim_params.trial_duration, dt=bold_dt)
         wta_monitor.monitors['voxel']=get_bold_signal(wta_monitor.monitors['voxel']['G_total'].values[0], voxel.params,
-            [500, 2500], sim_params.trial_duration)
+            baseline_range, sim_params.trial_duration, dt=bold_dt)
         print "BOLD generation time: %.2fs" % (time() - start_time)
 
     # Write output to file
@@ -391,6 +620,93 @@ def run_wta(wta_params, input_freq, sim_params, pyr_params=pyr_params(), inh_par
 
     return wta_monitor
 
+
+def run_wta_batch(wta_params, input_freqs, sim_params, pyr_params=pyr_params(), inh_params=inh_params(),
+                  plasticity_params=plasticity_params(), report='text'):
+    """
+    Run a batch of independent WTA trials in a single block-diagonal network so that one integration loop advances
+    all trials together
+       wta_params = network parameters
+       input_freqs = mean firing rate of each input group in each trial (trials x num_groups)
+       sim_params = simulation parameters
+    Returns a Struct with e_rates (trials x num_groups x time), i_rates (trials x 1 x time), rt and choice (one per trial)
+    """
+
+    start_time = time()
+
+    input_freqs=np.array(input_freqs, dtype=float)
+    num_trials=input_freqs.shape[0]
+
+    simulation_clock=Clock(dt=sim_params.dt)
+    input_update_clock=Clock(dt=1/(wta_params.refresh_rate/Hz)*second)
+
+    background_input=PoissonGroup(wta_params.background_input_size*num_trials, rates=wta_params.background_freq,
+        clock=simulation_clock)
+    task_inputs=[]
+    for i in range(wta_params.num_groups):
+        task_inputs.append(PoissonGroup(wta_params.task_input_size*num_trials, rates=wta_params.task_input_resting_rate,
+            clock=simulation_clock))
+
+    # Create WTA network with one replica per trial
+    wta_network=WTANetworkBatch(num_trials, params=wta_params, background_input=background_input,
+        task_inputs=task_inputs, pyr_params=pyr_params, inh_params=inh_params, plasticity_params=plasticity_params,
+        clock=simulation_clock)
+
+    @network_operation(when='start', clock=input_update_clock)
+    def set_task_inputs():
+        for idx in range(len(task_inputs)):
+            rates=np.ones(num_trials)*wta_params.task_input_resting_rate
+            if sim_params.stim_start_time<=simulation_clock.t<sim_params.stim_end_time:
+                # Independent input noise for each trial
+                rates=input_freqs[:,idx]+np.random.randn(num_trials)*(wta_params.input_var/Hz)
+                rates[rates<wta_params.task_input_resting_rate/Hz]=wta_params.task_input_resting_rate/Hz
+            task_inputs[idx]._S[0, :]=np.repeat(rates, wta_params.task_input_size)
+
+    # Neurons of every trial that current and muscimol are applied to, so that they are set with one write per step
+    def get_group_idx(groups):
+        return np.concatenate([np.arange(len(group))+group._origin-wta_network._origin for group in groups])
+    e_idx=get_group_idx(wta_network.trial_group_e)
+    i_idx=get_group_idx(wta_network.trial_group_i)
+    injection_idx=get_group_idx([groups_e[sim_params.injection_site] for groups_e in wta_network.trial_groups_e])
+    I_dcs=wta_network.state('I_dcs')
+    g_muscimol=wta_network.state('g_muscimol')
+
+    @network_operation(clock=simulation_clock)
+    def inject_current():
+        if simulation_clock.t>sim_params.dcs_start_time:
+            I_dcs[e_idx]=float(sim_params.p_dcs)
+            I_dcs[i_idx]=float(sim_params.i_dcs)
+
+    @network_operation(when='start', clock=simulation_clock)
+    def inject_muscimol():
+        if sim_params.muscimol_amount>0:
+            g_muscimol[injection_idx]=float(sim_params.muscimol_amount)
+
+    # One rate monitor for all populations of all trials
+    rate_monitor=BatchPopulationRateMonitor(wta_network, wta_network.get_rate_labels())
+
+    # Create Brian network and reset clock
+    net=Network(background_input, task_inputs, set_task_inputs, wta_network, wta_network.connections.values(),
+        rate_monitor, inject_muscimol, inject_current)
+    print "Initialization time: %.2fs" % (time() - start_time)
+
+    # Run simulation
+    start_time = time()
+    net.run(sim_params.trial_duration, report=report)
+    print "Simulation time: %.2fs (%d trials)" % (time() - start_time, num_trials)
+
+    rates=rate_monitor.smooth_rate(width=5*ms, filter='gaussian')
+    rates=np.reshape(rates, (num_trials, wta_params.num_groups+1, rates.shape[1]))
+
+    results=Struct()
+    results.input_freqs=input_freqs
+    results.e_rates=rates[:,:wta_params.num_groups,:]
+    results.i_rates=rates[:,wta_params.num_groups:,:]
+    results.rt,results.choice=get_response_times(results.e_rates, sim_params.stim_start_time,
+        sim_params.stim_end_time, upper_threshold=wta_params.resp_threshold, dt=sim_params.dt)
+
+    return results
+
 if __name__=='__main__':
     ap = argparse.ArgumentParser(description='Run the WTA model')
     ap.add_argument('--num_groups', type=int, default=2, help='Number of input groups')
@@ -422,9 +738,23 @@ if __name__=='__main__':
     ap.add_argument('--record_inputs', type=int, default=0, help='Record network inputs')
     ap.add_argument('--save_summary_only', type=int, default=0, help='Save only summary data')
     ap.add_argument('--plot_output', type=int, default=0, help='Plot data')
+    ap.add_argument('--connectivity_cache_dir', type=str, default=None, help='Directory to cache network connectivity in')
+    ap.add_argument('--connectivity_seed', type=int, default=None, help='Random seed for network connectivity')
+    ap.add_argument('--stop_on_decision', type=int, default=0, help='Stop the trial once a decision is reached')
+    ap.add_argument('--post_decision_margin', type=float, default=100.0,
+        help='Time to continue the trial after a decision when stopping on decision (ms)')
+    ap.add_argument('--compile_cache_dir', type=str, default=None, help='Directory to share compiled code in')
+    ap.add_argument('--lfp_dt', type=float, default=None, help='LFP recording time step (ms)')
+    ap.add_argument('--voxel_dt', type=float, default=None, help='Voxel recording time step (ms)')
+    ap.add_argument('--neuron_state_dt', type=float, default=None, help='Neuron state recording time step (ms)')
+    ap.add_argument('--rate_dt', type=float, default=None, help='Firing rate bin size (ms)')
+    ap.add_argument('--single_precision', type=int, default=0, help='Record signals in single precision')
 
     argvals = ap.parse_args()
 
+    if argvals.compile_cache_dir is not None:
+        use_compile_cache(argvals.compile_cache_dir)
+
     input_freq=np.zeros(argvals.num_groups)
     inputs=argvals.inputs.split(',')
     for i in range(argvals.num_groups):
@@ -447,8 +777,23 @@ if __name__=='__main__':
     sim_params.i_dcs=argvals.i_dcs*pA
     sim_params.dcs_start_time=argvals.dcs_start_time*second
 
+    record_params=default_record_params()
+    for signal in ['lfp', 'voxel', 'neuron_state', 'rate']:
+        signal_dt=getattr(argvals, '%s_dt' % signal)
+        if signal_dt is not None:
+            record_params['%s_dt' % signal]=signal_dt*ms
+        if argvals.single_precision:
+            record_params['%s_dtype' % signal]=np.float32
+
+    connectivity_cache=None
+    if argvals.connectivity_cache_dir is not None:
+        connectivity_cache=ConnectivityCache(cache_dir=argvals.connectivity_cache_dir)
+
     run_wta(wta_params, input_freq, sim_params, output_file=argvals.output_file, record_lfp=argvals.record_lfp,
         record_voxel=argvals.record_voxel, record_neuron_state=argvals.record_neuron_state,
         record_spikes=argvals.record_spikes, record_firing_rate=argvals.record_firing_rate,
         record_inputs=argvals.record_inputs, record_connections=['t0->e0_ampa'],
-        save_summary_only=argvals.save_summary_only, plot_output=argvals.plot_output)
+        save_summary_only=argvals.save_summary_only, plot_output=argvals.plot_output,
+        connectivity_cache=connectivity_cache, connectivity_seed=argvals.connectivity_seed,
+        stop_on_decision=argvals.stop_on_decision, post_decision_margin=argvals.post_decision_margin*ms,
+        record_params=record_params)
@@ -100,11 +100,19 @@ def read_subject_data(data_dir, subj_id, conditions, filter=True, response_only=
 
         if neural_data:
             f_rates=f_neur['firing_rates']
-            for trial_idx in range(trial_rt.shape[1]):
-                f_trial=f_rates['trial_%d' % trial_idx]
-                trial_rates['inhibitory_rate'].append(np.array(f_trial['inhibitory_rate']))
-                trial_rates['excitatory_rate_0'].append(np.array(f_trial['excitatory_rate_0']))
-                trial_rates['excitatory_rate_1'].append(np.array(f_trial['excitatory_rate_1']))
+            if 'num_samples' in f_rates:
+                # Trials x time datasets written by SessionWriter
+                num_samples=np.array(f_rates['num_samples'])
+                for name in trial_rates:
+                    rates=np.array(f_rates[name])
+                    for trial_idx in range(trial_rt.shape[1]):
+                        trial_rates[name].append(rates[trial_idx,:num_samples[trial_idx]])
+            else:
+                for trial_idx in range(trial_rt.shape[1]):
+                    f_trial=f_rates['trial_%d' % trial_idx]
+                    trial_rates['inhibitory_rate'].append(np.array(f_trial['inhibitory_rate']))
+                    trial_rates['excitatory_rate_0'].append(np.array(f_trial['excitatory_rate_0']))
+                    trial_rates['excitatory_rate_1'].append(np.array(f_trial['excitatory_rate_1']))
 
         last_resp = float('NaN')
         for trial_idx in range(trial_rt.shape[1]):
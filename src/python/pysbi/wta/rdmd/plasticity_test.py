@@ -77,7 +77,7 @@ def run_session(subject, condition, sim_params, coherence_levels, output_file=No
     record_connections = ['t0->e0_ampa', 't1->e1_ampa', 't0->e1_ampa', 't1->e0_ampa']
     # Create session monitor
     session_monitor = SessionMonitor(subject.wta_network, sim_params, plasticity_params,
-        record_connections=record_connections, conv_window=40, record_firing_rates=True)
+        record_connections=record_connections, conv_window=40, record_firing_rates=True, output_file=output_file)
     # Trials per coherence level
     trials_per_level = 20
     # Create inputs for each trial
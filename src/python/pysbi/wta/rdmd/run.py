@@ -61,8 +61,9 @@ def run_session(subject, condition, sim_params, output_file=None, plot=False):
     print('** Condition: %s **' % condition)
 
     # Create session monitor
+    # Trials are written to the output file as they are recorded
     session_monitor=SessionMonitor(subject.wta_network, sim_params, {}, record_connections=[], conv_window=40,
-        record_firing_rates=True)
+        record_firing_rates=True, output_file=output_file)
 
     # Run on six coherence levels
     coherence_levels=[0.032, .064, .128, .256, .512]
@@ -143,7 +143,7 @@ class TrialData:
 
         if rt is None:
             self.rt,winner=get_response_time(e_firing_rates, 1*second, trial_duration-1*second,
-                upper_threshold=upper_resp_threshold, lower_threshold=lower_resp_threshold, dt=dt)
+                upper_threshold=upper_resp_threshold, dt=dt)
         else:
             self.rt=rt
 
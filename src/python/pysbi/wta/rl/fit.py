@@ -1,7 +1,10 @@
+import hashlib
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import os
 import scipy.io
-from scipy.optimize import leastsq, fmin_ncg, fmin
+from scipy.optimize import leastsq, fmin_ncg, fmin, fmin_l_bfgs_b
+from scipy.special import expit
 import h5py
 import matplotlib.pyplot as plt
 
@@ -40,30 +43,72 @@ stim_order=np.array([
     [1,4,2,5]
 ])
 
+# Bounds of the fitted learning rate (alpha) and softmax inverse temperature (beta)
+param_bounds=[(1e-6, 1.0), (1e-6, None)]
+
 def rescorla_td_prediction(walkset, choices, learning_rate):
-    x_pre=np.zeros((2,walkset.shape[0]))
-    x_pre[:,0]=[0.5,0.5]
+    return rescorla_td_predictions(walkset, choices, [learning_rate])[0][0,:,:]
+
+def rescorla_td_predictions(walkset, choices, learning_rates):
+    """
+    Rescorla-Wagner value estimates for several learning rates at once
+    walkset = reward on each trial
+    choices = option chosen on each trial
+    learning_rates = learning rate of each candidate
+    Returns the value estimates (candidates x options x trials) and their derivatives with respect to the learning rate
+    """
+    learning_rates=np.asarray(learning_rates, dtype=float)
+    choices=np.asarray(choices, dtype=int)
+    x_pre=np.zeros((len(learning_rates),2,walkset.shape[0]))
+    dx_pre=np.zeros(x_pre.shape)
+    x_pre[:,:,0]=0.5
 
     for t in range(len(choices)-1):
-        x_pre[:,t+1]=x_pre[:,t]
-        x_pre[choices[t],t+1]=(1.0-learning_rate)*x_pre[choices[t],t]+learning_rate*walkset[t]
+        c=choices[t]
+        x_pre[:,:,t+1]=x_pre[:,:,t]
+        dx_pre[:,:,t+1]=dx_pre[:,:,t]
+        x_pre[:,c,t+1]=(1.0-learning_rates)*x_pre[:,c,t]+learning_rates*walkset[t]
+        dx_pre[:,c,t+1]=(1.0-learning_rates)*dx_pre[:,c,t]-x_pre[:,c,t]+walkset[t]
 
-    return x_pre
+    return x_pre,dx_pre
 
 def energy_learn_rewards(x, mags, rewards, choice):
-    alpha=x[0]
-    beta=x[1]
-    # don't allow negative estimates
-    if alpha<=0 or beta<=0 or alpha>1:
-        return 10000000
+    return energy_learn_rewards_batch(np.array([x]), mags, rewards, choice)[0][0]
+
+def energy_learn_rewards_batch(params, mags, rewards, choice):
+    """
+    Negative log likelihood of the choices under the Rescorla-Wagner + softmax model for several parameter sets at once
+    params = candidates x 2 array of (alpha, beta)
+    Returns the energy of each candidate and its gradient (candidates x 2)
+    """
+    params=np.asarray(params, dtype=float)
+    alpha=params[:,0]
+    beta=params[:,1]
+    choice=np.asarray(choice, dtype=int)
 
     # get modelled probs using Rescorla-Wagner model, then vals, then energy
-    model_probs = rescorla_td_prediction(rewards,choice,alpha);
-    model_vals = model_probs*mags;
-    ch_valdiffs=model_vals[0,:]-model_vals[1,:]
-    ch_valdiffs[np.where(choice==1)]=-ch_valdiffs[np.where(choice==1)] # swap if RH chosen
-    energy=-np.sum(np.log(1/(1+np.exp(-beta*ch_valdiffs)))) # maximise log likelihood (softmax function)
-    return energy
+    model_probs,d_model_probs=rescorla_td_predictions(rewards, choice, np.clip(alpha, 0.0, 1.0))
+    sign=np.where(choice==1, -1.0, 1.0) # swap if RH chosen
+    ch_valdiffs=(model_probs[:,0,:]*mags[0,:]-model_probs[:,1,:]*mags[1,:])*sign
+    d_ch_valdiffs=(d_model_probs[:,0,:]*mags[0,:]-d_model_probs[:,1,:]*mags[1,:])*sign
+    z=beta[:,np.newaxis]*ch_valdiffs
+    # maximise log likelihood (softmax function)
+    energy=np.sum(np.logaddexp(0, -z), axis=1)
+    # d/dz of log(1+exp(-z)) is -expit(-z)
+    d_energy=-expit(-z)
+    grad=np.zeros(params.shape)
+    grad[:,0]=np.sum(d_energy*beta[:,np.newaxis]*d_ch_valdiffs, axis=1)
+    grad[:,1]=np.sum(d_energy*ch_valdiffs, axis=1)
+
+    # don't allow negative estimates
+    invalid=(alpha<=0) | (beta<=0) | (alpha>1)
+    energy[invalid]=10000000
+    grad[invalid,:]=0
+    return energy,grad
+
+def energy_and_gradient(x, mags, rewards, choice):
+    energy,grad=energy_learn_rewards_batch(np.array([x]), mags, rewards, choice)
+    return energy[0],grad[0,:]
 
 def fit_subject_behavior(mat_file):
     mat = scipy.io.loadmat(mat_file)
@@ -135,30 +180,35 @@ def test_fit_behavior(mat_file):
     return fit_behavior(prob_walk,mags,model_rew,model_choices)
 
 
-def fit_behavior(prob_walk, mags, rew, choice, plot=False):
-    n_fits=100
-    all_param_estimates=np.zeros((2,n_fits))
-    all_energy=np.zeros(n_fits)
-    for i in range(n_fits):
-        params=np.random.rand(2)
-        all_param_estimates[:,i]=fmin(energy_learn_rewards, params, args=(mags, rew, choice), disp=False)
-        all_energy[i]=energy_learn_rewards(all_param_estimates[:,i],mags,rew,choice)
+def fit_behavior(prob_walk, mags, rew, choice, plot=False, n_fits=100, n_refine=5):
+    """
+    Fit the learning rate and softmax inverse temperature of the Rescorla-Wagner model to a subject's choices. All
+    random starting points are evaluated at once, and the best are refined with a bounded quasi-Newton optimizer using
+    the analytic gradient.
+    n_fits = number of random starting points
+    n_refine = number of starting points to refine
+    Returns the parameter estimates (alpha, beta) and the expected proportion of choices predicted by the fitted model
+    """
+    choice=np.asarray(choice, dtype=int)
+    starts=np.random.rand(n_fits,2)
+    start_energy=energy_learn_rewards_batch(starts, mags, rew, choice)[0]
+
+    all_param_estimates=np.zeros((2,n_refine))
+    all_energy=np.zeros(n_refine)
+    for i,start_idx in enumerate(np.argsort(start_energy)[:n_refine]):
+        all_param_estimates[:,i],all_energy[i],info=fmin_l_bfgs_b(energy_and_gradient, starts[start_idx,:],
+            args=(mags, rew, choice), bounds=param_bounds)
 
-    min_idx=np.where(all_energy==np.min(all_energy))[0][0]
+    min_idx=np.argmin(all_energy)
     param_ests=all_param_estimates[:,min_idx]
 
     fit_vals=rescorla_td_prediction(rew, choice, param_ests[0])
     fit_probs=np.zeros(fit_vals.shape)
     ev=fit_vals*mags
-    fit_probs[0,:]=1.0/(1.0+np.exp(-param_ests[1]*(ev[0,:]-ev[1,:])))
-    fit_probs[1,:]=1.0/(1.0+np.exp(-param_ests[1]*(ev[1,:]-ev[0,:])))
-    prop_correct_vec=np.zeros(100)
-    for i in range(100):
-        fit_choices=np.zeros(choice.shape)
-        for t in range(len(choice)):
-            fit_choices[t]=np.random.choice([0,1], p=fit_probs[:,t])
-        prop_correct_vec[i]=float(len(np.where(fit_choices==choice)[0]))/float(len(choice))
-    prop_correct=np.mean(prop_correct_vec)
+    fit_probs[0,:]=expit(param_ests[1]*(ev[0,:]-ev[1,:]))
+    fit_probs[1,:]=expit(param_ests[1]*(ev[1,:]-ev[0,:]))
+    # Expected proportion of choices that the model's sampled choices would match
+    prop_correct=np.mean(fit_probs[choice,np.arange(len(choice))])
 
     if plot:
         plt.figure()
@@ -188,11 +238,86 @@ def fit_behavior(prob_walk, mags, rew, choice, plot=False):
 
     return param_ests,prop_correct
 
-def fit_subjects(data_dir, num_subjects, output_file):
-    beta_stim_vals=[]
-    alpha_stim_vals=[]
-    beta_control_vals=[]
-    alpha_control_vals=[]
+def get_file_hash(file_name):
+    """
+    MD5 hash of the contents of a file
+    """
+    file_hash=hashlib.md5()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1<<20), ''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def fit_subject_file(args):
+    """
+    Fit the behavior in a subject's mat file - run in worker processes
+    args = (mat file, random seed)
+    Returns the mat file, parameter estimates, and proportion of correctly predicted choices
+    """
+    mat_file,seed=args
+    np.random.seed(seed)
+    param_ests,prop_correct=fit_subject_behavior(mat_file)
+    return mat_file,param_ests,prop_correct
+
+def fit_subject_files(mat_files, num_processes=None, cache_file=None, seed=0):
+    """
+    Fit the behavior in several subjects' mat files on a pool of worker processes. Fits are cached by the hash of the
+    mat file contents, so only new or changed files are fitted.
+    mat_files = list of mat files
+    num_processes = number of worker processes (number of CPUs if None)
+    cache_file = HDF5 file to cache fits in (fits are not cached if None)
+    seed = random seed - each file is fitted with seed plus its index
+    Returns a dictionary of mat file -> (parameter estimates, proportion of correctly predicted choices)
+    """
+    from pysbi.reports.utils import ReportCache
+    cache=ReportCache(cache_file) if cache_file is not None else None
+    fits={}
+    file_hashes={}
+    jobs=[]
+    for idx,mat_file in enumerate(mat_files):
+        file_hashes[mat_file]=get_file_hash(mat_file)
+        cached=cache.get(os.path.basename(mat_file), file_hashes[mat_file]) if cache is not None else None
+        if cached is not None:
+            fits[mat_file]=(np.array([cached['alpha'], cached['beta']]), cached['prop_correct'])
+        elif not mat_file in [job[0] for job in jobs]:
+            jobs.append((mat_file, seed+idx))
+    print('Fitting %d of %d subject files (%d cached)' % (len(jobs), len(mat_files), len(mat_files)-len(jobs)))
+
+    if len(jobs):
+        if num_processes is None:
+            num_processes=cpu_count()
+        pool=Pool(processes=min(num_processes, len(jobs)))
+        try:
+            for mat_file,param_ests,prop_correct in pool.imap_unordered(fit_subject_file, jobs):
+                fits[mat_file]=(param_ests, prop_correct)
+                if cache is not None:
+                    cache.set(os.path.basename(mat_file), file_hashes[mat_file], {'alpha': param_ests[0],
+                                                                                  'beta': param_ests[1],
+                                                                                  'prop_correct': prop_correct})
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    return fits
+
+def fit_subjects(data_dir, num_subjects, output_file, num_processes=None, cache_file=None, plot=True):
+    """
+    Fit the behavior of each subject in the control and stimulation sessions and write the parameter estimates to
+    output_file
+    data_dir = directory containing subject mat files
+    num_subjects = number of subjects
+    output_file = HDF5 file to write fitted parameters to
+    num_processes = number of worker processes (number of CPUs if None)
+    cache_file = HDF5 file to cache fits in (fit_cache.h5 in the output file's directory if None)
+    plot = plot the distributions of changes in parameters
+    """
+    if cache_file is None:
+        cache_file=os.path.join(os.path.dirname(os.path.abspath(output_file)), 'fit_cache.h5')
+    subj_ids=[]
+    stim_files=[]
+    control_files=[]
     for i in range(num_subjects):
         subj_id=i+1
         subj_stim_session_number=stim_order[i,LAT]
@@ -200,33 +325,35 @@ def fit_subjects(data_dir, num_subjects, output_file):
         subj_control_session_number=stim_order[i,NOSTIM1]
         control_file_name=os.path.join(data_dir,'value%d_s%d_t2.mat' % (subj_id,subj_control_session_number))
         if os.path.exists(stim_file_name) and os.path.exists(control_file_name):
-            print('processing subject %d' % subj_id)
-            control_param_ests,control_prop_correct=fit_subject_behavior(control_file_name)
-            alpha_control_vals.append(control_param_ests[0])
-            beta_control_vals.append(control_param_ests[1])
-            stim_param_ests,stim_prop_correct=fit_subject_behavior(stim_file_name)
-            alpha_stim_vals.append(stim_param_ests[0])
-            beta_stim_vals.append(stim_param_ests[1])
-            #alpha_diff_vals.append(stim_param_ests[0]-control_param_ests[0])
-            #beta_diff_vals.append(stim_param_ests[1]-control_param_ests[1])
-
-    alpha_control_vals=np.array(alpha_control_vals)
-    beta_control_vals=np.array(beta_control_vals)
-    alpha_stim_vals=np.array(alpha_stim_vals)
-    beta_stim_vals=np.array(beta_stim_vals)
+            subj_ids.append(subj_id)
+            stim_files.append(stim_file_name)
+            control_files.append(control_file_name)
+
+    fits=fit_subject_files(control_files+stim_files, num_processes=num_processes, cache_file=cache_file)
+
+    alpha_control_vals=np.array([fits[file_name][0][0] for file_name in control_files])
+    beta_control_vals=np.array([fits[file_name][0][1] for file_name in control_files])
+    alpha_stim_vals=np.array([fits[file_name][0][0] for file_name in stim_files])
+    beta_stim_vals=np.array([fits[file_name][0][1] for file_name in stim_files])
 
     alpha_diff_vals=alpha_stim_vals-alpha_control_vals
     beta_diff_vals=beta_stim_vals-beta_control_vals
 
     f = h5py.File(output_file, 'w')
+    f['subj_ids']=np.array(subj_ids)
     control_group=f.create_group('control')
     control_group['alpha']=alpha_control_vals
     control_group['beta']=beta_control_vals
+    control_group['prop_correct']=np.array([fits[file_name][1] for file_name in control_files])
     stim_group=f.create_group('stim')
     stim_group['alpha']=alpha_stim_vals
     stim_group['beta']=beta_stim_vals
+    stim_group['prop_correct']=np.array([fits[file_name][1] for file_name in stim_files])
     f.close()
 
+    if not plot:
+        return
+
     fig=plt.figure()
     alpha_hist,alpha_bins=np.histogram(np.array(alpha_diff_vals), bins=10, range=(-1.0,1.0), density=True)
     bin_width=alpha_bins[1]-alpha_bins[0]
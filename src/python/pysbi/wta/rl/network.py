@@ -1,16 +1,75 @@
 import argparse
+import os
 from brian.stdunits import ms, pA, Hz
 from brian.units import second
 import numpy as np
 import scipy.io
 import h5py
 from pysbi.util.utils import get_response_time
-from pysbi.wta.network import default_params, run_wta, pyr_params, inh_params, simulation_params
+from pysbi.wta.monitor import get_rate_dt
+from pysbi.wta.network import default_params, pyr_params, inh_params, simulation_params
 from pysbi.wta.rl.fit import fit_behavior
-
+from pysbi.wta.virtual_subject import VirtualSubject
+
+
+def write_trial(f, trial, e_rates, i_rates, vals, inputs, choice, rew, rt, exp_rew, truncated=None):
+    """
+    Write a completed trial to a session output file. The expected rewards after the trial are written last and mark
+    the trial as complete.
+    f = open output file
+    trial = trial index
+    exp_rew = expected reward of each option after the trial
+    truncated = whether or not the trial was stopped after a decision (not written if None)
+    """
+    trial_group=f.create_group('trial %d' % trial)
+    trial_group['e_rates'] = np.array(e_rates)
+    trial_group['i_rates'] = np.array(i_rates)
+    if truncated is not None:
+        trial_group.attrs['truncated'] = truncated
+    trial_group.attrs['vals'] = vals
+    trial_group.attrs['inputs'] = inputs
+    trial_group.attrs['choice'] = choice
+    trial_group.attrs['rew'] = rew
+    trial_group.attrs['rt'] = rt if rt is not None else float('NaN')
+    trial_group.attrs['exp_rew'] = exp_rew
+    f.flush()
+
+def read_completed_trials(f, vals, inputs, choice, rew, rts):
+    """
+    Read the trials completed in a session output file into the session arrays, and remove a trial that was only
+    partially written
+    f = open output file
+    Returns the index of the first trial to run and the expected reward of each option after the last completed trial
+    """
+    exp_rew=np.array([0.5, 0.5])
+    trial=0
+    while 'trial %d' % trial in f:
+        trial_group=f['trial %d' % trial]
+        if not 'exp_rew' in trial_group.attrs:
+            del f['trial %d' % trial]
+            break
+        vals[:,trial]=trial_group.attrs['vals']
+        inputs[:,trial]=trial_group.attrs['inputs']
+        choice[trial]=trial_group.attrs['choice']
+        rew[trial]=trial_group.attrs['rew']
+        rts[trial]=trial_group.attrs['rt']
+        exp_rew=np.array(trial_group.attrs['exp_rew'])
+        trial+=1
+    return trial,exp_rew
 
 def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs=0*pA, i_dcs=0*pA, dcs_start_time=0*ms,
-                      output_file=None):
+                      output_file=None, stop_on_decision=False, resume=False):
+    """
+    Simulate a session of the reward learning task, with the inputs on each trial set by the Rescorla-Wagner expected
+    values. One network is built for the whole session and only its task input rates change between trials. Each trial
+    is written to the output file as soon as it is completed.
+    mat_file = subject mat file with the reward probability walk and magnitudes
+    alpha = learning rate
+    beta = softmax inverse temperature (sets the background rate if background_freq is None)
+    output_file = HDF5 file to write the session to
+    stop_on_decision = stop each trial once a decision is reached
+    resume = continue the session in output_file from the last completed trial (start a new session if False)
+    """
     mat = scipy.io.loadmat(mat_file)
     prob_idx=-1
     mags_idx=-1
@@ -32,6 +91,8 @@ def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs
     sim_params.p_dcs=p_dcs
     sim_params.i_dcs=i_dcs
     sim_params.dcs_start_time=dcs_start_time
+    # Stimulation stays on until the end of each trial
+    sim_params.dcs_end_time=sim_params.trial_duration
 
     exp_rew=np.array([0.5, 0.5])
     if background_freq is None:
@@ -48,30 +109,44 @@ def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs
     rts=np.zeros(trials)
     inputs=np.zeros(prob_walk.shape)
 
+    first_trial=0
     if output_file is not None:
-        f = h5py.File(output_file, 'w')
-
-        f.attrs['alpha']=alpha
-        f.attrs['beta']=beta
-        f.attrs['mat_file']=mat_file
-
-        f_sim_params=f.create_group('sim_params')
-        for attr, value in sim_params.iteritems():
-            f_sim_params.attrs[attr] = value
-
-        f_network_params=f.create_group('network_params')
-        for attr, value in wta_params.iteritems():
-            f_network_params.attrs[attr] = value
-
-        f_pyr_params=f.create_group('pyr_params')
-        for attr, value in pyr_params.iteritems():
-            f_pyr_params.attrs[attr] = value
-
-        f_inh_params=f.create_group('inh_params')
-        for attr, value in inh_params.iteritems():
-            f_inh_params.attrs[attr] = value
-
-    for trial in range(sim_params.ntrials):
+        if resume and os.path.exists(output_file):
+            f = h5py.File(output_file, 'a')
+            if f.attrs['mat_file']!=mat_file or f.attrs['alpha']!=alpha or f.attrs['beta']!=beta:
+                f.close()
+                raise ValueError('%s is a session of a different subject or model' % output_file)
+            first_trial,exp_rew=read_completed_trials(f, vals, inputs, choice, rew, rts)
+            print('Resuming session at trial %d' % first_trial)
+        else:
+            f = h5py.File(output_file, 'w')
+
+            f.attrs['alpha']=alpha
+            f.attrs['beta']=beta
+            f.attrs['mat_file']=mat_file
+
+            f_sim_params=f.create_group('sim_params')
+            for attr, value in sim_params.iteritems():
+                f_sim_params.attrs[attr] = value
+
+            f_network_params=f.create_group('network_params')
+            for attr, value in wta_params.iteritems():
+                f_network_params.attrs[attr] = value
+
+            f_pyr_params=f.create_group('pyr_params')
+            for attr, value in pyr_params.iteritems():
+                f_pyr_params.attrs[attr] = value
+
+            f_inh_params=f.create_group('inh_params')
+            for attr, value in inh_params.iteritems():
+                f_inh_params.attrs[attr] = value
+
+    # Network that is kept for the whole session
+    subject=VirtualSubject(0, wta_params=wta_params, pyr_params=pyr_params, inh_params=inh_params,
+        sim_params=sim_params, stop_on_decision=stop_on_decision)
+    trial_monitor=subject.wta_monitor
+
+    for trial in range(first_trial, sim_params.ntrials):
         print('Trial %d' % trial)
         vals[:,trial]=exp_rew
         ev=vals[:,trial]*mags[:,trial]
@@ -79,23 +154,20 @@ def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs
         inputs[1,trial]=ev[1]
         inputs[:,trial]=40.0+40.0*inputs[:,trial]
 
-        trial_monitor=run_wta(wta_params, inputs[:,trial], sim_params, record_lfp=False, record_voxel=False,
-            record_neuron_state=False, record_spikes=True, record_firing_rate=True, record_inputs=False,
-            plot_output=False)
+        subject.run_trial(sim_params, inputs[:,trial])
 
         e_rates = []
         for i in range(wta_params.num_groups):
             e_rates.append(trial_monitor.monitors['excitatory_rate_%d' % i].smooth_rate(width=5 * ms, filter='gaussian'))
         i_rates = [trial_monitor.monitors['inhibitory_rate'].smooth_rate(width=5 * ms, filter='gaussian')]
 
-        if output_file is not None:
-            trial_group=f.create_group('trial %d' % trial)
-            trial_group['e_rates'] = np.array(e_rates)
-
-            trial_group['i_rates'] = np.array(i_rates)
-
-        rt,decision_idx=get_response_time(e_rates, sim_params.stim_start_time, sim_params.stim_end_time,
-            upper_threshold=wta_params.resp_threshold, lower_threshold=None, dt=sim_params.dt)
+        if stop_on_decision:
+            rt=trial_monitor.monitors['decision'].rt
+            decision_idx=trial_monitor.monitors['decision'].decision_idx
+        else:
+            rate_dt=get_rate_dt(trial_monitor.monitors['excitatory_rate_0'])
+            rt,decision_idx=get_response_time(e_rates, sim_params.stim_start_time, sim_params.stim_end_time,
+                upper_threshold=wta_params.resp_threshold, dt=rate_dt)
 
         reward=0.0
         if decision_idx>=0 and np.random.random()<=prob_walk[decision_idx,trial]:
@@ -106,6 +178,11 @@ def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs
         rts[trial]=rt
         rew[trial]=reward
 
+        if output_file is not None:
+            truncated=trial_monitor.monitors['decision'].truncated if stop_on_decision else None
+            write_trial(f, trial, e_rates, i_rates, vals[:,trial], inputs[:,trial], decision_idx, reward, rt, exp_rew,
+                truncated=truncated)
+
     param_ests,prop_correct=fit_behavior(prob_walk, mags, rew, choice)
 
     if output_file is not None:
@@ -113,13 +190,13 @@ def run_rl_simulation(mat_file, alpha=0.4, beta=5.0, background_freq=None, p_dcs
         f.attrs['est_beta']=param_ests[1]
         f.attrs['prop_correct']=prop_correct
 
-        f['prob_walk']=prob_walk
-        f['mags']=mags
-        f['rew']=rew
-        f['choice']=choice
-        f['vals']=vals
-        f['inputs']=inputs
-        f['rts']=rts
+        session_data={'prob_walk': prob_walk, 'mags': mags, 'rew': rew, 'choice': choice, 'vals': vals,
+                      'inputs': inputs, 'rts': rts}
+        for name,data in session_data.iteritems():
+            # A resumed session may have been interrupted after its last trial
+            if name in f:
+                del f[name]
+            f[name]=data
         f.close()
 
 
@@ -133,9 +210,11 @@ if __name__=='__main__':
     ap.add_argument('--beta', type=float, default=5.0, help='Temperature')
     ap.add_argument('--background', type=float, default=None, help='Background firing rate (Hz)')
     ap.add_argument('--output_file', type=str, default=None, help='HDF5 output file')
+    ap.add_argument('--stop_on_decision', type=int, default=0, help='Stop each trial once a decision is reached')
+    ap.add_argument('--resume', type=int, default=0, help='Resume the session in the output file')
 
     argvals = ap.parse_args()
 
     run_rl_simulation(argvals.stim_mat_file, alpha=argvals.alpha, beta=argvals.beta, background_freq=argvals.background,
         p_dcs=argvals.p_dcs*pA, i_dcs=argvals.i_dcs*pA, dcs_start_time=argvals.dcs_start_time*second,
-        output_file=argvals.output_file)
+        output_file=argvals.output_file, stop_on_decision=argvals.stop_on_decision, resume=argvals.resume)
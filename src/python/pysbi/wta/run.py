@@ -1,18 +1,44 @@
+import argparse
 import os
+import random
+import zlib
+from multiprocessing import Pool, cpu_count
+from time import time
 from brian.stdunits import nS, pA, Hz
 import numpy as np
 from brian.units import siemens, second
-from ezrcluster.launcher import Launcher
 from pysbi.config import SRC_DIR
-from pysbi.wta.network import simulation_params, default_params
+from pysbi.util.compile_cache import use_compile_cache
+from pysbi.wta.connectivity import ConnectivityCache
+from pysbi.wta.network import simulation_params, default_params, run_wta
+
+def get_wta_point_desc(wta_params, sim_params, e_desc=''):
+    """
+    Get the description of a parameter point used to name the output and log files of its trials
+    """
+    return 'wta.groups.%d.duration.%0.3f.p_e_e.%0.3f.p_e_i.%0.3f.p_i_i.%0.3f.p_i_e.%0.3f.p_dcs.%0.4f.i_dcs.%0.4f.%s' %\
+           (wta_params.num_groups, sim_params.trial_duration, wta_params.p_e_e, wta_params.p_e_i, wta_params.p_i_i,
+            wta_params.p_i_e, sim_params.p_dcs/pA, sim_params.i_dcs/pA, e_desc)
+
+def get_connectivity_seed(seed, point_desc):
+    """
+    Get the random seed that the connectivity of a parameter point is generated with when connectivity is cached
+    seed = base random seed
+    point_desc = description of the parameter point (see get_wta_point_desc)
+    """
+    return (seed+zlib.crc32(point_desc)) & 0xffffffff
+
+def get_wta_file_desc(wta_params, sim_params, contrast, trial, e_desc=''):
+    """
+    Get the description used to name the output and log files of a trial
+    """
+    return '%s.contrast.%0.4f.trial.%d' % (get_wta_point_desc(wta_params, sim_params, e_desc=e_desc), contrast, trial)
 
 def get_wta_cmds(wta_params, inputs, sim_params, contrast, trial, record_lfp=True, record_voxel=False,
                  record_neuron_state=False, record_spikes=True, record_firing_rate=True, save_summary_only=True,
-                 e_desc=''):
+                 e_desc='', compile_cache_dir=None):
     cmds = ['python', '/tmp/pySBI/src/python/pysbi/wta/network.py']
-    file_desc='wta.groups.%d.duration.%0.3f.p_e_e.%0.3f.p_e_i.%0.3f.p_i_i.%0.3f.p_i_e.%0.3f.p_dcs.%0.4f.i_dcs.%0.4f.%s.contrast.%0.4f.trial.%d' %\
-              (wta_params.num_groups, sim_params.trial_duration, wta_params.p_e_e, wta_params.p_e_i, wta_params.p_i_i,
-               wta_params.p_i_e, sim_params.p_dcs/pA, sim_params.i_dcs/pA, e_desc, contrast, trial)
+    file_desc=get_wta_file_desc(wta_params, sim_params, contrast, trial, e_desc=e_desc)
     log_file_template='%s.log' % file_desc
     output_file='/tmp/wta-output/%s.h5' % file_desc
     cmds.append('--num_groups')
@@ -76,44 +102,212 @@ def get_wta_cmds(wta_params, inputs, sim_params, contrast, trial, record_lfp=Tru
         cmds.append('1')
     else:
         cmds.append('0')
+    if compile_cache_dir is not None:
+        cmds.append('--compile_cache_dir')
+        cmds.append(compile_cache_dir)
 
     return cmds, log_file_template, output_file
 
+def get_wta_jobs(p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range, num_trials,
+                 sim_params, input_sum=40.0, contrast_range=[0.0, 0.0625, 0.125, 0.25, 0.5, 1.0]):
+    """
+    Generate the jobs of a parameter sweep - one job per parameter point, contrast, and trial
+    Returns a list of (wta_params, inputs, contrast, trial) tuples
+    """
+    points=[]
+    for p_b_e in p_b_e_range:
+        for p_x_e in p_x_e_range:
+            for p_e_e in p_e_e_range:
+                for p_e_i in p_e_i_range:
+                    for p_i_i in p_i_i_range:
+                        for p_i_e in p_i_e_range:
+                            points.append({'p_b_e': p_b_e, 'p_x_e': p_x_e, 'p_e_e': p_e_e, 'p_e_i': p_e_i,
+                                           'p_i_i': p_i_i, 'p_i_e': p_i_e})
+    return get_wta_point_jobs(points, num_trials, input_sum=input_sum, contrast_range=contrast_range)
+
+def get_wta_point_jobs(points, num_trials, input_sum=40.0, contrast_range=[0.0, 0.0625, 0.125, 0.25, 0.5, 1.0]):
+    """
+    Generate the jobs of a list of parameter points - one job per parameter point, contrast, and trial
+    points = list of dictionaries of parameter name -> value, for parameters that differ from the defaults
+    Returns a list of (wta_params, inputs, contrast, trial) tuples
+    """
+    jobs=[]
+    for point in points:
+        wta_params=default_params()
+        for name,value in point.iteritems():
+            setattr(wta_params, name, value)
+        for i,contrast in enumerate(contrast_range):
+            inputs=np.zeros(2)
+            inputs[0]=(input_sum*(contrast+1.0)/2.0)
+            inputs[1]=input_sum-inputs[0]
+            for t in range(num_trials):
+                np.random.shuffle(inputs)
+                jobs.append((wta_params, np.array(inputs), contrast, t))
+    return jobs
+
 def post_wta_jobs(nodes, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range, num_trials,
                    muscimol_amount=0*nS, injection_site=0, start_nodes=True):
+    from ezrcluster.launcher import Launcher
+
     sim_params=simulation_params()
     sim_params.muscimol_amount=muscimol_amount
     sim_params.injection_site=injection_site
 
-    input_sum=40.0
     launcher=Launcher(nodes)
     if start_nodes:
         launcher.set_application_script(os.path.join(SRC_DIR, 'sh/ezrcluster-application-script.sh'))
         launcher.start_nodes()
 
-    contrast_range=[0.0, 0.0625, 0.125, 0.25, 0.5, 1.0]
+    for wta_params, inputs, contrast, t in get_wta_jobs(p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range,
+                                                         p_i_i_range, p_i_e_range, num_trials, sim_params):
+        cmds,log_file_template,out_file=get_wta_cmds(wta_params, inputs, sim_params, contrast, t, record_lfp=True,
+            record_voxel=True, record_neuron_state=False, record_firing_rate=True, record_spikes=True)
+        launcher.add_job(cmds, log_file_template=log_file_template, output_file=out_file)
 
-    for p_b_e in p_b_e_range:
-        for p_x_e in p_x_e_range:
-            for p_e_e in p_e_e_range:
-                for p_e_i in p_e_i_range:
-                    for p_i_i in p_i_i_range:
-                        for p_i_e in p_i_e_range:
-                            wta_params=default_params()
-                            wta_params.p_b_e=p_b_e
-                            wta_params.p_x_e=p_x_e
-                            wta_params.p_e_e=p_e_e
-                            wta_params.p_e_i=p_e_i
-                            wta_params.p_i_i=p_i_i
-                            wta_params.p_i_e=p_i_e
-                            for i,contrast in enumerate(contrast_range):
-                                inputs=np.zeros(2)
-                                inputs[0]=(input_sum*(contrast+1.0)/2.0)
-                                inputs[1]=input_sum-inputs[0]
-                                for t in range(num_trials):
-                                    np.random.shuffle(inputs)
-                                    cmds,log_file_template,out_file=get_wta_cmds(wta_params, inputs, sim_params,
-                                        contrast, t, record_lfp=True, record_voxel=True, record_neuron_state=False,
-                                        record_firing_rate=True, record_spikes=True)
-                                    launcher.add_job(cmds, log_file_template=log_file_template, output_file=out_file)
 
+# Connectivity cache of this worker process
+worker_connectivity_cache=None
+
+def init_worker(cache_connectivity, compile_cache_dir):
+    """
+    Initialize a local worker process
+    cache_connectivity = reuse network connectivity across the jobs with the same parameters run by this worker
+    compile_cache_dir = root directory of the shared compile cache (None to use weave's default)
+    """
+    global worker_connectivity_cache
+    if compile_cache_dir is not None:
+        use_compile_cache(compile_cache_dir)
+    if cache_connectivity:
+        worker_connectivity_cache=ConnectivityCache()
+
+def run_wta_job(job):
+    """
+    Run one trial of a sweep in a worker process. Each job is seeded with its own seed, and cached connectivity is
+    generated with its parameter point's connectivity seed, so results do not depend on which worker runs which job.
+    job = (wta_params, inputs, sim_params, output_file, seed, connectivity seed, record flags dict)
+    Returns (output_file, run time, error message or None)
+    """
+    wta_params, inputs, sim_params, output_file, seed, connectivity_seed, record = job
+    np.random.seed(seed)
+    random.seed(seed)
+    # Without a cache each trial gets its own connectivity
+    if worker_connectivity_cache is None:
+        connectivity_seed=None
+    start_time=time()
+    try:
+        run_wta(wta_params, inputs, sim_params, output_file=output_file, report=None,
+            connectivity_cache=worker_connectivity_cache, connectivity_seed=connectivity_seed, **record)
+    except Exception as e:
+        return output_file, time()-start_time, '%s: %s' % (type(e).__name__, str(e))
+    return output_file, time()-start_time, None
+
+def run_wta_jobs_local(output_dir, p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range, p_i_e_range,
+                       num_trials, muscimol_amount=0*nS, injection_site=0, num_processes=None, seed=0,
+                       skip_existing=True, cache_connectivity=False, record_lfp=True, record_voxel=True,
+                       record_neuron_state=False, record_spikes=True, record_firing_rate=True, save_summary_only=True,
+                       compile_cache_dir=None):
+    """
+    Run a parameter sweep on this machine with a pool of worker processes - same jobs and output file names as
+    post_wta_jobs. Workers are reused for many jobs, so weave compilation is only paid once per worker.
+    output_dir = directory to write trial files to
+    num_processes = number of worker processes (defaults to the number of cores)
+    seed = base random seed - job i is seeded with seed+i
+    skip_existing = don't rerun jobs whose output file already exists
+    cache_connectivity = reuse network connectivity for jobs with the same parameters within each worker - each
+                         parameter point's connectivity is generated from its own seed, so every worker builds the same
+                         network for it
+    compile_cache_dir = root directory of a shared compile cache, e.g. filled by pysbi.wta.warmup
+    """
+    sim_params=simulation_params()
+    sim_params.muscimol_amount=muscimol_amount
+    sim_params.injection_site=injection_site
+
+    record={
+        'record_lfp': record_lfp,
+        'record_voxel': record_voxel,
+        'record_neuron_state': record_neuron_state,
+        'record_spikes': record_spikes,
+        'record_firing_rate': record_firing_rate,
+        'save_summary_only': save_summary_only
+    }
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Generate inputs with the base seed so that the same sweep always gets the same trial inputs
+    np.random.seed(seed)
+    jobs=get_local_jobs(output_dir, get_wta_jobs(p_b_e_range, p_x_e_range, p_e_e_range, p_e_i_range, p_i_i_range,
+        p_i_e_range, num_trials, sim_params), sim_params, record, seed=seed, skip_existing=skip_existing)
+
+    run_jobs_local(jobs, num_processes=num_processes, cache_connectivity=cache_connectivity,
+        compile_cache_dir=compile_cache_dir)
+
+def get_local_jobs(output_dir, wta_jobs, sim_params, record, seed=0, skip_existing=True, e_desc=''):
+    """
+    Get the jobs to run with run_jobs_local
+    output_dir = directory to write trial files to
+    wta_jobs = list of (wta_params, inputs, contrast, trial) tuples
+    record = dictionary of run_wta record flags
+    seed = base random seed - job i is seeded with seed+i, and the connectivity of each parameter point is seeded with
+           get_connectivity_seed(seed, point description)
+    skip_existing = don't rerun jobs whose output file already exists
+    """
+    jobs=[]
+    for idx,(wta_params, inputs, contrast, t) in enumerate(wta_jobs):
+        point_desc=get_wta_point_desc(wta_params, sim_params, e_desc=e_desc)
+        output_file=os.path.join(output_dir, '%s.h5' % get_wta_file_desc(wta_params, sim_params, contrast, t,
+            e_desc=e_desc))
+        if skip_existing and os.path.exists(output_file):
+            continue
+        jobs.append((wta_params, inputs, sim_params, output_file, seed+idx, get_connectivity_seed(seed, point_desc),
+                     record))
+    return jobs
+
+def run_jobs_local(jobs, num_processes=None, cache_connectivity=False, compile_cache_dir=None):
+    """
+    Run jobs with a pool of worker processes
+    jobs = list of jobs to pass to run_wta_job
+    num_processes = number of worker processes (defaults to the number of cores)
+    """
+    if num_processes is None:
+        num_processes=cpu_count()
+    print('Running %d jobs on %d processes' % (len(jobs), num_processes))
+
+    start_time=time()
+    pool=Pool(processes=num_processes, initializer=init_worker, initargs=(cache_connectivity, compile_cache_dir))
+    try:
+        for idx,(output_file, run_time, error) in enumerate(pool.imap_unordered(run_wta_job, jobs)):
+            if error is None:
+                print('%d/%d %s (%.2fs)' % (idx+1, len(jobs), output_file, run_time))
+            else:
+                print('%d/%d %s failed - %s' % (idx+1, len(jobs), output_file, error))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    pool.join()
+    print('Total time: %.2fs' % (time()-start_time))
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Run a WTA parameter sweep with a local process pool')
+    ap.add_argument('--output_dir', type=str, default='/tmp/wta-output', help='Directory to write trial files to')
+    ap.add_argument('--p_b_e', type=float, nargs='+', default=[1.0], help='Connection probabilities: background->e')
+    ap.add_argument('--p_x_e', type=float, nargs='+', default=[1.0], help='Connection probabilities: task->e')
+    ap.add_argument('--p_e_e', type=float, nargs='+', default=[default_params.p_e_e], help='Connection probabilities: e->e')
+    ap.add_argument('--p_e_i', type=float, nargs='+', default=[default_params.p_e_i], help='Connection probabilities: e->i')
+    ap.add_argument('--p_i_i', type=float, nargs='+', default=[default_params.p_i_i], help='Connection probabilities: i->i')
+    ap.add_argument('--p_i_e', type=float, nargs='+', default=[default_params.p_i_e], help='Connection probabilities: i->e')
+    ap.add_argument('--num_trials', type=int, default=10, help='Number of trials per parameter point and contrast')
+    ap.add_argument('--num_processes', type=int, default=None, help='Number of worker processes')
+    ap.add_argument('--seed', type=int, default=0, help='Base random seed')
+    ap.add_argument('--rerun_existing', action='store_true', default=False, help='Rerun jobs with existing output')
+    ap.add_argument('--cache_connectivity', action='store_true', default=False,
+        help='Reuse connectivity for jobs with the same parameters')
+    ap.add_argument('--compile_cache_dir', type=str, default=None, help='Directory to share compiled code in')
+
+    argvals = ap.parse_args()
+
+    run_wta_jobs_local(argvals.output_dir, argvals.p_b_e, argvals.p_x_e, argvals.p_e_e, argvals.p_e_i, argvals.p_i_i,
+        argvals.p_i_e, argvals.num_trials, num_processes=argvals.num_processes, seed=argvals.seed,
+        skip_existing=not argvals.rerun_existing, cache_connectivity=argvals.cache_connectivity,
+        compile_cache_dir=argvals.compile_cache_dir)
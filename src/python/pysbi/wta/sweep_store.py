@@ -0,0 +1,393 @@
+import argparse
+import os
+import re
+from time import time
+import h5py
+import numpy as np
+from brian import ms, second
+from pysbi.util.utils import get_response_time
+
+# Parameters parsed from trial file names (or read from the network parameters) and stored in the trial index
+index_params=['duration', 'p_b_e', 'p_x_e', 'p_e_e', 'p_e_i', 'p_i_i', 'p_i_e', 'p_dcs', 'i_dcs']
+
+# Per-population summary fields stored in the trial index - e_final_mean and e_final_max are the mean and max rate of
+# each excitatory population in the final_window before the end of the stimulus, which trial AUCs are computed from
+summary_fields=['e_mean', 'e_max', 'i_mean', 'i_max', 'e_final_mean', 'e_final_max']
+
+# Window before the end of the stimulus that trial AUCs are computed from (as in analysis.get_roc_init)
+final_window=100*ms
+
+# Index columns with one value per population or input
+array_fields=summary_fields+['input_freq']
+
+trial_file_re=re.compile(r'^(?P<prefix>.*)\.contrast\.(?P<contrast>[0-9.]+)\.trial\.(?P<trial>\d+)\.h5$')
+
+def parse_trial_file_name(file_name):
+    """
+    Parse the name of a trial file
+    file_name = trial file name
+    Returns (prefix, contrast, trial, dictionary of parameter -> value) or None if not a trial file
+    """
+    match=trial_file_re.match(os.path.basename(file_name))
+    if match is None:
+        return None
+    prefix=match.group('prefix')
+    params={}
+    for param in index_params:
+        param_match=re.search(r'(^|\.)%s\.(-?[0-9]+\.[0-9]+)(\.|$)' % param, prefix)
+        if param_match is not None:
+            params[param]=float(param_match.group(2))
+    return prefix, float(match.group('contrast')), int(match.group('trial')), params
+
+def copy_group(src, dest, compression=4):
+    """
+    Copy an HDF5 group, storing arrays chunked and compressed
+    src = group to copy
+    dest = group to copy to
+    compression = gzip compression level
+    """
+    for name,value in src.attrs.iteritems():
+        dest.attrs[name]=value
+    for name,item in src.iteritems():
+        if isinstance(item, h5py.Group):
+            copy_group(item, dest.create_group(name), compression=compression)
+        elif item.shape is None or item.size<2:
+            dest.create_dataset(name, data=item[()])
+        else:
+            dest.create_dataset(name, data=np.array(item), chunks=True, compression='gzip',
+                compression_opts=compression, shuffle=True)
+
+def get_sim_param(f, name):
+    """
+    Read a simulation parameter of a trial file - from the sim_params group written by WTAMonitor, or from the root
+    attributes of older trial files
+    """
+    if 'sim_params' in f and name in f['sim_params'].attrs:
+        return f['sim_params'].attrs[name]
+    return f.attrs[name]
+
+def get_window_summary(rates, start_idx, end_idx):
+    """
+    Get the mean and max rate of each population between two time steps - NaN if the rates end before the window (as
+    they do in trials stopped after a decision)
+    rates = population firing rates (populations x time)
+    Returns (mean of each population, max of each population)
+    """
+    rates=np.atleast_2d(rates)[:,max(0,start_idx):end_idx]
+    if rates.shape[1]==0:
+        nan_values=np.zeros(rates.shape[0])*float('NaN')
+        return nan_values, nan_values.copy()
+    return np.mean(rates,axis=1), np.max(rates,axis=1)
+
+def get_rate_summary(e_rates, i_rates, stim_end_time, rate_dt):
+    """
+    Compute the summary fields of a trial from its firing rates (as FileInfo does for trials without a summary)
+    e_rates = excitatory population firing rates (populations x time)
+    i_rates = inhibitory population firing rates (populations x time)
+    Returns a dictionary of summary field -> value of each population
+    """
+    end_idx=int(stim_end_time/rate_dt)
+    start_idx=end_idx-int(round(final_window/rate_dt))
+    summary={}
+    for name,rates in [('e', e_rates), ('i', i_rates)]:
+        summary['%s_mean' % name]=get_window_summary(rates, start_idx, end_idx)[0]
+        summary['%s_max' % name]=np.max(rates,axis=1)
+    summary['e_final_mean'],summary['e_final_max']=get_window_summary(e_rates, start_idx, end_idx)
+    return summary
+
+def read_trial_summary(f, upper_resp_threshold=30, dt=.1*ms):
+    """
+    Read the index entries of a trial file
+    f = open trial file
+    upper_resp_threshold = response threshold used if the response time was not saved with the trial
+    dt = firing rate time step used if it was not saved with the trial
+    Returns a dictionary of index column -> value
+    """
+    row={}
+    row['input_freq']=np.atleast_1d(np.array(f.attrs['input_freq'], dtype=float))
+    for param in ['p_e_e', 'p_e_i', 'p_i_i', 'p_i_e']:
+        if 'network_params' in f and param in f['network_params'].attrs:
+            row[param]=float(f['network_params'].attrs[param])
+    row['duration']=float(get_sim_param(f, 'trial_duration'))
+
+    stim_end_time=float(get_sim_param(f, 'stim_end_time'))*second
+    e_rates=None
+    if 'firing_rates' in f:
+        f_rates=f['firing_rates']
+        rate_dt=float(f_rates.attrs['dt'])*second if 'dt' in f_rates.attrs else dt
+        e_rates=np.array(f_rates['e_rates'], dtype=float)
+
+    rt=float('NaN')
+    choice=-1
+    if 'rt' in f.attrs and 'choice' in f.attrs:
+        rt=float(f.attrs['rt'])
+        choice=int(f.attrs['choice'])
+    elif e_rates is not None:
+        trial_rt,choice=get_response_time(e_rates, float(get_sim_param(f, 'stim_start_time'))*second, stim_end_time,
+            upper_threshold=upper_resp_threshold, dt=rate_dt)
+        if trial_rt is not None:
+            rt=float(trial_rt)
+    row['rt']=rt
+    row['choice']=choice
+    # Trials stopped after a decision have no rates at the end of the stimulus
+    row['truncated']=int(bool(f.attrs['truncated'])) if 'truncated' in f.attrs else 0
+
+    if 'summary' in f:
+        f_summary=f['summary']
+        for field in summary_fields:
+            if field in f_summary:
+                row[field]=np.atleast_1d(np.array(f_summary[field], dtype=float))
+        for field in ['bold_max', 'bold_exc_max']:
+            if field in f_summary:
+                row[field]=float(np.max(f_summary[field]))
+    else:
+        # Compute the summary of trials saved with all data from their firing rates and BOLD signal
+        if e_rates is not None:
+            row.update(get_rate_summary(e_rates, np.array(f_rates['i_rates'], dtype=float), stim_end_time, rate_dt))
+        for field,group in [('bold_max', 'voxel/total_syn'), ('bold_exc_max', 'voxel/exc_syn')]:
+            if group in f and 'y' in f[group]:
+                bold=np.array(f[group]['y'], dtype=float)
+                row[field]=float(np.max(bold[~np.isnan(bold)])) if np.any(~np.isnan(bold)) else float('NaN')
+    return row
+
+
+class SweepStore():
+    """
+    Trials of a parameter sweep packed into one HDF5 file (written by pack_sweep), or an index of the trial files of a
+    sweep (written by update_index). The trial index is read once when the store is opened, trial data is read with
+    FileInfo when needed.
+    store_file = store file
+    """
+    def __init__(self, store_file):
+        self.store_file=store_file
+        f=h5py.File(store_file, 'r')
+        f_index=f['index']
+        self.index=dict([(name, np.array(f_index[name])) for name in f_index])
+        self.attrs=dict(f.attrs.iteritems())
+        self.has_trials='trials' in f
+        f.close()
+
+        self.trials={}
+        self.prefix_trials={}
+        for row,(prefix,contrast,trial) in enumerate(zip(self.index['prefix'], self.index['contrast'],
+                                                         self.index['trial'])):
+            self.trials[(prefix, round(contrast,4), int(trial))]=row
+            if not prefix in self.prefix_trials:
+                self.prefix_trials[prefix]=set()
+            self.prefix_trials[prefix].add((round(contrast,4), int(trial)))
+
+    def __len__(self):
+        return len(self.index['name'])
+
+    def get_prefixes(self):
+        return sorted(self.prefix_trials.keys())
+
+    def get_row(self, prefix, contrast, trial):
+        """
+        Get the index row of a trial (None if not in the store)
+        prefix = trial file prefix (without directory)
+        """
+        return self.trials.get((os.path.basename(prefix), round(contrast,4), int(trial)), None)
+
+    def get_trial_group(self, prefix, contrast, trial):
+        """
+        Get the path of a trial's data in the store (None if not in the store)
+        """
+        row=self.get_row(prefix, contrast, trial)
+        if row is None or not self.has_trials:
+            return None
+        return 'trials/%s' % self.index['name'][row]
+
+    def all_trials_exist(self, prefix, contrast_range, num_trials):
+        trials=self.prefix_trials.get(os.path.basename(prefix), set())
+        for contrast in contrast_range:
+            for trial in range(num_trials):
+                if not (round(contrast,4), trial) in trials:
+                    return False
+        return True
+
+    def get_param_combos(self, params, contrast_range, num_trials):
+        """
+        Get the parameter combinations with all trials in the store
+        params = names of parameters in the combinations
+        Returns a sorted list of tuples of parameter values
+        """
+        param_combos=set()
+        for prefix in self.get_prefixes():
+            if self.all_trials_exist(prefix, contrast_range, num_trials):
+                row=min([self.trials[(prefix, contrast, trial)] for (contrast, trial) in self.prefix_trials[prefix]])
+                param_combos.add(tuple([float(self.index[param][row]) for param in params]))
+        return sorted(param_combos)
+
+    def get_column(self, name, prefix=None):
+        """
+        Get an index column, for all trials or only those of one prefix
+        """
+        if prefix is None:
+            return self.index[name]
+        return self.index[name][self.index['prefix']==os.path.basename(prefix)]
+
+    def query(self, **conditions):
+        """
+        Find trials in the index, e.g. query(p_e_e=0.08, contrast=lambda contrast: contrast>0)
+        conditions = column name -> value (floats are compared to 4 decimal places) or function of the column values
+                     returning a boolean array
+        Returns the row indices of matching trials
+        """
+        mask=np.ones(len(self), dtype=bool)
+        for name,condition in conditions.iteritems():
+            values=self.index[name]
+            if callable(condition):
+                mask&=np.asarray(condition(values), dtype=bool)
+            elif values.dtype.kind=='f':
+                mask&=np.abs(values-condition)<.00005
+            else:
+                mask&=values==condition
+        return np.where(mask)[0]
+
+
+def pack_sweep(data_dir, store_file, file_prefix='', upper_resp_threshold=30, dt=.1*ms, compression=4,
+               copy_trials=True):
+    """
+    Pack the trial files of a sweep into one HDF5 file with an index of all trials. Trials already in the store are
+    skipped (unless their file has changed) so a store can be updated as a sweep runs.
+    data_dir = directory containing trial files
+    store_file = store to write (appended to if it exists)
+    file_prefix = only pack trial files starting with this prefix
+    upper_resp_threshold = response threshold used for trials without a saved response time
+    dt = firing rate time step used for trials without a saved time step
+    compression = gzip compression level of trial arrays
+    copy_trials = copy trial data into the store if true, otherwise only index the trial files
+    """
+    start_time=time()
+    f=h5py.File(store_file, 'a')
+    if not 'index' in f:
+        f_index=f.create_group('index')
+        if copy_trials:
+            f.create_group('trials')
+        f.attrs['upper_resp_threshold']=upper_resp_threshold
+        str_type=h5py.special_dtype(vlen=str)
+        for name in ['name', 'prefix']:
+            f_index.create_dataset(name, (0,), dtype=str_type, maxshape=(None,), chunks=(1024,))
+        f_index.create_dataset('trial', (0,), dtype=int, maxshape=(None,), chunks=(1024,))
+        f_index.create_dataset('choice', (0,), dtype=int, maxshape=(None,), chunks=(1024,))
+        f_index.create_dataset('truncated', (0,), dtype=int, maxshape=(None,), chunks=(1024,))
+        for name in ['contrast', 'rt', 'bold_max', 'bold_exc_max', 'mtime']+index_params:
+            f_index.create_dataset(name, (0,), dtype=float, maxshape=(None,), chunks=(1024,))
+    elif copy_trials!=('trials' in f):
+        f.close()
+        raise ValueError('%s is %s' % (store_file, 'an index only' if copy_trials else 'a store with trial data'))
+    f_index=f['index']
+    # Stores written before file modification times were indexed are updated with every trial file
+    if not 'mtime' in f_index:
+        f_index.create_dataset('mtime', (f_index['name'].shape[0],), dtype=float, maxshape=(None,), chunks=(1024,),
+            fillvalue=float('NaN'))
+    # Trials indexed before truncated trials were recorded are not known to be complete
+    if not 'truncated' in f_index:
+        f_index.create_dataset('truncated', (f_index['name'].shape[0],), dtype=int, maxshape=(None,), chunks=(1024,),
+            fillvalue=-1)
+    packed=dict([(name, (row, mtime)) for row,(name, mtime) in enumerate(zip(f_index['name'][:],
+                                                                              f_index['mtime'][:]))])
+
+    num_packed=0
+    num_updated=0
+    try:
+        for file_name in sorted(os.listdir(data_dir)):
+            if not file_name.startswith(file_prefix):
+                continue
+            parsed=parse_trial_file_name(file_name)
+            if parsed is None:
+                continue
+            mtime=os.path.getmtime(os.path.join(data_dir, file_name))
+            # Only read files that are new or have been rewritten
+            row_idx=None
+            if file_name in packed:
+                row_idx,packed_mtime=packed[file_name]
+                if mtime<=packed_mtime:
+                    continue
+            prefix,contrast,trial,params=parsed
+            try:
+                f_trial=h5py.File(os.path.join(data_dir, file_name), 'r')
+                row=read_trial_summary(f_trial, upper_resp_threshold=upper_resp_threshold, dt=dt)
+                if copy_trials:
+                    if file_name in f['trials']:
+                        del f['trials'][file_name]
+                    copy_group(f_trial, f['trials'].create_group(file_name), compression=compression)
+                f_trial.close()
+            except Exception as e:
+                print('cannot pack file %s: %s' % (file_name, str(e)))
+                if copy_trials and file_name in f['trials']:
+                    del f['trials'][file_name]
+                continue
+            row.update(params)
+            row['name']=file_name
+            row['prefix']=prefix
+            row['contrast']=contrast
+            row['trial']=trial
+            row['mtime']=mtime
+            if row_idx is None:
+                write_index_row(f_index, f_index['name'].shape[0], row)
+                num_packed+=1
+            else:
+                write_index_row(f_index, row_idx, row)
+                num_updated+=1
+    finally:
+        f.close()
+    print('Added %d and updated %d trials in %s: %.2fs' % (num_packed, num_updated, store_file, time()-start_time))
+
+def update_index(data_dir, index_file, file_prefix='', upper_resp_threshold=30, dt=.1*ms):
+    """
+    Add new or changed trial files of a sweep to a trial index (which can be opened with SweepStore)
+    data_dir = directory containing trial files
+    index_file = index to write (appended to if it exists)
+    file_prefix = only index trial files starting with this prefix
+    upper_resp_threshold = response threshold used for trials without a saved response time
+    dt = firing rate time step used for trials without a saved time step
+    """
+    pack_sweep(data_dir, index_file, file_prefix=file_prefix, upper_resp_threshold=upper_resp_threshold, dt=dt,
+        copy_trials=False)
+
+def write_index_row(f_index, row_idx, row):
+    """
+    Write a trial to the index, adding a row if needed - columns missing from the row are filled with NaN (-1 for
+    integer columns)
+    """
+    num_rows=f_index['name'].shape[0]
+    for field in array_fields:
+        if field in row and not field in f_index:
+            f_index.create_dataset(field, (num_rows, len(row[field])), dtype=float, maxshape=(None, None),
+                chunks=(1024, len(row[field])), fillvalue=float('NaN'))
+    for name in f_index:
+        dataset=f_index[name]
+        if row_idx>=dataset.shape[0]:
+            dataset.resize(row_idx+1, axis=0)
+        if len(dataset.shape)>1:
+            values=row.get(name, [])
+            if len(values)>dataset.shape[1]:
+                dataset.resize(len(values), axis=1)
+            padded=np.zeros(dataset.shape[1])*float('NaN')
+            padded[:len(values)]=values
+            dataset[row_idx,:]=padded
+        elif name in row:
+            dataset[row_idx]=row[name]
+        elif dataset.dtype.kind=='i':
+            dataset[row_idx]=-1
+        elif dataset.dtype.kind=='f':
+            dataset[row_idx]=float('NaN')
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Pack or index the trial files of a sweep in one HDF5 file')
+    ap.add_argument('--data_dir', type=str, required=True, help='Directory containing trial files')
+    ap.add_argument('--store_file', type=str, required=True, help='Store to write (appended to if it exists)')
+    ap.add_argument('--file_prefix', type=str, default='', help='Only pack trial files starting with this prefix')
+    ap.add_argument('--upper_resp_threshold', type=float, default=30,
+        help='Response threshold for trials without a saved response time')
+    ap.add_argument('--compression', type=int, default=4, help='gzip compression level')
+    ap.add_argument('--index_only', action='store_true', default=False,
+        help='Only index the trial files instead of copying their data into the store')
+
+    argvals = ap.parse_args()
+
+    pack_sweep(argvals.data_dir, argvals.store_file, file_prefix=argvals.file_prefix,
+        upper_resp_threshold=argvals.upper_resp_threshold, compression=argvals.compression,
+        copy_trials=not argvals.index_only)
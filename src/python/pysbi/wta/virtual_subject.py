@@ -30,7 +30,7 @@ def generate_virtual_subject(subj_id, behavioral_param_file):
 
 class VirtualSubject:
     def __init__(self, subj_id, wta_params=default_params(), pyr_params=pyr_params(), inh_params=inh_params(),
-                 plasticity_params=plasticity_params(), sim_params=simulation_params()):
+                 plasticity_params=plasticity_params(), sim_params=simulation_params(), stop_on_decision=False):
         self.subj_id = subj_id
         self.wta_params = wta_params
         self.pyr_params = pyr_params
@@ -58,49 +58,85 @@ class VirtualSubject:
         self.wta_monitor = WTAMonitor(self.wta_network, None, None, self.sim_params, record_lfp=False,
                                       record_voxel=False, record_neuron_state=False, record_spikes=False,
                                       record_firing_rate=True, record_inputs=True, record_connections=None,
-                                      save_summary_only=False, clock=self.simulation_clock)
+                                      save_summary_only=False, clock=self.simulation_clock,
+                                      stop_on_decision=stop_on_decision)
 
 
-        # Create Brian network and reset clock
-        self.net = Network(self.background_input, self.task_inputs, self.wta_network,
-            self.wta_network.connections.values(), self.wta_monitor.monitors.values())
-
-
-    def run_trial(self, sim_params, input_freq):
-        self.wta_monitor.sim_params=sim_params
-        self.net.reinit(states=False)
+        # Parameters of the current trial - read by the network operations below, which are created once and stay in
+        # the network for the lifetime of the subject
+        self.trial_sim_params = self.sim_params
+        self.input_freq = np.zeros(self.wta_params.num_groups)
+        self.dcs_on = False
 
         @network_operation(when='start', clock=self.input_update_clock)
         def set_task_inputs():
             for idx in range(len(self.task_inputs)):
                 rate = self.wta_params.task_input_resting_rate
-                if sim_params.stim_start_time <= self.simulation_clock.t < sim_params.stim_end_time:
-                    rate = input_freq[idx] * Hz + np.random.randn() * self.wta_params.input_var
+                if self.trial_sim_params.stim_start_time <= self.simulation_clock.t < self.trial_sim_params.stim_end_time:
+                    rate = self.input_freq[idx] * Hz + np.random.randn() * self.wta_params.input_var
                     if rate < self.wta_params.task_input_resting_rate:
                         rate = self.wta_params.task_input_resting_rate
                 self.task_inputs[idx]._S[0, :] = rate
 
         @network_operation(clock=self.simulation_clock)
         def inject_current():
-            if sim_params.dcs_start_time < self.simulation_clock.t <= sim_params.dcs_end_time:
-                self.wta_network.group_e.I_dcs = sim_params.p_dcs
-                self.wta_network.group_i.I_dcs = sim_params.i_dcs
-            else:
-                self.wta_network.group_e.I_dcs = 0 * pA
-                self.wta_network.group_i.I_dcs = 0 * pA
+            # Only touch the network state when stimulation switches on or off
+            dcs_on = self.trial_sim_params.dcs_start_time < self.simulation_clock.t <= self.trial_sim_params.dcs_end_time
+            if dcs_on != self.dcs_on:
+                self.set_dcs(dcs_on)
 
-        @network_operation(when='start', clock=self.simulation_clock)
-        def inject_muscimol():
-            if sim_params.muscimol_amount > 0:
-                self.wta_network.groups_e[sim_params.injection_site].g_muscimol = sim_params.muscimol_amount
+        self.set_task_inputs = set_task_inputs
+        self.inject_current = inject_current
 
-        self.net.remove(set_task_inputs, inject_current, inject_muscimol, self.wta_network.stdp.values())
+        # Create Brian network and reset clock
+        self.net = Network(self.background_input, self.task_inputs, self.wta_network,
+            self.wta_network.connections.values(), self.wta_monitor.monitors.values(), set_task_inputs, inject_current)
+        self.plasticity = False
+
+    def set_dcs(self, dcs_on):
+        """
+        Switch stimulation on or off
+        dcs_on = whether or not stimulation is applied
+        """
+        self.dcs_on = dcs_on
+        if dcs_on:
+            self.wta_network.group_e.I_dcs = self.trial_sim_params.p_dcs
+            self.wta_network.group_i.I_dcs = self.trial_sim_params.i_dcs
+        else:
+            self.wta_network.group_e.I_dcs = 0 * pA
+            self.wta_network.group_i.I_dcs = 0 * pA
+
+    def reset_trial(self, sim_params, input_freq):
+        """
+        Reset the network for a new trial in place - only the trial parameters read by the network operations change,
+        the network itself is not modified
+        sim_params = simulation parameters for the trial
+        input_freq = mean firing rate of each input group
+        """
+        self.wta_monitor.sim_params = sim_params
+        if 'decision' in self.wta_monitor.monitors:
+            self.wta_monitor.monitors['decision'].sim_params = sim_params
+        self.trial_sim_params = sim_params
+        self.input_freq[:] = input_freq
+        self.net.reinit(states=False)
 
-        self.net.add(set_task_inputs, inject_current, inject_muscimol)
-        if sim_params.plasticity:
-            self.net.add(self.wta_network.stdp.values())
+        # Stimulation state at the start of the trial
+        self.set_dcs(sim_params.dcs_start_time < 0 * second <= sim_params.dcs_end_time)
 
-        self.net.run(sim_params.trial_duration, report='text')
+        # Muscimol is constant over the trial, so it only needs to be set once
+        for idx, group_e in enumerate(self.wta_network.groups_e):
+            group_e.g_muscimol = 0 * nS
+            if sim_params.muscimol_amount > 0 and idx == sim_params.injection_site:
+                group_e.g_muscimol = sim_params.muscimol_amount
 
-        #self.wta_monitor.plot()
-        self.net.remove(set_task_inputs, inject_current, inject_muscimol, self.wta_network.stdp.values())
+        # Only add or remove STDP when plasticity is switched on or off
+        if sim_params.plasticity != self.plasticity:
+            if sim_params.plasticity:
+                self.net.add(self.wta_network.stdp.values())
+            else:
+                self.net.remove(self.wta_network.stdp.values())
+            self.plasticity = sim_params.plasticity
+
+    def run_trial(self, sim_params, input_freq):
+        self.reset_trial(sim_params, input_freq)
+        self.net.run(sim_params.trial_duration, report='text')
@@ -0,0 +1,98 @@
+import argparse
+import os
+from multiprocessing import Process
+from time import time
+
+def warmup_wta(compile_cache_dir=None):
+    """
+    Compile the WTA network, LFP source, voxel, and STDP code by running a small network for a few time steps
+    compile_cache_dir = root directory of the shared compile cache
+    """
+    from brian import ms, pA
+    import numpy as np
+    from pysbi.util.compile_cache import use_compile_cache
+    from pysbi.wta.network import default_params, simulation_params, run_wta
+
+    if compile_cache_dir is not None:
+        use_compile_cache(compile_cache_dir)
+
+    # The generated code does not depend on the network size
+    wta_params=default_params(network_group_size=200, background_input_size=200)
+    wta_params.task_input_size=int(wta_params.network_group_size*.8*wta_params.f)
+
+    sim_params=simulation_params(trial_duration=10*ms, stim_start_time=0*ms, stim_end_time=10*ms, p_dcs=0.5*pA,
+        i_dcs=-0.25*pA, dcs_start_time=0*ms, dcs_end_time=10*ms, plasticity=True)
+
+    run_wta(wta_params, np.array([40.0, 0.0]), sim_params, record_voxel=False, record_inputs=True, report=None)
+
+def warmup_neglect(compile_cache_dir=None):
+    """
+    Compile the neglect model code by running a small network for a few time steps
+    compile_cache_dir = root directory of the shared compile cache
+    """
+    from brian import ms, PoissonGroup, Network, Hz, defaultclock
+    from pysbi.util.compile_cache import use_compile_cache, CompileCacheMonitor
+    # Sets the neglect model's preferences
+    from pysbi.neglect.run import default_params
+    from pysbi.neglect.network import BrainNetworkGroup
+    from pysbi.voxel import LFPSource, Voxel
+
+    if compile_cache_dir is not None:
+        use_compile_cache(compile_cache_dir)
+
+    background_inputs=[PoissonGroup(100, rates=25*Hz), PoissonGroup(100, rates=25*Hz)]
+    visual_cortex_inputs=[PoissonGroup(100, rates=5*Hz), PoissonGroup(100, rates=5*Hz)]
+    go_input=PoissonGroup(100, rates=20*Hz)
+    brain_network=BrainNetworkGroup(250, params=default_params, background_inputs=background_inputs,
+        visual_cortex_input=visual_cortex_inputs, go_input=go_input)
+    lfp_source=LFPSource(brain_network.left_lip.e_group)
+    voxel=Voxel(defaultclock, network=brain_network.left_lip.neuron_group)
+
+    net=Network(background_inputs, visual_cortex_inputs, go_input, brain_network, lfp_source, voxel,
+        brain_network.connections)
+    compile_monitor=CompileCacheMonitor()
+    try:
+        net.run(10*ms)
+    finally:
+        compile_monitor.close()
+    print compile_monitor.report()
+
+# Models that can be warmed up
+models={
+    'wta': warmup_wta,
+    'neglect': warmup_neglect
+}
+
+def warmup(compile_cache_dir, model_names=None):
+    """
+    Pre-compile model code into a shared compile cache. Each model is compiled in its own process so that it is
+    compiled with its own Brian preferences.
+    compile_cache_dir = root directory of the shared compile cache
+    model_names = names of models to compile (all if None)
+    """
+    if model_names is None:
+        model_names=sorted(models.keys())
+    for model_name in model_names:
+        start_time=time()
+        print 'Compiling %s model' % model_name
+        process=Process(target=models[model_name], args=(compile_cache_dir,))
+        process.start()
+        process.join()
+        if process.exitcode:
+            print 'Compiling %s model failed' % model_name
+        else:
+            print 'Compiled %s model: %.2fs' % (model_name, time()-start_time)
+
+if __name__=='__main__':
+    ap = argparse.ArgumentParser(description='Pre-compile model code into a shared compile cache')
+    ap.add_argument('--compile_cache_dir', type=str, default=os.environ.get('PYSBI_COMPILE_CACHE', None),
+        help='Root directory of the compile cache (defaults to $PYSBI_COMPILE_CACHE)')
+    ap.add_argument('--models', type=str, nargs='+', default=None, choices=sorted(models.keys()),
+        help='Models to compile')
+
+    argvals = ap.parse_args()
+
+    if argvals.compile_cache_dir is None:
+        ap.error('No compile cache directory given')
+
+    warmup(argvals.compile_cache_dir, model_names=argvals.models)